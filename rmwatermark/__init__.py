@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+rmwatermark - watermark removal core shared by the GUI and batch tools.
+
+Importing this package is cheap: torch and LaMa are only loaded on demand
+(see rmwatermark.model).
+"""
+
+from .model import LAMA_AVAILABLE, get_model, start_warmup, model_status
+from .engine import JobResult, LogoSettings, RemovalSettings, WatermarkEngine
+from .batch import BatchItem, BatchSummary, run_batch
+from .files import list_images, read_image, write_image
+
+__all__ = [
+    "LAMA_AVAILABLE",
+    "get_model",
+    "start_warmup",
+    "model_status",
+    "JobResult",
+    "LogoSettings",
+    "RemovalSettings",
+    "WatermarkEngine",
+    "BatchItem",
+    "BatchSummary",
+    "run_batch",
+    "list_images",
+    "read_image",
+    "write_image",
+]
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+"""
+Inpainting backends and automatic backend selection.
+
+Every backend fills the masked pixels of a job's context crop and returns
+the crop-sized RGB result. Built in:
+
+    lama      big-lama deep model (best quality, needs torch)
+    lama-fast big-lama on a downscaled crop plus detail transfer (faster)
+    opencv    cv2.inpaint Navier-Stokes (the classic fallback)
+    telea     cv2.inpaint Telea fast marching
+    pyramid   multi-scale Navier-Stokes (inpaint.pyramid_inpaint)
+
+Third-party backends subclass Backend (usually just inpaint_region) and
+call register_backend(). Each backend has a relative quality score and a
+cost model - a fixed cost plus a per-unit cost (model pixels for LaMa,
+masked pixels x radius^2 for cv2.inpaint) that is re-fitted from the
+timings actually observed. select_backend() ranks the backends for a job
+by RemovalSettings.preference ("quality", "balanced" or "speed") within
+RemovalSettings.max_latency_ms, unless RemovalSettings.backend names one.
+"""
+
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .inpaint import opencv_inpaint, pyramid_inpaint, transfer_detail
+from .lama_batch import PAD_MODULO, lama_inpaint_batch
+from .metrics import TILED_INPAINT
+from .model import LAMA_AVAILABLE
+from .tiling import (LAMA_BYTES_PER_PIXEL, OPENCV_BYTES_PER_PIXEL, needs_tiling, tile_size_for_budget,
+                     tiled_inpaint)
+
+BACKEND_AUTO = "auto"
+BACKEND_LAMA = "lama"
+BACKEND_LAMA_FAST = "lama-fast"
+BACKEND_OPENCV = "opencv"
+BACKEND_TELEA = "telea"
+BACKEND_PYRAMID = "pyramid"
+
+# Used when the selected backend fails
+FALLBACK_BACKEND = BACKEND_OPENCV
+
+PREFERENCES = ("quality", "balanced", "speed")
+
+# "balanced": quality points given up per 10x more estimated time
+BALANCE_POINTS_PER_DECADE = 15
+
+# Weight of a new observation in the per-unit cost estimate
+COST_SMOOTHING = 0.2
+
+# lama-fast: model input side relative to the crop; crops smaller than
+# FAST_MIN_SIDE (after scaling) are not worth it and run as plain lama
+FAST_SCALE = 0.5
+FAST_MIN_SIDE = 64
+
+log = logging.getLogger(__name__)
+
+
+class CostModel:
+    """estimate(units) = fixed_ms + ms_per_unit * units, ms_per_unit re-fitted from observations"""
+
+    def __init__(self, fixed_ms, ms_per_unit):
+        self.fixed_ms = fixed_ms
+        self.ms_per_unit = ms_per_unit
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def estimate(self, units):
+        return self.fixed_ms + self.ms_per_unit * units
+
+    def observe(self, units, ms):
+        if units <= 0:
+            return
+        rate = max(0.0, ms - self.fixed_ms) / units
+        with self._lock:
+            self.ms_per_unit += COST_SMOOTHING * (rate - self.ms_per_unit)
+            self.observations += 1
+
+
+class Backend:
+    """Base class: inpaint the mask's bounding box (plus context) of the crop, tiled if needed"""
+
+    name = None
+    quality = 0                     # relative output quality, 0-100
+    bytes_per_pixel = OPENCV_BYTES_PER_PIXEL
+
+    def __init__(self, cost):
+        self.cost = cost
+
+    def available(self, engine, settings):
+        return True
+
+    def work(self, job):
+        """Units of work for the cost model (default: masked pixels x radius^2)"""
+        return np.count_nonzero(job.mask) * job.settings.inpaint_radius ** 2
+
+    def estimate_ms(self, job):
+        return self.cost.estimate(self.work(job))
+
+    def resolve(self, job):
+        """The backend that actually runs for job: self, unless this one hands it to another"""
+        return self
+
+    def inpaint_region(self, image, mask, settings):
+        """RGB result for image (a view - don't write to it) with mask's pixels filled"""
+        raise NotImplementedError
+
+    def inpaint(self, engine, job):
+        """Crop-sized RGB result for job"""
+        settings = job.settings
+        crop_x1, crop_y1, crop_x2, crop_y2 = job.crop
+        crop_img = job.image[crop_y1:crop_y2, crop_x1:crop_x2]
+
+        # Only the mask's bounding box plus the radius the algorithm can reach
+        h, w = job.mask.shape[:2]
+        mx, my, mw, mh = cv2.boundingRect(job.mask)
+        margin = settings.inpaint_radius * 2
+        bounds = (max(0, mx - margin), max(0, my - margin), min(w, mx + mw + margin), min(h, my + mh + margin))
+        bx1, by1, bx2, by2 = bounds
+
+        def run(img, msk):
+            return self.inpaint_region(img, msk, settings)
+
+        if needs_tiling(bounds, settings.tile_memory_mb, self.bytes_per_pixel):
+            region_result, _ = tiled(engine, settings, crop_img, job.mask, bounds, run, self.bytes_per_pixel)
+        else:
+            region_result = run(crop_img[by1:by2, bx1:bx2], job.mask[by1:by2, bx1:bx2])
+
+        result = crop_img.copy()
+        result[by1:by2, bx1:bx2] = region_result
+        return result
+
+
+class OpenCVBackend(Backend):
+    def __init__(self, name, method, quality, cost):
+        super().__init__(cost)
+        self.name = name
+        self.method = method
+        self.quality = quality
+
+    def inpaint_region(self, image, mask, settings):
+        return opencv_inpaint(image, mask, settings.inpaint_radius, self.method)
+
+
+class PyramidBackend(Backend):
+    name = BACKEND_PYRAMID
+    quality = 45    # same result as NS at full resolution, plus the coarse levels
+
+    def inpaint_region(self, image, mask, settings):
+        return pyramid_inpaint(image, mask, settings.inpaint_radius)
+
+
+class LamaBackend(Backend):
+    """big-lama on the whole crop (bucket-padded), batched through engine.inpainter if set"""
+
+    name = BACKEND_LAMA
+    quality = 90
+    bytes_per_pixel = LAMA_BYTES_PER_PIXEL
+
+    def available(self, engine, settings):
+        # Blocks until the warm-up thread has loaded the model
+        return settings.use_lama and LAMA_AVAILABLE and engine.model_provider() is not None
+
+    def work(self, job):
+        crop_x1, crop_y1, crop_x2, crop_y2 = job.crop
+        pad_bottom, pad_right = job.crop_pad
+        return (crop_y2 - crop_y1 + pad_bottom) * (crop_x2 - crop_x1 + pad_right)
+
+    def inpaint(self, engine, job):
+        simple_lama = engine.model_provider()
+        crop_x1, crop_y1, crop_x2, crop_y2 = job.crop
+        log.debug("📦 Crop region: (%d,%d) to (%d,%d)", crop_x1, crop_y1, crop_x2, crop_y2)
+
+        # A view - the model input tensors are built from it, the image is not written to
+        with engine.metrics.span("crop"):
+            crop_img = job.image[crop_y1:crop_y2, crop_x1:crop_x2]
+            crop_mask = job.mask
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("📐 Crop size: %s, Mask white pixels: %d", crop_img.shape, np.count_nonzero(crop_mask))
+
+        def run_lama(img, msk):
+            return self.run_model(engine, simple_lama, img, msk)
+
+        log.debug("⏳ Running LaMa inpainting...")
+        if needs_tiling(job.crop, job.settings.tile_memory_mb, LAMA_BYTES_PER_PIXEL):
+            # Too big for the memory budget - overlapping tiles
+            result_crop, tile = tiled(engine, job.settings, crop_img, crop_mask, None, run_lama,
+                                      LAMA_BYTES_PER_PIXEL)
+            job.model_shape = (tile, tile)
+        else:
+            # Image smaller than the bucket - reflect-pad bottom/right, sliced off below
+            pad_bottom, pad_right = job.crop_pad
+            model_img, model_mask = crop_img, crop_mask
+            if pad_bottom or pad_right:
+                model_img = np.pad(crop_img, ((0, pad_bottom), (0, pad_right), (0, 0)), mode='reflect')
+                model_mask = np.pad(crop_mask, ((0, pad_bottom), (0, pad_right)), mode='reflect')
+
+            result_crop = run_lama(model_img, model_mask)
+            result_crop = result_crop[:crop_img.shape[0], :crop_img.shape[1]]
+            job.model_shape = model_img.shape[:2]
+        log.debug("✅ LaMa done! Result shape: %s", result_crop.shape)
+
+        # Handle size mismatch
+        if result_crop.shape[:2] != crop_img.shape[:2]:
+            result_crop = cv2.resize(result_crop, (crop_img.shape[1], crop_img.shape[0]))
+        return result_crop
+
+    @staticmethod
+    def run_model(engine, simple_lama, image, mask):
+        # Batched with other callers if an inpainter is set
+        if engine.inpainter is not None:
+            return engine.inpainter.inpaint(image, mask)
+        return lama_inpaint_batch(simple_lama, [image], [mask])[0]
+
+
+class LamaFastBackend(LamaBackend):
+    """
+    big-lama on the crop downscaled by `scale`: the fill is upsampled and the
+    texture lost to downscaling is transferred in from the unmasked context
+    """
+
+    name = BACKEND_LAMA_FAST
+    quality = 75
+
+    def __init__(self, cost, scale=FAST_SCALE):
+        super().__init__(cost)
+        self.scale = scale
+
+    def work(self, job):
+        return super().work(job) * self.scale ** 2
+
+    def estimate_ms(self, job):
+        backend = self.resolve(job)
+        return backend.estimate_ms(job) if backend is not self else super().estimate_ms(job)
+
+    def resolve(self, job):
+        # Too small to downscale - full resolution, reported and costed as lama
+        crop_x1, crop_y1, crop_x2, crop_y2 = job.crop
+        if min(crop_y2 - crop_y1, crop_x2 - crop_x1) * self.scale < FAST_MIN_SIDE:
+            return get_backend(BACKEND_LAMA)
+        return self
+
+    def _model_size(self, height, width):
+        """Downscaled (height, width), multiples of PAD_MODULO"""
+        return tuple(max(PAD_MODULO, int(round(side * self.scale)) // PAD_MODULO * PAD_MODULO)
+                     for side in (height, width))
+
+    def inpaint(self, engine, job):
+        crop_x1, crop_y1, crop_x2, crop_y2 = job.crop
+        crop_img = job.image[crop_y1:crop_y2, crop_x1:crop_x2]
+        h, w = crop_img.shape[:2]
+        if self.resolve(job) is not self:
+            return super().inpaint(engine, job)
+
+        simple_lama = engine.model_provider()
+        settings = job.settings
+        # Same bucket padding as full resolution, so bucketed crops keep one model shape
+        pad_bottom, pad_right = job.crop_pad
+        model_img, model_mask = crop_img, job.mask
+        if pad_bottom or pad_right:
+            model_img = np.pad(crop_img, ((0, pad_bottom), (0, pad_right), (0, 0)), mode='reflect')
+            model_mask = np.pad(job.mask, ((0, pad_bottom), (0, pad_right)), mode='reflect')
+        full_h, full_w = model_img.shape[:2]
+        small_h, small_w = self._model_size(full_h, full_w)
+
+        with engine.metrics.span("crop"):
+            small_img = cv2.resize(model_img, (small_w, small_h), interpolation=cv2.INTER_AREA)
+            # Any coverage counts, so the fill reaches every masked full-resolution pixel
+            small_mask = (cv2.resize(model_mask, (small_w, small_h), interpolation=cv2.INTER_AREA) > 0)
+            small_mask = small_mask.astype(np.uint8) * 255
+
+        def run_lama(img, msk):
+            return self.run_model(engine, simple_lama, img, msk)
+
+        log.debug("⏳ Running LaMa at %dx%d for a %dx%d crop...", small_w, small_h, w, h)
+        if needs_tiling((0, 0, small_w, small_h), settings.tile_memory_mb, LAMA_BYTES_PER_PIXEL):
+            small_result, tile = tiled(engine, settings, small_img, small_mask, None, run_lama,
+                                       LAMA_BYTES_PER_PIXEL)
+            job.model_shape = (tile, tile)
+        else:
+            small_result = run_lama(small_img, small_mask)
+            job.model_shape = (small_h, small_w)
+
+        fill = cv2.resize(small_result, (full_w, full_h), interpolation=cv2.INTER_CUBIC)[:h, :w]
+        low = cv2.resize(small_img, (full_w, full_h), interpolation=cv2.INTER_CUBIC)[:h, :w]
+        return transfer_detail(crop_img, job.mask, fill, low)
+
+
+def tiled(engine, settings, image, mask, bounds, inpaint_fn, bytes_per_pixel):
+    """Inpaint bounds of image (None = all) in memory-bounded tiles. Returns (region result, tile size)"""
+    if bounds is None:
+        bounds = (0, 0, image.shape[1], image.shape[0])
+    workers = max(1, settings.tile_workers)
+    engine.metrics.count(TILED_INPAINT)
+    tile = tile_size_for_budget(settings.tile_memory_mb, bytes_per_pixel, workers)
+
+    if workers == 1:
+        result = tiled_inpaint(image, mask, bounds, inpaint_fn, tile, settings.tile_overlap)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            result = tiled_inpaint(image, mask, bounds, inpaint_fn, tile, settings.tile_overlap,
+                                   map_fn=pool.map)
+    return result, tile
+
+
+_registry = {}
+
+
+def register_backend(backend):
+    """Add (or replace) a backend; it takes part in automatic selection from now on"""
+    _registry[backend.name] = backend
+    return backend
+
+
+def get_backend(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise ValueError(f"Unknown inpainting backend: {name} (expected one of {', '.join(_registry)})")
+
+
+def backend_names():
+    return tuple(_registry)
+
+
+def _rank_key(backend, estimate_ms, preference):
+    if preference == "speed":
+        return (-estimate_ms, backend.quality)
+    if preference == "balanced":
+        return (backend.quality - BALANCE_POINTS_PER_DECADE * math.log10(max(1.0, estimate_ms)), -estimate_ms)
+    return (backend.quality, -estimate_ms)
+
+
+def select_backend(engine, job):
+    """The backend to run for job, following the job's settings (resolved, see Backend.resolve)"""
+    settings = job.settings
+    if settings.backend != BACKEND_AUTO:
+        backend = get_backend(settings.backend)
+        if backend.available(engine, settings):
+            return backend.resolve(job)
+        log.debug("Backend %s not available, selecting automatically", settings.backend)
+
+    candidates = [b for b in _registry.values() if settings.use_lama or not isinstance(b, LamaBackend)]
+    estimates = {b.name: b.estimate_ms(job) for b in candidates}
+    preference = settings.preference
+    if settings.max_latency_ms is not None:
+        fast_enough = [b for b in candidates if estimates[b.name] <= settings.max_latency_ms]
+        if fast_enough:
+            candidates = fast_enough
+        else:
+            # Nothing fits the budget - get as close as possible
+            preference = "speed"
+
+    ranked = sorted(candidates, key=lambda b: _rank_key(b, estimates[b.name], preference), reverse=True)
+    # Availability last: checking LaMa may wait for the model to load
+    for backend in ranked:
+        if backend.available(engine, settings):
+            log.debug("🧠 Backend %s (estimated %.0f ms)", backend.name, estimates[backend.name])
+            return backend.resolve(job)
+    return get_backend(FALLBACK_BACKEND)
+
+
+# Priors measured on a desktop CPU; refined by CostModel.observe as jobs run
+register_backend(LamaBackend(CostModel(fixed_ms=30.0, ms_per_unit=4e-3)))
+register_backend(LamaFastBackend(CostModel(fixed_ms=35.0, ms_per_unit=4e-3)))
+register_backend(OpenCVBackend(BACKEND_OPENCV, cv2.INPAINT_NS, 50, CostModel(fixed_ms=3.0, ms_per_unit=5e-5)))
+register_backend(OpenCVBackend(BACKEND_TELEA, cv2.INPAINT_TELEA, 40, CostModel(fixed_ms=3.0, ms_per_unit=5.2e-5)))
+register_backend(PyramidBackend(CostModel(fixed_ms=8.0, ms_per_unit=6e-5)))
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Batch processing shared by the GUI ("Hàng Loạt" button) and the CLI.
+"""
+
+import logging
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .detect_cache import DetectionCache
+from .engine import JobResult, WatermarkEngine
+from .files import read_image, write_image
+from .jpeg_patch import changed_rows, write_output
+from .lama_batch import BatchingInpainter
+from .metrics import IMAGE_ERRORS
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchItem:
+    """Outcome of one image in a batch run"""
+    index: int
+    path: str
+    output_path: str
+    ok: bool
+    error: Optional[str] = None
+    image: Optional[np.ndarray] = None    # decoded input (RGB)
+    result: Optional[JobResult] = None
+    write_mode: Optional[str] = None      # jpeg_patch.MODE_* when jpeg_patch is on
+    seconds: Optional[float] = None       # decode to written, wall time
+
+
+@dataclass
+class BatchSummary:
+    total: int
+    success: int = 0
+    failed: List[str] = field(default_factory=list)
+    seconds: float = 0.0
+    stage_stats: Dict[str, dict] = field(default_factory=dict)  # pipeline mode only
+    model_shapes: Counter = field(default_factory=Counter)       # (h, w) fed to LaMa -> count
+    detection_hits: int = 0     # detection cache verified the previous box
+    detection_misses: int = 0   # full detection had to run
+    write_modes: Counter = field(default_factory=Counter)        # jpeg_patch mode -> count
+    backends: Counter = field(default_factory=Counter)           # inpainting backend -> count
+    skipped: int = 0            # resume: already done in an earlier run, not in total
+
+    def add(self, item):
+        """Count one finished BatchItem"""
+        if item.ok:
+            self.success += 1
+            if item.write_mode:
+                self.write_modes[item.write_mode] += 1
+            if item.result is not None and item.result.backend:
+                self.backends[item.result.backend] += 1
+            if item.result is not None and item.result.model_shape:
+                self.model_shapes[tuple(item.result.model_shape)] += 1
+            if item.result is not None and item.result.cache_hit is not None:
+                if item.result.cache_hit:
+                    self.detection_hits += 1
+                else:
+                    self.detection_misses += 1
+        else:
+            self.failed.append(item.path)
+
+
+def write_result(output_path, image, source_path, before=None, rows=None, jpeg_patch=False):
+    """
+    Write a result image. With jpeg_patch, JPEG sources keep their compressed
+    blocks outside the changed rows (given, or diffed against `before`).
+    Returns the jpeg_patch write mode, or None without jpeg_patch.
+    """
+    if not jpeg_patch:
+        write_image(output_path, image)
+        return None
+    if rows is None:
+        rows = changed_rows(before, image)
+    return write_output(output_path, image, source_path, rows)
+
+
+def process_file(engine, index, image_path, output_folder, settings, jpeg_patch=False):
+    """Process a single file and write the result; never raises"""
+    output_path = str(Path(output_folder) / Path(image_path).name)
+    start = time.perf_counter()
+    try:
+        with engine.metrics.span("decode"):
+            image = read_image(image_path)
+        if image is None:
+            raise IOError(f"Cannot read image: {image_path}")
+
+        result = engine.process(image, settings)
+        with engine.metrics.span("encode"):
+            mode = write_result(output_path, result.image, image_path, before=image, jpeg_patch=jpeg_patch)
+        return BatchItem(index, image_path, output_path, True, image=image, result=result, write_mode=mode,
+                         seconds=time.perf_counter() - start)
+
+    except Exception as e:
+        engine.metrics.count(IMAGE_ERRORS)
+        log.error("Error: %s: %s", image_path, e)
+        return BatchItem(index, image_path, output_path, False, error=str(e), seconds=time.perf_counter() - start)
+
+
+def run_batch(image_files, output_folder, settings, engine=None, on_progress=None,
+              workers=1, torch_threads=None, lama_batch_size=1, lama_max_wait=0.05,
+              stage_threads=None, detect_cache=True, jpeg_patch=False, resume=False):
+    """
+    Process image_files in order, writing results into output_folder.
+    on_progress(done, total, item) is called after every image.
+    With workers > 1 the work is spread over a process pool (see parallel.py).
+    Stage timings and counters go to engine.metrics (see metrics.py), worker
+    processes included.
+    With stage_threads (dict stage -> threads) it runs as a streaming
+    pipeline with overlapped I/O and inference (see pipeline.py).
+    With lama_batch_size > 1, that many images are processed concurrently and
+    their LaMa crops share batched forward passes (see lama_batch.py).
+    With detect_cache, auto-mode detection is reused across images of the
+    same resolution after a cheap verification (see detect_cache.py).
+    With jpeg_patch, JPEG outputs re-encode only the changed blocks of the
+    source (see jpeg_patch.py).
+    With resume, every outcome is recorded in a manifest in output_folder and
+    inputs already done with the same settings are skipped (see manifest.py);
+    item.index still refers to image_files.
+    """
+    if resume:
+        return _run_resumable(image_files, output_folder, settings, engine=engine, on_progress=on_progress,
+                              workers=workers, torch_threads=torch_threads, lama_batch_size=lama_batch_size,
+                              lama_max_wait=lama_max_wait, stage_threads=stage_threads,
+                              detect_cache=detect_cache, jpeg_patch=jpeg_patch)
+
+    if workers > 1 and len(image_files) > 1:
+        from .parallel import run_batch_parallel
+        return run_batch_parallel(image_files, output_folder, settings, workers,
+                                  torch_threads=torch_threads, on_progress=on_progress,
+                                  lama_batch_size=lama_batch_size, lama_max_wait=lama_max_wait,
+                                  detect_cache=detect_cache, jpeg_patch=jpeg_patch,
+                                  metrics=engine.metrics if engine is not None else None)
+
+    if stage_threads is not None:
+        from .pipeline import run_pipeline
+        return run_pipeline(image_files, output_folder, settings, engine=engine, on_progress=on_progress,
+                            stage_threads=stage_threads,
+                            lama_batch_size=lama_batch_size, lama_max_wait=lama_max_wait,
+                            detect_cache=detect_cache, jpeg_patch=jpeg_patch)
+
+    engine = engine or WatermarkEngine()
+    if detect_cache and settings.auto_mode:
+        engine = engine.clone(detection_cache=DetectionCache())
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+
+    summary = BatchSummary(total=len(image_files))
+    start = time.perf_counter()
+
+    def report(item):
+        summary.add(item)
+        if on_progress:
+            on_progress(item.index + 1, summary.total, item)
+
+    if lama_batch_size > 1 and settings.use_lama:
+        inpainter = BatchingInpainter(engine.model_provider, lama_batch_size, lama_max_wait)
+        batch_engine = engine.clone(inpainter=inpainter)
+        try:
+            with ThreadPoolExecutor(max_workers=lama_batch_size) as pool:
+                # Sliding window keeps at most 2 batches of decoded images alive
+                pending = deque()
+                for i, image_path in enumerate(image_files):
+                    pending.append(pool.submit(process_file, batch_engine, i, image_path, output_folder, settings,
+                                               jpeg_patch))
+                    if len(pending) >= lama_batch_size * 2:
+                        report(pending.popleft().result())
+                while pending:
+                    report(pending.popleft().result())
+        finally:
+            inpainter.close()
+    else:
+        for i, image_path in enumerate(image_files):
+            report(process_file(engine, i, image_path, output_folder, settings, jpeg_patch))
+
+    summary.seconds = time.perf_counter() - start
+    return summary
+
+
+def _run_resumable(image_files, output_folder, settings, on_progress=None, **options):
+    """run_batch over the inputs the manifest doesn't have as done"""
+    from . import model as lama_model
+    from .manifest import Manifest
+
+    cpu_options = lama_model.cpu_options()
+    manifest = Manifest(output_folder, settings, options.get("jpeg_patch", False),
+                        cpu_options.precision if cpu_options is not None else None)
+    try:
+        todo = manifest.pending(image_files)
+        skipped = len(image_files) - len(todo)
+        if skipped:
+            log.info("⏭️ Resume: %d already done, %d to process", skipped, len(todo))
+
+        def on_item(done, total, item):
+            # Map back from the todo list to image_files
+            item.index = todo[item.index]
+            manifest.record(item)
+            if on_progress:
+                on_progress(done, total, item)
+
+        summary = run_batch([image_files[i] for i in todo], output_folder, settings,
+                            on_progress=on_item, **options)
+    finally:
+        manifest.close()
+    summary.skipped = skipped
+    return summary
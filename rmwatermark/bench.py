@@ -0,0 +1,509 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible benchmark of the removal pipeline.
+
+    python -m rmwatermark.bench -o bench.json
+    python -m rmwatermark.bench --sizes 1920x1080,4000x3000 --images 5 --compare baseline.json
+    python -m rmwatermark.bench --current new.json --compare baseline.json
+
+Synthetic images (seeded textures) are generated at each resolution and
+stamped with a known watermark - white 'MI VIETNAM.VN' style text or the
+bundled logo.jpg - in the top-left corner, then written as JPEG. Each
+stage is timed on its own: decode, detect (and template detection on the
+logo images), mask, stroke mask refinement, crop, LaMa inference (a
+stub network by default, so no weights are needed) at full resolution
+and in the lama-fast tier (crops large enough for it only), OpenCV
+inference, paste, overlay (logo.jpg), encode and JPEG patching, plus the
+end-to-end time per image. A few extra images per size carry a large
+text watermark, so lama and lama-fast are always compared on some crops.
+The report is JSON: images/sec, per-stage percentiles, detection and
+template accuracy against the known boxes, the share of the box mask the
+stroke masks keep, fill PSNR against the clean image per backend, lama vs
+lama-fast latency and PSNR on the same crops, and peak RSS.
+--compare flags stages that got slower than a stored baseline and exits
+with status 1 if any did.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from . import model as lama_model
+from .backends import BACKEND_LAMA_FAST, get_backend
+from .engine import BACKEND_LAMA, BACKEND_OPENCV, LogoSettings, RemovalSettings, WatermarkEngine
+from .files import read_image, write_image
+from .jpeg_patch import changed_rows, patch_jpeg
+from .lama_batch import lama_inpaint_batch
+from .logo import prepare_logo, premultiply, stamp
+from .metrics import peak_rss_bytes
+from .strokes import refine_mask
+from .template_match import TemplateDetector
+
+DEFAULT_SIZES = ((640, 480), (1280, 720), (1920, 1080))
+DEFAULT_IMAGES = 4
+DEFAULT_SEED = 1234
+
+# Text size (times stamp_text's usual) of the extra watermarks that compare lama with lama-fast
+FAST_TIER_TEXT_SIZE = 4.0
+
+# Relative slowdown (p50) that counts as a regression, and an absolute noise floor
+DEFAULT_THRESHOLD = 0.10
+NOISE_FLOOR_MS = 0.5
+
+BUNDLED_LOGO = Path(__file__).resolve().parent.parent / "logo.jpg"
+
+STAGES = ("decode", "detect", "detect_template", "mask", "strokes", "crop", "infer_lama", "infer_lama_fast",
+          "infer_opencv", "paste", "overlay", "encode", "encode_patch", "total")
+
+
+def _peak_rss_mb():
+    rss = peak_rss_bytes()
+    return round(rss / (1024 * 1024), 1) if rss else None
+
+
+def parse_sizes(text):
+    """'1920x1080,4000x3000' -> ((1920, 1080), (4000, 3000))"""
+    sizes = []
+    for part in text.split(','):
+        w, _, h = part.strip().lower().partition('x')
+        sizes.append((int(w), int(h)))
+    return tuple(sizes)
+
+
+def synthetic_image(width, height, rng):
+    """Photo-like RGB texture: smooth gradient, blurred noise and a few shapes"""
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        120 + 80 * np.sin(xx / width * np.pi * rng.uniform(0.5, 2) + rng.uniform(0, 6)),
+        110 + 70 * np.cos(yy / height * np.pi * rng.uniform(0.5, 2) + rng.uniform(0, 6)),
+        100 + 60 * np.sin((xx + yy) / (width + height) * np.pi * rng.uniform(1, 3)),
+    ], axis=2)
+    noise = rng.normal(0, 25, (height // 8 + 1, width // 8 + 1, 3)).astype(np.float32)
+    base += cv2.resize(noise, (width, height), interpolation=cv2.INTER_CUBIC)
+    image = np.clip(base, 0, 255).astype(np.uint8)
+
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        cx, cy = int(rng.integers(0, width)), int(rng.integers(0, height))
+        r = int(rng.integers(width // 40 + 1, width // 8 + 2))
+        if rng.random() < 0.5:
+            cv2.circle(image, (cx, cy), r, color, -1)
+        else:
+            cv2.rectangle(image, (cx, cy), (cx + r, cy + r // 2), color, -1)
+    return cv2.GaussianBlur(image, (0, 0), 1.2)
+
+
+def stamp_text(image, text="MI VIETNAM.VN", size=1.0):
+    """White text watermark in the top-left corner, `size` times the usual. Returns its box (x, y, w, h)"""
+    h, w = image.shape[:2]
+    scale = w / 1400 * size
+    thickness = max(1, int(round(scale * 2)))
+    (tw, th), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, thickness)
+    x, y = int(w * 0.02), int(h * 0.02) + th
+    cv2.putText(image, text, (x + 2, y + 2), cv2.FONT_HERSHEY_SIMPLEX, scale, (40, 40, 40), thickness, cv2.LINE_AA)
+    cv2.putText(image, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, scale, (255, 255, 255), thickness, cv2.LINE_AA)
+    return (x, y - th, tw + 2, th + baseline + 2)
+
+
+def stamp_logo(image, logo_path, scale=0.2, opacity=0.85):
+    """The bundled logo as a watermark in the top-left corner. Returns its box"""
+    h, w = image.shape[:2]
+    logo = prepare_logo(str(logo_path), True, 0, int(w * scale), opacity)
+    prepared = premultiply(logo)
+    x, y = int(w * 0.02), int(h * 0.02)
+    stamp(image, prepared, x, y)
+    lw, lh = prepared.size
+    return (x, y, lw, lh)
+
+
+def _iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+class StubLama:
+    """
+    SimpleLama stand-in with the same call interface: a small random-weight
+    conv net on top of a normalized-convolution fill (the known pixels,
+    blurred at the finest scale that reaches into the mask). The fill keeps
+    the detail the input resolution allows, so fill PSNR tells the full and
+    downscaled tiers apart; the conv net only adds a little texture.
+    """
+
+    def __init__(self):
+        import torch
+        import torch.nn.functional as F
+
+        torch.manual_seed(0)
+        self.device = torch.device("cpu")
+
+        class Net(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.body = torch.nn.Sequential(
+                    torch.nn.Conv2d(4, 16, 3, padding=1), torch.nn.ReLU(),
+                    torch.nn.Conv2d(16, 16, 3, padding=1), torch.nn.ReLU(),
+                    torch.nn.Conv2d(16, 3, 3, padding=1), torch.nn.Sigmoid(),
+                )
+
+            def forward(self, image, mask):
+                known = 1 - mask
+                size = image.shape[-2:]
+                fill = torch.zeros_like(image)
+                filled = torch.zeros_like(mask)
+                # Coarser scales only where the finer ones had no known pixel in reach
+                for factor in (1, 4, 16, 64):
+                    num, den = image * known, known
+                    if factor > 1:
+                        num = F.avg_pool2d(num, factor, ceil_mode=True)
+                        den = F.avg_pool2d(den, factor, ceil_mode=True)
+                    num = F.avg_pool2d(num, 9, stride=1, padding=4)
+                    den = F.avg_pool2d(den, 9, stride=1, padding=4)
+                    if factor > 1:
+                        num = F.interpolate(num, size=size, mode="bilinear", align_corners=False)
+                        den = F.interpolate(den, size=size, mode="bilinear", align_corners=False)
+                    take = (den > 1e-3).float() * (1 - filled)
+                    fill = fill + take * num / den.clamp(min=1e-3)
+                    filled = filled + take
+                texture = self.body(torch.cat([image, mask], dim=1)) - 0.5
+                return (image * known + (fill + 0.05 * texture) * mask).clamp(0, 1)
+
+        self.model = Net().eval()
+
+
+def _load_lama(kind):
+    """(model, description) for --lama stub|real|none; (None, "none") if unavailable"""
+    if kind == "real" and lama_model.LAMA_AVAILABLE:
+        lama_model.start_warmup()
+        return lama_model.get_model(), "big-lama"
+    if kind == "stub" and importlib.util.find_spec("torch") is not None:
+        return StubLama(), "stub-conv"
+    return None, "none"
+
+
+def _percentiles(samples_ms):
+    a = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "n": int(a.size),
+        "mean_ms": round(float(a.mean()), 3),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p90_ms": round(float(np.percentile(a, 90)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+        "max_ms": round(float(a.max()), 3),
+    }
+
+
+class _Timer:
+    def __init__(self):
+        self.samples = {}
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        t0 = time.perf_counter()
+        yield
+        self.samples.setdefault(stage, []).append((time.perf_counter() - t0) * 1000)
+
+
+def _fill_psnr(clean, result, mask):
+    """PSNR (dB) of result against the clean image over the masked pixels"""
+    diff = clean[mask > 0].astype(np.float64) - result[mask > 0]
+    mse = float(np.mean(diff ** 2)) if diff.size else 0.0
+    return 10 * np.log10(255 ** 2 / mse) if mse else 100.0
+
+
+def bench_size(width, height, n_images, workdir, lama, seed, warmup=1, logo_path=BUNDLED_LOGO):
+    """Benchmark one resolution. Returns its report dict"""
+    rng = np.random.default_rng([seed, width, height])
+    paths, truths, cleans = [], [], []
+    for i in range(n_images + warmup):
+        image = synthetic_image(width, height, rng)
+        cleans.append(image.copy())
+        # Alternate text and logo watermarks
+        if i % 2 == 0 or not Path(logo_path).exists():
+            truth = stamp_text(image)
+        else:
+            truth = stamp_logo(image, logo_path)
+        path = Path(workdir) / f"bench_{width}x{height}_{i}.jpg"
+        write_image(path, image)
+        paths.append(path)
+        truths.append(truth)
+
+    # The engine only calls LaMa when simple_lama is installed; the stage is timed on the model directly
+    engine = WatermarkEngine(model_provider=lambda: lama)
+    auto = RemovalSettings(auto_mode=True, use_lama=lama is not None)
+    logo = LogoSettings(str(logo_path), position="bottom-right") if Path(logo_path).exists() else None
+
+    # Logo images are also searched for by template (see template_match.py)
+    template = TemplateDetector(str(logo_path)) if Path(logo_path).exists() else None
+
+    timer = _Timer()
+    detected_ok = 0
+    template_ok = template_total = 0
+    stroke_ratios = []
+    psnr = {BACKEND_LAMA: [], BACKEND_LAMA_FAST: [], BACKEND_OPENCV: []}
+    fast_backend = get_backend(BACKEND_LAMA_FAST)
+    fast_pairs = []   # (lama ms, lama-fast ms, lama dB, lama-fast dB) on crops the fast tier ran on
+    for i, (path, truth, clean) in enumerate(zip(paths, truths, cleans)):
+        if i == warmup:
+            timer = _Timer()  # drop warm-up samples
+        t = timer
+        with t("decode"):
+            image = read_image(path)
+        with t("detect"):
+            found, box = engine.detect_watermark_bounds(image)
+        if i >= warmup and found and _iou(box, truth) >= 0.5:
+            detected_ok += 1
+        if template is not None and i % 2:
+            with t("detect_template"):
+                detection = template.detect(image)
+            if i >= warmup:
+                template_total += 1
+                template_ok += detection.found and _iou(detection.box, truth) >= 0.5
+
+        manual = replace(auto, auto_mode=False, region=box if found else truth, use_lama=False)
+        with t("mask"):
+            job = engine.prepare(image, manual)
+        if found:
+            with t("strokes"):
+                x1, y1, x2, y2 = job.crop
+                strokes = refine_mask(image[y1:y2, x1:x2], (box[0] - x1, box[1] - y1, box[2], box[3]))
+            if i >= warmup:
+                box_pixels = np.count_nonzero(job.mask)
+                stroke_ratios.append(np.count_nonzero(strokes) / box_pixels if strokes is not None else 1.0)
+        with t("crop"):
+            x1, y1, x2, y2 = job.crop
+            crop = image[y1:y2, x1:x2]
+            crop_mask = job.mask
+        with t("infer_opencv"):
+            engine.inpaint(job)
+        if i >= warmup:
+            psnr[BACKEND_OPENCV].append(_fill_psnr(clean[y1:y2, x1:x2], job.inpainted, crop_mask))
+        if lama is not None:
+            # Crops too small for the fast tier would just run lama twice
+            engaged = fast_backend.resolve(job) is fast_backend
+            if engaged:
+                with t("infer_lama_fast"):
+                    fast = fast_backend.inpaint(engine, job)
+            with t("infer_lama"):
+                job.inpainted = lama_inpaint_batch(lama, [crop], [crop_mask])[0]
+            job.backend = BACKEND_LAMA
+            if i >= warmup:
+                psnr[BACKEND_LAMA].append(_fill_psnr(clean[y1:y2, x1:x2], job.inpainted, crop_mask))
+                if engaged:
+                    psnr[BACKEND_LAMA_FAST].append(_fill_psnr(clean[y1:y2, x1:x2], fast, crop_mask))
+                    fast_pairs.append((t.samples["infer_lama"][-1], t.samples["infer_lama_fast"][-1],
+                                       psnr[BACKEND_LAMA][-1], psnr[BACKEND_LAMA_FAST][-1]))
+        with t("paste"):
+            result = engine.compose(job)
+        if logo is not None:
+            with t("overlay"):
+                engine.apply_logo(result.image, logo, inplace=True)
+        with t("encode"):
+            cv2.imencode(".jpg", cv2.cvtColor(result.image, cv2.COLOR_RGB2BGR))
+        with t("encode_patch"):
+            patch_jpeg(path.read_bytes(), result.image, changed_rows(image, result.image))
+
+        with t("total"):
+            full = read_image(path)
+            out = engine.process(full, replace(auto, logo=logo))
+            cv2.imencode(".jpg", cv2.cvtColor(out.image, cv2.COLOR_RGB2BGR))
+
+    if lama is not None:
+        fast_pairs += _fast_tier_cases(width, height, n_images, lama, rng, engine, fast_backend)
+
+    stages = {stage: _percentiles(timer.samples[stage]) for stage in STAGES if stage in timer.samples}
+    total_s = sum(timer.samples["total"]) / 1000
+    return {
+        "width": width,
+        "height": height,
+        "images": n_images,
+        "images_per_sec": round(n_images / total_s, 3) if total_s else None,
+        "detect_accuracy": round(detected_ok / n_images, 3) if n_images else None,
+        "template_accuracy": round(template_ok / template_total, 3) if template_total else None,
+        "stroke_mask_ratio": round(float(np.mean(stroke_ratios)), 3) if stroke_ratios else None,
+        "fill_psnr_db": {tier: round(float(np.mean(v)), 2) for tier, v in psnr.items() if v},
+        "fast_tier": _fast_tier_summary(fast_pairs),
+        "stages": stages,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _fast_tier_cases(width, height, n_images, lama, rng, engine, fast_backend):
+    """
+    lama vs lama-fast on large text watermarks, whose crops are big enough for
+    the fast tier at every size. Returns (lama ms, lama-fast ms, lama dB, lama-fast dB) per crop
+    """
+    pairs = []
+    for _ in range(n_images):
+        image = synthetic_image(width, height, rng)
+        clean = image.copy()
+        truth = stamp_text(image, size=FAST_TIER_TEXT_SIZE)
+        job = engine.prepare(image, RemovalSettings(auto_mode=False, region=truth, use_lama=False))
+        if fast_backend.resolve(job) is not fast_backend:
+            continue
+        x1, y1, x2, y2 = job.crop
+        t0 = time.perf_counter()
+        fast = fast_backend.inpaint(engine, job)
+        t1 = time.perf_counter()
+        full = lama_inpaint_batch(lama, [image[y1:y2, x1:x2]], [job.mask])[0]
+        t2 = time.perf_counter()
+        pairs.append(((t2 - t1) * 1000, (t1 - t0) * 1000, _fill_psnr(clean[y1:y2, x1:x2], full, job.mask),
+                      _fill_psnr(clean[y1:y2, x1:x2], fast, job.mask)))
+    return pairs
+
+
+def _fast_tier_summary(pairs):
+    """p50 latency and mean fill PSNR of lama and lama-fast over the same crops, or None"""
+    if not pairs:
+        return None
+    lama_ms, fast_ms, lama_db, fast_db = (np.asarray(v, dtype=np.float64) for v in zip(*pairs))
+    return {
+        "crops": len(pairs),
+        "lama_p50_ms": round(float(np.median(lama_ms)), 3),
+        "lama_fast_p50_ms": round(float(np.median(fast_ms)), 3),
+        "lama_psnr_db": round(float(lama_db.mean()), 2),
+        "lama_fast_psnr_db": round(float(fast_db.mean()), 2),
+    }
+
+
+def run(sizes=DEFAULT_SIZES, n_images=DEFAULT_IMAGES, lama="stub", seed=DEFAULT_SEED, warmup=1):
+    """Run the whole suite. Returns the JSON-able report"""
+    model, model_name = _load_lama(lama)
+    workdir = tempfile.mkdtemp(prefix="rmwatermark-bench-")
+    try:
+        results = {}
+        for width, height in sizes:
+            print(f"⏱️ {width}x{height}: {n_images} images...", file=sys.stderr)
+            results[f"{width}x{height}"] = bench_size(width, height, n_images, workdir, model, seed, warmup)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    torch_version = None
+    if model is not None:
+        import torch
+        torch_version = torch.__version__
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "torch": torch_version,
+        },
+        "config": {"sizes": [f"{w}x{h}" for w, h in sizes], "images": n_images, "seed": seed,
+                   "warmup": warmup, "lama": model_name},
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Regressions of current vs baseline: list of dicts (size, metric, baseline, current, change).
+    A stage regresses when its p50 grew by more than threshold (and NOISE_FLOOR_MS);
+    throughput regresses when images/sec dropped by more than threshold.
+    """
+    regressions = []
+    for size, cur in current["results"].items():
+        base = baseline.get("results", {}).get(size)
+        if base is None:
+            continue
+        for stage, stats in cur["stages"].items():
+            old = base["stages"].get(stage)
+            if old is None or not old["p50_ms"]:
+                continue
+            change = stats["p50_ms"] / old["p50_ms"] - 1
+            if change > threshold and stats["p50_ms"] - old["p50_ms"] > NOISE_FLOOR_MS:
+                regressions.append({"size": size, "metric": f"{stage}.p50_ms", "baseline": old["p50_ms"],
+                                    "current": stats["p50_ms"], "change": round(change, 3)})
+        if base.get("images_per_sec") and cur.get("images_per_sec"):
+            change = cur["images_per_sec"] / base["images_per_sec"] - 1
+            if change < -threshold:
+                regressions.append({"size": size, "metric": "images_per_sec", "baseline": base["images_per_sec"],
+                                    "current": cur["images_per_sec"], "change": round(change, 3)})
+    return regressions
+
+
+def format_report(report):
+    """Human readable summary of a report"""
+    lines = []
+    for size, res in report["results"].items():
+        template = ""
+        if res.get("template_accuracy") is not None:
+            template = f", template accuracy {res['template_accuracy']}"
+        lines.append(f"📊 {size}: {res['images_per_sec']} img/s, detect accuracy {res['detect_accuracy']}{template}, "
+                     f"peak RSS {res['peak_rss_mb']} MB")
+        if res.get("stroke_mask_ratio") is not None:
+            lines.append(f"   stroke masks    {res['stroke_mask_ratio']:.0%} of the box mask")
+        if res.get("fill_psnr_db"):
+            psnr = ", ".join(f"{tier} {db} dB" for tier, db in res["fill_psnr_db"].items())
+            lines.append(f"   fill PSNR       {psnr}")
+        fast = res.get("fast_tier")
+        if fast:
+            lines.append(f"   lama-fast       {fast['crops']} crops: {fast['lama_fast_p50_ms']:.2f} ms vs "
+                         f"{fast['lama_p50_ms']:.2f} ms, {fast['lama_fast_psnr_db']} dB vs {fast['lama_psnr_db']} dB")
+        for stage, st in res["stages"].items():
+            lines.append(f"   {stage:<15} p50 {st['p50_ms']:>9.2f} ms   p90 {st['p90_ms']:>9.2f} ms")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m rmwatermark.bench",
+                                     description="Benchmark the watermark removal pipeline.")
+    parser.add_argument("--sizes", type=parse_sizes, default=DEFAULT_SIZES, metavar="WxH,...",
+                        help="resolutions (default: 640x480,1280x720,1920x1080)")
+    parser.add_argument("--images", type=int, default=DEFAULT_IMAGES, help="timed images per size (default: 4)")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed images per size (default: 1)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--lama", choices=("stub", "real", "none"), default="stub",
+                        help="LaMa stage: small stub network, the real model, or skip (default: stub)")
+    parser.add_argument("-o", "--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a stored report")
+    parser.add_argument("--current", metavar="REPORT", help="compare this stored report instead of running")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown that counts as a regression (default: 0.10)")
+    args = parser.parse_args(argv)
+
+    if args.current:
+        report = json.loads(Path(args.current).read_text(encoding="utf-8"))
+    else:
+        report = run(args.sizes, args.images, args.lama, args.seed, args.warmup)
+        text = json.dumps(report, indent=2)
+        if args.output:
+            Path(args.output).write_text(text, encoding="utf-8")
+        else:
+            print(text)
+        print(format_report(report), file=sys.stderr)
+
+    if not args.compare:
+        return 0
+    baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+    regressions = compare(baseline, report, args.threshold)
+    for r in regressions:
+        print(f"❌ REGRESSION {r['size']} {r['metric']}: {r['baseline']} -> {r['current']} "
+              f"({r['change'] * 100:+.0f}%)", file=sys.stderr)
+    if not regressions:
+        print("✅ No regressions", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
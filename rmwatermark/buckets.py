@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Shape bucketing for LaMa crops.
+
+The crop fed to LaMa is the watermark box plus context, clamped to the
+image, so almost every image produces a different tensor shape. That
+defeats allocator reuse, traced graphs and batching. Here each crop side
+is rounded up to one of a few canonical sizes: first by taking more
+context from the image, and only when the image itself is too small, by
+reflect-padding the bottom/right edge. The crop origin is what compose()
+uses for the paste coordinates, and the padding is sliced off the model
+output, so results map back exactly.
+"""
+
+from collections import Counter
+
+DEFAULT_BUCKETS = (256, 384, 512, 768, 1024, 1536, 2048)
+
+
+def parse_buckets(text):
+    """'256,512,1024' -> (256, 512, 1024); 'default' -> DEFAULT_BUCKETS"""
+    if not text or text == "default":
+        return DEFAULT_BUCKETS
+    sizes = sorted({int(v) for v in text.split(',')})
+    if not sizes or sizes[0] <= 0 or any(s % 8 for s in sizes):
+        raise ValueError("bucket sizes must be positive multiples of 8")
+    return tuple(sizes)
+
+
+def bucket_side(length, buckets):
+    """Smallest bucket >= length; beyond the largest, round up to a multiple of it / 4"""
+    for size in buckets:
+        if length <= size:
+            return size
+    step = max(8, buckets[-1] // 4)
+    return -(-length // step) * step
+
+
+def _grow(start, end, target, limit):
+    """Grow [start, end) to target length inside [0, limit). Returns (start, end, pad)"""
+    if target >= limit:
+        # Whole image side is not enough - take all of it and pad the rest
+        return 0, limit, target - limit
+
+    extra = target - (end - start)
+    start -= extra // 2
+    end = start + target
+    if start < 0:
+        end -= start
+        start = 0
+    if end > limit:
+        start -= end - limit
+        end = limit
+    return start, end, 0
+
+
+def fit_to_bucket(crop, image_shape, buckets):
+    """
+    Grow crop (x1, y1, x2, y2) so its padded size is a bucket.
+    Returns: (new_crop, (pad_bottom, pad_right), (bucket_h, bucket_w))
+    """
+    x1, y1, x2, y2 = crop
+    h, w = image_shape[:2]
+
+    bucket_h = bucket_side(y2 - y1, buckets)
+    bucket_w = bucket_side(x2 - x1, buckets)
+
+    y1, y2, pad_bottom = _grow(y1, y2, bucket_h, h)
+    x1, x2, pad_right = _grow(x1, x2, bucket_w, w)
+
+    return (x1, y1, x2, y2), (pad_bottom, pad_right), (bucket_h, bucket_w)
+
+
+def snap_crop(crop, image_shape, modulo=8):
+    """Grow crop (x1, y1, x2, y2) so both sides are multiples of modulo (or the whole image side)"""
+    x1, y1, x2, y2 = crop
+    h, w = image_shape[:2]
+    y1, y2, _ = _grow(y1, y2, -(-(y2 - y1) // modulo) * modulo, h)
+    x1, x2, _ = _grow(x1, x2, -(-(x2 - x1) // modulo) * modulo, w)
+    return (x1, y1, x2, y2)
+
+
+def shape_report(model_shapes):
+    """
+    Summarize the shapes fed to LaMa (Counter of (h, w)).
+    A 'hit' is a crop whose shape had already been seen in the run.
+    """
+    crops = sum(model_shapes.values())
+    distinct = len(model_shapes)
+    return {
+        "crops": crops,
+        "distinct_shapes": distinct,
+        "hit_rate": round((crops - distinct) / crops, 3) if crops else 0.0,
+        "top": [(f"{h}x{w}", n) for (h, w), n in Counter(model_shapes).most_common(5)],
+    }
+
+
+def format_shape_report(report):
+    if not report["crops"]:
+        return ""
+    top = ", ".join(f"{shape}: {n}" for shape, n in report["top"])
+    return (f"📐 LaMa crops: {report['crops']}, distinct shapes: {report['distinct_shapes']}, "
+            f"bucket hit rate: {report['hit_rate'] * 100:.0f}% ({top})")
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Command line batch processing - no Tk, no X server needed.
+
+    python -m rmwatermark input/ -o output/
+    python -m rmwatermark input/ --region 0,0,400,80 --logo logo.png --logo-position bottom-right
+    python -m rmwatermark input/ -q --metrics-json run.json --metrics-port 9108
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from . import model as lama_model
+from .batch import run_batch
+from .buckets import DEFAULT_BUCKETS, format_shape_report, parse_buckets, shape_report
+from .backends import BACKEND_AUTO, PREFERENCES, backend_names
+from .engine import LOGO_POSITIONS, LogoSettings, RemovalSettings, WatermarkEngine
+from .files import list_images
+from .lama_cpu import PRECISIONS, CpuOptions
+from .metrics import CROP_PIXELS, LOG_LEVELS, MASK_BOX_PIXELS, MASK_PIXELS, Metrics, serve_prometheus, setup_logging
+from .pipeline import format_stage_stats, parse_stage_threads
+
+
+def _parse_region(text):
+    try:
+        x, y, w, h = (int(v) for v in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("region must be X,Y,W,H")
+    if w <= 0 or h <= 0:
+        raise argparse.ArgumentTypeError("region width/height must be positive")
+    return (x, y, w, h)
+
+
+def _parse_bounds(text):
+    try:
+        low, high = (int(v) for v in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("bounds must be MIN,MAX")
+    if not 0 <= low <= high:
+        raise argparse.ArgumentTypeError("bounds must satisfy 0 <= MIN <= MAX")
+    return (low, high)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m rmwatermark",
+        description="Remove watermarks from every image in a folder (same options as the GUI)."
+    )
+    parser.add_argument("inputs", nargs="+", help="input folder(s) and/or image files")
+    parser.add_argument("-o", "--output", default="output", help="output folder (default: output)")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="worker processes, each with its own warm LaMa model (default: 1)")
+    parser.add_argument("--torch-threads", type=int,
+                        help="torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="overlap decode/detect/inpaint/compose/encode in a streaming pipeline")
+    parser.add_argument("--stage-threads", metavar="STAGE=N,...",
+                        help="pipeline threads per stage, e.g. decode=2,encode=3 (implies --pipeline; "
+                             "stages: decode, prepare, infer, post, encode)")
+    parser.add_argument("--lama-batch", type=int, default=1,
+                        help="LaMa crops per forward pass, 1 = no batching (default: 1)")
+    parser.add_argument("--lama-max-wait", type=float, default=50,
+                        help="max ms to wait for a LaMa batch to fill up (default: 50)")
+    parser.add_argument("--lama-cpu", action="store_true",
+                        help="run LaMa as a frozen channels-last graph tuned for CPU inference")
+    parser.add_argument("--lama-precision", choices=PRECISIONS,
+                        help="LaMa CPU precision, bf16 is faster on CPUs with bf16 support but changes "
+                             "the output slightly (implies --lama-cpu, default: fp32)")
+    parser.add_argument("--interop-threads", type=int,
+                        help="torch inter-op threads per worker (implies --lama-cpu)")
+    parser.add_argument("--resume", action="store_true",
+                        help="record progress in a manifest in the output folder and skip inputs already "
+                             "done with the same settings (failed or changed ones are redone)")
+    parser.add_argument("--jpeg-patch", action="store_true",
+                        help="for JPEG inputs, keep the original compressed blocks outside the changed "
+                             "area and re-encode only the rest with the source quantization tables; only "
+                             "sources with restart markers can be patched - most camera and web JPEGs have "
+                             "none and are re-encoded whole (with markers, so the outputs can be patched)")
+
+    output = parser.add_argument_group("logging and metrics")
+    output.add_argument("--log-level", choices=LOG_LEVELS, default="info",
+                        help="debug shows every step of every image (default: info)")
+    output.add_argument("-q", "--quiet", action="store_const", const="warning", dest="log_level",
+                        help="only warnings, errors and the final summary")
+    output.add_argument("--metrics-json", metavar="FILE", help="write per-stage timings and counters as JSON")
+    output.add_argument("--metrics-csv", metavar="FILE", help="write per-stage timings and counters as CSV")
+    output.add_argument("--metrics-port", type=int, metavar="PORT",
+                        help="serve live metrics in Prometheus text format at http://127.0.0.1:PORT/metrics")
+    output.add_argument("--metrics-memory", action="store_true",
+                        help="also record peak allocations per stage (tracemalloc, slower)")
+
+    removal = parser.add_argument_group("watermark removal")
+    removal.add_argument("--region", type=_parse_region, metavar="X,Y,W,H",
+                         help="manual region to remove (default: auto-detect the watermark in the corners "
+                              "and the centre band)")
+    removal.add_argument("--radius", type=int, default=20,
+                         help="OpenCV inpaint radius, 1-30 (default: 20)")
+    removal.add_argument("--no-lama", action="store_true",
+                         help="use OpenCV inpainting only (never loads torch)")
+    removal.add_argument("--backend", choices=(BACKEND_AUTO,) + backend_names(), default=BACKEND_AUTO,
+                         help="inpainting backend; auto picks one per image by --prefer and --max-latency "
+                              "(default: auto)")
+    removal.add_argument("--prefer", choices=PREFERENCES, default="quality",
+                         help="what auto backend selection optimizes for (default: quality)")
+    removal.add_argument("--max-latency", type=float, metavar="MS",
+                         help="auto selection: skip backends estimated to take longer per image")
+    removal.add_argument("--context-pad", type=int, metavar="PX",
+                         help="fixed context margin around the region (default: adaptive, from the region's "
+                              "size and the surrounding texture)")
+    removal.add_argument("--context-bounds", type=_parse_bounds, default=(32, 256), metavar="MIN,MAX",
+                         help="adaptive context margin limits in px (default: 32,256)")
+    removal.add_argument("--template", metavar="IMAGE",
+                         help="image of the watermark (e.g. a logo) to search for first, at any size and "
+                              "position; falls back to text detection where it isn't found")
+    removal.add_argument("--box-mask", action="store_true",
+                         help="inpaint the whole detected box instead of only the watermark's strokes inside it")
+    removal.add_argument("--no-detect-cache", action="store_true",
+                         help="run full watermark detection on every image instead of verifying "
+                              "the previous image's box first")
+    removal.add_argument("--tile-memory", type=int, metavar="MB",
+                         help="peak memory budget per inpainting call; larger areas are split "
+                              "into overlapping, feathered tiles")
+    removal.add_argument("--tile-overlap", type=int, default=64, help="tile overlap in px (default: 64)")
+    removal.add_argument("--tile-workers", type=int, default=1, help="tiles inpainted in parallel (default: 1)")
+    removal.add_argument("--buckets", nargs="?", const="default", metavar="SIZES",
+                         help="round LaMa crops up to canonical sizes; optional comma list "
+                              f"(default set: {','.join(map(str, DEFAULT_BUCKETS))})")
+
+    logo = parser.add_argument_group("new watermark")
+    logo.add_argument("--logo", help="logo image to stamp onto the result")
+    logo.add_argument("--logo-position", choices=LOGO_POSITIONS, default="top-left")
+    logo.add_argument("--logo-scale", type=int, default=5, help="logo width, %% of image width (default: 5)")
+    logo.add_argument("--logo-opacity", type=int, default=51, help="logo opacity %% (default: 51)")
+    logo.add_argument("--logo-tiled", action="store_true", help="repeat the logo over the whole image")
+    logo.add_argument("--keep-logo-bg", action="store_true", help="do not make white logo pixels transparent")
+    logo.add_argument("--logo-angle", type=int, default=0, help="logo rotation in degrees")
+    return parser
+
+
+def settings_from_args(args, parser):
+    logo = None
+    if args.logo:
+        logo = LogoSettings(
+            path=args.logo,
+            position=args.logo_position,
+            scale=args.logo_scale,
+            opacity=args.logo_opacity,
+            tiled=args.logo_tiled,
+            remove_bg=not args.keep_logo_bg,
+            angle=args.logo_angle,
+        )
+    buckets = None
+    if args.buckets:
+        try:
+            buckets = parse_buckets(args.buckets)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.template and args.region:
+        parser.error("--template only applies to auto-detection, not with --region")
+    try:
+        return RemovalSettings(
+            auto_mode=args.region is None,
+            region=args.region,
+            inpaint_radius=args.radius,
+            use_lama=not args.no_lama,
+            logo=logo,
+            crop_buckets=buckets,
+            tile_memory_mb=args.tile_memory,
+            tile_overlap=args.tile_overlap,
+            tile_workers=args.tile_workers,
+            backend=args.backend,
+            preference=args.prefer,
+            max_latency_ms=args.max_latency,
+            context_pad=args.context_pad,
+            context_bounds=args.context_bounds,
+            template=args.template,
+            stroke_mask=not args.box_mask,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+
+def collect_inputs(inputs):
+    image_files = []
+    for item in inputs:
+        if Path(item).is_dir():
+            image_files.extend(list_images(item))
+        else:
+            image_files.append(item)
+    return image_files
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    settings = settings_from_args(args, parser)
+    log = setup_logging(args.log_level)
+
+    image_files = collect_inputs(args.inputs)
+    if not image_files:
+        print("No images found")
+        return 1
+
+    metrics = Metrics(track_memory=args.metrics_memory)
+    if args.metrics_port:
+        serve_prometheus(metrics, args.metrics_port)
+        log.info("📈 Metrics at http://127.0.0.1:%d/metrics", args.metrics_port)
+
+    def on_progress(done, total, item):
+        status = "✅" if item.ok else "❌"
+        backend = f" ({item.result.backend})" if item.result is not None else ""
+        log.info("%s [%d/%d] %s%s", status, done, total, item.path, backend)
+
+    stage_threads = None
+    if args.pipeline or args.stage_threads:
+        try:
+            stage_threads = parse_stage_threads(args.stage_threads)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.lama_cpu or args.lama_precision or args.interop_threads:
+        lama_model.set_cpu_options(CpuOptions(precision=args.lama_precision or "fp32",
+                                              interop_threads=args.interop_threads))
+
+    summary = run_batch(image_files, args.output, settings, engine=WatermarkEngine(metrics=metrics),
+                        on_progress=on_progress,
+                        workers=args.workers, torch_threads=args.torch_threads,
+                        lama_batch_size=args.lama_batch, lama_max_wait=args.lama_max_wait / 1000.0,
+                        stage_threads=stage_threads, detect_cache=not args.no_detect_cache,
+                        jpeg_patch=args.jpeg_patch, resume=args.resume)
+    print(f"✅ Done: {summary.success}/{summary.total} images in {summary.seconds:.1f}s -> {args.output}")
+    if summary.skipped:
+        print(f"⏭️ Skipped {summary.skipped} images already done in an earlier run")
+    if summary.stage_stats:
+        print(format_stage_stats(summary.stage_stats))
+    if summary.detection_hits or summary.detection_misses:
+        print(f"♻️ Detection cache: {summary.detection_hits} hits, {summary.detection_misses} misses")
+    if summary.model_shapes:
+        print(format_shape_report(shape_report(summary.model_shapes)))
+    if metrics.counter(MASK_BOX_PIXELS) > metrics.counter(MASK_PIXELS):
+        box_pixels = metrics.counter(MASK_BOX_PIXELS)
+        print(f"🎭 Stroke masks: {metrics.counter(MASK_PIXELS) / 1e6:.2f} MP masked instead of "
+              f"{box_pixels / 1e6:.2f} MP of boxes (-{100 * (1 - metrics.counter(MASK_PIXELS) / box_pixels):.0f}%)")
+    if metrics.counter(MASK_PIXELS):
+        crop_pixels = metrics.counter(CROP_PIXELS)
+        print(f"📦 Context crops: {crop_pixels / 1e6:.1f} MP sent to the inpainter, "
+              f"{crop_pixels / metrics.counter(MASK_PIXELS):.1f}x the masked area")
+    if summary.backends:
+        print("🧠 Backends: " + ", ".join(f"{n} {name}" for name, n in summary.backends.most_common()))
+    if summary.write_modes:
+        print("🧱 JPEG output: " + ", ".join(f"{n} {mode}" for mode, n in sorted(summary.write_modes.items())))
+    if log.isEnabledFor(logging.INFO):
+        print(metrics.format())
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+    if args.metrics_csv:
+        metrics.write_csv(args.metrics_csv)
+    return 0 if not summary.failed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive context margin around the watermark box.
+
+The crop sent to the inpainter is the box plus a margin of real image on
+every side. A fixed margin is wrong at both ends: a 20x10 mark gets a crop
+that is almost all context, a 2000 px wide selection gets too little. The
+margin here grows with the size of the box (square root of its area) and
+with how textured the surroundings are - flat sky needs little context to
+be continued, foliage or fabric needs more - and is clamped to
+RemovalSettings.context_bounds.
+"""
+
+import math
+
+import cv2
+import numpy as np
+
+# Margin as a fraction of sqrt(box area), for flat and for fully textured surroundings
+FLAT_SCALE = 0.4
+TEXTURED_SCALE = 1.0
+
+# Mean |Laplacian| (grey levels, at half resolution) that counts as fully textured
+TEXTURE_REF = 12.0
+
+# Texture is sampled on every SAMPLE_STEP-th pixel
+SAMPLE_STEP = 2
+
+
+def texture_complexity(image, box, probe):
+    """0 (flat) .. 1 (busy): mean |Laplacian| in a `probe` px ring around box (x, y, w, h)"""
+    x, y, bw, bh = box
+    h, w = image.shape[:2]
+    x1, y1 = max(0, x - probe), max(0, y - probe)
+    x2, y2 = min(w, x + bw + probe), min(h, y + bh + probe)
+
+    gray = cv2.cvtColor(image[y1:y2:SAMPLE_STEP, x1:x2:SAMPLE_STEP], cv2.COLOR_RGB2GRAY)
+    if gray.size == 0:
+        return 0.0
+    lap = np.abs(cv2.Laplacian(gray, cv2.CV_32F))
+
+    # Leave out the watermark itself
+    ring = np.ones(lap.shape, dtype=bool)
+    ring[max(0, y - y1) // SAMPLE_STEP:-(-(y + bh - y1) // SAMPLE_STEP),
+         max(0, x - x1) // SAMPLE_STEP:-(-(x + bw - x1) // SAMPLE_STEP)] = False
+    if not ring.any():
+        return 0.0
+    return min(1.0, float(lap[ring].mean()) / TEXTURE_REF)
+
+
+def context_margin(image, box, bounds):
+    """Context margin in px for box (x, y, w, h), clamped to bounds (min, max)"""
+    low, high = bounds
+    size = math.sqrt(max(1, box[2] * box[3]))
+    texture = texture_complexity(image, box, int(min(high, max(low, size * FLAT_SCALE))))
+    scale = FLAT_SCALE + (TEXTURED_SCALE - FLAT_SCALE) * texture
+    return int(min(high, max(low, round(size * scale))))
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-location watermark detection.
+
+The image is reduced once to a working copy of at most WORK_SIDE px (a
+strided read first, so huge images cost little more than small ones). On
+that copy the four corners and the centre band are scanned in one pass for
+'MI VIETNAM.VN' style text: morphological gradient, Otsu threshold per
+window, a horizontal close to join letters into words, then wide
+components grouped into lines of similar height. Each line whose edges
+stand out from the window's texture gets a confidence from how much
+denser its edges are than the ring around it and how often they alternate
+along a row (letters do, a single straight edge doesn't), weighted by a
+small prior for where watermarks usually sit. Only the winner is refined at full
+resolution, inside its own box. Kernel sizes and size limits scale with
+the resolution they run at (the hand-tuned values are for REFERENCE_SIDE).
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Long side of the working copy
+WORK_SIDE = 1200
+
+# Resolution (long side) the kernel sizes and limits below were tuned for
+REFERENCE_SIDE = 1200
+GRADIENT_KERNEL = 3
+CONNECT_KERNEL = (15, 3)
+MIN_BOX = (30, 10)
+MIN_ASPECT = 2.0
+BOX_PAD = (10, 5)
+
+# Scan windows as fractions of the image (x1, y1, x2, y2) and their prior weight
+WINDOWS = {
+    "top-left": ((0.0, 0.0, 0.4, 0.15), 1.0),
+    "top-right": ((0.6, 0.0, 1.0, 0.15), 0.9),
+    "bottom-left": ((0.0, 0.85, 0.4, 1.0), 0.9),
+    "bottom-right": ((0.6, 0.85, 1.0, 1.0), 0.9),
+    "center": ((0.2, 0.425, 0.8, 0.575), 0.8),
+}
+
+# Edge on/off transitions per box pixel along rows from which a box counts as fully text-like
+TEXT_TRANSITIONS = 0.12
+# Below this many on/off transitions per row (about four strokes) a box isn't text
+MIN_ROW_TRANSITIONS = 8
+
+# Text edges are at least this many times stronger than the window's 75th-percentile gradient
+EDGE_CONTRAST = 2.0
+
+# Components join one text cluster when their heights differ by at most this
+# ratio and the horizontal gap between them is at most CLUSTER_GAP heights
+CLUSTER_HEIGHT_RATIO = 1.5
+CLUSTER_GAP = 2.0
+
+# Detections below this confidence count as "not found"
+MIN_CONFIDENCE = 0.5
+
+
+@dataclass(frozen=True)
+class Detection:
+    found: bool
+    box: Tuple[int, int, int, int]    # (x, y, w, h), full resolution
+    confidence: float                 # 0..1
+    location: str = ""                # key of WINDOWS, or "template"
+    scale: Optional[float] = None     # template matching: matched size / template file size
+
+
+NOT_FOUND = Detection(False, (0, 0, 0, 0), 0.0)
+
+
+def _odd(value):
+    return max(3, int(round(value)) // 2 * 2 + 1)
+
+
+def _edge_map(gray, factor):
+    """(morphological gradient, its Otsu threshold, the threshold with letters joined into words)"""
+    size = _odd(GRADIENT_KERNEL * factor)
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    connect = cv2.getStructuringElement(cv2.MORPH_RECT, (_odd(CONNECT_KERNEL[0] * factor),
+                                                         _odd(CONNECT_KERNEL[1] * factor)))
+    return gradient, binary, cv2.morphologyEx(binary, cv2.MORPH_CLOSE, connect)
+
+
+def _text_boxes(connected, factor, min_aspect):
+    """
+    Boxes (x1, y1, x2, y2) of text-like clusters: components of similar
+    height that sit next to each other on the same line. A background shape
+    in the same window stays a cluster of its own instead of swelling the box.
+    """
+    min_w, min_h = MIN_BOX[0] * factor, MIN_BOX[1] * factor
+    contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = []
+    for cnt in contours:
+        x, y, cw, ch = cv2.boundingRect(cnt)
+        if cw < min_w or ch < min_h or cw / float(ch) < min_aspect:
+            continue
+        boxes.append((x, y, x + cw, y + ch))
+
+    # Union-find over pairs that look like neighbouring words of one line
+    parent = list(range(len(boxes)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, a in enumerate(boxes):
+        for j in range(i + 1, len(boxes)):
+            b = boxes[j]
+            ha, hb = a[3] - a[1], b[3] - b[1]
+            overlap = min(a[3], b[3]) - max(a[1], b[1])
+            gap = max(a[0], b[0]) - min(a[2], b[2])
+            if (max(ha, hb) <= CLUSTER_HEIGHT_RATIO * min(ha, hb) and overlap >= 0.5 * min(ha, hb)
+                    and gap <= CLUSTER_GAP * max(ha, hb)):
+                parent[root(j)] = root(i)
+
+    clusters = {}
+    for i, box in enumerate(boxes):
+        x1, y1, x2, y2 = clusters.get(root(i), box)
+        clusters[root(i)] = (min(x1, box[0]), min(y1, box[1]), max(x2, box[2]), max(y2, box[3]))
+    return list(clusters.values())
+
+
+def _confidence(binary, box):
+    """0..1: edge density inside box vs the ring around it, times how text-like the edges alternate"""
+    x1, y1, x2, y2 = box
+    h, w = binary.shape
+    ring = max(2, (y2 - y1) // 2)
+    rx1, ry1, rx2, ry2 = max(0, x1 - ring), max(0, y1 - ring), min(w, x2 + ring), min(h, y2 + ring)
+
+    inside = np.count_nonzero(binary[y1:y2, x1:x2])
+    around = np.count_nonzero(binary[ry1:ry2, rx1:rx2]) - inside
+    inside_area = (x2 - x1) * (y2 - y1)
+    ring_area = (rx2 - rx1) * (ry2 - ry1) - inside_area
+    if not inside:
+        return 0.0
+    inside_density = inside / inside_area
+    ring_density = around / ring_area if ring_area else 0.0
+    contrast = np.clip((inside_density - ring_density) / inside_density, 0.0, 1.0)
+
+    transitions = np.count_nonzero(np.diff(binary[y1:y2, x1:x2] > 0, axis=1))
+    # A lone shape crosses a row a couple of times, a word many more
+    if transitions < MIN_ROW_TRANSITIONS * (y2 - y1):
+        return 0.0
+    return float(contrast * min(1.0, transitions / inside_area / TEXT_TRANSITIONS))
+
+
+def _percentile(gray, q):
+    """q-quantile (0..1) of a uint8 image, from its histogram"""
+    cumulative = np.cumsum(cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel())
+    return float(np.searchsorted(cumulative, q * cumulative[-1]))
+
+
+def _working_copy(image):
+    """(grey copy of at most WORK_SIDE px, scale from full resolution to it)"""
+    h, w = image.shape[:2]
+    scale = min(1.0, WORK_SIDE / max(h, w))
+    # Strided read first, so the cost hardly grows with the image: strokes big
+    # enough to matter at WORK_SIDE are several source pixels wide
+    step = max(1, int(1 / scale))
+    gray = cv2.cvtColor(np.ascontiguousarray(image[::step, ::step]), cv2.COLOR_RGB2GRAY)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if gray.shape[::-1] != size:
+        # Less than 2x left after the strided read - bilinear is enough
+        gray = cv2.resize(gray, size, interpolation=cv2.INTER_LINEAR)
+    return gray, scale
+
+
+def _scan(gray, factor):
+    """Best (confidence, location, box) over WINDOWS on the working copy"""
+    h, w = gray.shape
+    best = (0.0, "", None)
+    for location, ((fx1, fy1, fx2, fy2), prior) in WINDOWS.items():
+        wx1, wy1, wx2, wy2 = int(w * fx1), int(h * fy1), int(w * fx2), int(h * fy2)
+        if wx2 - wx1 < 2 or wy2 - wy1 < 2:
+            continue
+        gradient, binary, connected = _edge_map(gray[wy1:wy2, wx1:wx2], factor)
+        texture = max(1.0, _percentile(gradient, 0.75))
+        for box in _text_boxes(connected, factor, MIN_ASPECT):
+            x1, y1, x2, y2 = box
+            # Too big for a watermark - probably a busy background
+            if x2 - x1 > (wx2 - wx1) * 0.9 or y2 - y1 > (wy2 - wy1) * 0.8:
+                continue
+            # Edges no stronger than the window's texture - Otsu split noise
+            strength = cv2.mean(gradient[y1:y2, x1:x2], mask=binary[y1:y2, x1:x2])[0]
+            if strength < EDGE_CONTRAST * texture:
+                continue
+            confidence = _confidence(binary, box) * prior
+            if confidence > best[0]:
+                best = (confidence, location, (wx1 + x1, wy1 + y1, wx1 + x2, wy1 + y2))
+    return best
+
+
+def _refine(image, box, factor):
+    """Text box inside box (x1, y1, x2, y2) at full resolution, or None"""
+    x1, y1, x2, y2 = box
+    gray = cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_RGB2GRAY)
+    if gray.size == 0:
+        return None
+    _, _, connected = _edge_map(gray, factor)
+    # Letters one by one are fine here - the box is already known to be text
+    boxes = _text_boxes(connected, factor, 0.0)
+    if not boxes:
+        return None
+    found = max(boxes, key=lambda b: b[2] - b[0])
+    return (x1 + found[0], y1 + found[1], x1 + found[2], y1 + found[3])
+
+
+def detect_watermark(image):
+    """Scan corners and centre band of an RGB image. Returns a Detection"""
+    h, w = image.shape[:2]
+    gray, scale = _working_copy(image)
+    confidence, location, box = _scan(gray, max(gray.shape) / REFERENCE_SIDE)
+    if box is None or confidence < MIN_CONFIDENCE:
+        return Detection(False, (0, 0, 0, 0), confidence, location)
+
+    # Back to full resolution, one working pixel of slack on each side
+    slack = math.ceil(1 / scale)
+    coarse = (max(0, int(box[0] / scale) - slack), max(0, int(box[1] / scale) - slack),
+              min(w, math.ceil(box[2] / scale) + slack), min(h, math.ceil(box[3] / scale) + slack))
+    full_factor = max(h, w) / REFERENCE_SIDE
+    x1, y1, x2, y2 = _refine(image, coarse, full_factor) or coarse
+
+    pad_x = int(round(BOX_PAD[0] * max(1.0, full_factor)))
+    pad_y = int(round(BOX_PAD[1] * max(1.0, full_factor)))
+    x1, y1 = max(0, x1 - pad_x), max(0, y1 - pad_y)
+    x2, y2 = min(w, x2 + pad_x), min(h, y2 + pad_y)
+    return Detection(True, (x1, y1, x2 - x1, y2 - y1), round(confidence, 3), location)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Cross-image detection reuse for homogeneous batches.
+
+Images from the same source almost always carry the watermark at the same
+place. Per image resolution, DetectionCache remembers the last box that
+full detection confirmed plus an edge-map template of the watermark
+pixels. A new image is first checked with a normalized cross-correlation
+of that template in a small window around the cached box; full detection
+only runs when the check fails.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+# Minimum TM_CCOEFF_NORMED score on the edge maps to accept a cached box
+MATCH_THRESHOLD = 0.6
+
+# How far (px) the watermark may move between images and still be a hit
+SEARCH_MARGIN = 8
+
+_EDGE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+
+
+def _edges(image_rgb):
+    """Morphological gradient of the grayscale image - same cue the detector uses"""
+    gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+    return cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, _EDGE_KERNEL)
+
+
+class DetectionCache:
+    """Thread-safe {(h, w): (box, template)} with hit/miss counters"""
+
+    def __init__(self, threshold=MATCH_THRESHOLD, search_margin=SEARCH_MARGIN):
+        self.threshold = threshold
+        self.search_margin = search_margin
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, image):
+        """Return the cached (x, y, w, h) if it verifies on this image, else None"""
+        h, w = image.shape[:2]
+        with self._lock:
+            entry = self._entries.get((h, w))
+        if entry is None:
+            self._count(False)
+            return None
+
+        (x, y, bw, bh), template = entry
+        m = self.search_margin
+        wx1, wy1 = max(0, x - m), max(0, y - m)
+        wx2, wy2 = min(w, x + bw + m), min(h, y + bh + m)
+        window = _edges(image[wy1:wy2, wx1:wx2])
+        if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+            self._count(False)
+            return None
+
+        scores = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if not np.isfinite(score) or score < self.threshold:
+            self._count(False)
+            return None
+
+        self._count(True)
+        return (wx1 + dx, wy1 + dy, bw, bh)
+
+    def store(self, image, box):
+        """Remember a box confirmed by full detection"""
+        x, y, bw, bh = box
+        template = _edges(image[y:y+bh, x:x+bw])
+        # A flat template can't be verified by correlation
+        if template.size == 0 or template.std() < 1.0:
+            return
+        with self._lock:
+            self._entries[image.shape[:2]] = (box, template)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+Headless watermark removal engine.
+
+Everything here works on RGB numpy arrays and an immutable per-job
+settings object, so the same engine drives the Tk GUI, the command line
+and batch workers. The engine keeps no per-image state and is safe to
+call from many threads at once.
+"""
+
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from .backends import (BACKEND_AUTO, BACKEND_LAMA, BACKEND_OPENCV, FALLBACK_BACKEND, PREFERENCES, backend_names,
+                       get_backend, select_backend)
+from .buckets import fit_to_bucket, snap_crop
+from .context import context_margin
+from .detect import detect_watermark
+from .lama_batch import PAD_MODULO
+from .logo import LogoCache, blend, stamp
+from .metrics import (CROP_PIXELS, DETECTION_CACHE_HIT, DETECTION_MISS, FALLBACK_OPENCV, MASK_BOX_PIXELS, MASK_PIXELS,
+                      Metrics)
+from .model import get_model
+from .strokes import refine_mask
+from .template_match import TemplateCache
+
+LOGO_POSITIONS = ("top-left", "top-right", "bottom-left", "bottom-right", "center")
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LogoSettings:
+    """How to stamp a new logo onto the cleaned image"""
+    path: str
+    position: str = "top-left"  # one of LOGO_POSITIONS
+    scale: int = 5              # logo width, % of image width
+    opacity: int = 51           # %
+    tiled: bool = False         # repeat the logo over the whole image
+    remove_bg: bool = True      # make (near) white logo pixels transparent
+    angle: int = 0              # rotation in degrees
+
+
+@dataclass(frozen=True)
+class RemovalSettings:
+    """Immutable per-job settings (mirrors the GUI controls)"""
+    auto_mode: bool = True
+    region: Optional[Tuple[int, int, int, int]] = None  # manual (x, y, w, h)
+    inpaint_radius: int = 20
+    use_lama: bool = True
+    logo: Optional[LogoSettings] = None
+    # Round LaMa crops up to these side lengths (see buckets.py); None = exact crop
+    crop_buckets: Optional[Tuple[int, ...]] = None
+    # Peak-memory budget for one inpainting call; larger areas are tiled (see tiling.py)
+    tile_memory_mb: Optional[int] = None
+    tile_overlap: int = 64      # px shared by neighbouring tiles (feathered)
+    tile_workers: int = 1       # tiles inpainted in parallel
+    # Inpainting backend name, or "auto" to pick one per job by preference and latency budget
+    backend: str = BACKEND_AUTO
+    preference: str = "quality"  # one of backends.PREFERENCES
+    max_latency_ms: Optional[float] = None
+    # Context around the region: fixed margin in px, or None = adaptive within context_bounds (see context.py)
+    context_pad: Optional[int] = None
+    context_bounds: Tuple[int, int] = (32, 256)
+    # Auto mode: image of the watermark to look for first (see template_match.py), text detection if not found
+    template: Optional[str] = None
+    # Auto mode: mask only the watermark's strokes inside a detected box (see strokes.py), not the whole box
+    stroke_mask: bool = True
+
+    def __post_init__(self):
+        if not self.auto_mode and self.region is None:
+            raise ValueError("Manual mode needs a region (x, y, w, h)")
+        if self.logo is not None and self.logo.position not in LOGO_POSITIONS:
+            raise ValueError(f"Unknown logo position: {self.logo.position}")
+        if self.backend != BACKEND_AUTO and self.backend not in backend_names():
+            raise ValueError(f"Unknown inpainting backend: {self.backend}")
+        if self.preference not in PREFERENCES:
+            raise ValueError(f"Unknown backend preference: {self.preference}")
+        if self.context_pad is not None and self.context_pad < 0:
+            raise ValueError("context_pad must be >= 0")
+        if not 0 <= self.context_bounds[0] <= self.context_bounds[1]:
+            raise ValueError("context_bounds must be (min, max) with 0 <= min <= max")
+        if self.template is not None and not os.path.isfile(self.template):
+            raise ValueError(f"Template image not found: {self.template}")
+
+
+@dataclass
+class JobResult:
+    """Output of WatermarkEngine.process()"""
+    image: np.ndarray
+    region: Tuple[int, int, int, int]  # region that was removed (x, y, w, h)
+    detected: bool                     # auto mode: True if detection matched
+    backend: str                       # name of the inpainting backend that ran (see backends.py)
+    model_shape: Optional[Tuple[int, int]] = None  # (h, w) fed to LaMa
+    cache_hit: Optional[bool] = None               # detection cache hit (None = not used)
+    box: Optional[Tuple[int, int, int, int]] = None  # (x1, y1, x2, y2) pixels written by the removal
+    confidence: Optional[float] = None               # detection confidence 0..1 (None = not detected this time)
+
+
+@dataclass
+class RemovalJob:
+    """Intermediate state passed between the prepare / inpaint / compose stages"""
+    image: np.ndarray
+    settings: RemovalSettings
+    region: Tuple[int, int, int, int]  # (x, y, w, h)
+    detected: bool
+    mask: np.ndarray                   # mask of the crop area (not the frame), 255 = inpaint
+    crop: Tuple[int, int, int, int]    # (x1, y1, x2, y2) context crop, the only area ever touched
+    crop_pad: Tuple[int, int] = (0, 0)  # reflect padding (bottom, right) up to the bucket
+    backend: Optional[str] = None
+    model_shape: Optional[Tuple[int, int]] = None
+    cache_hit: Optional[bool] = None
+    confidence: Optional[float] = None
+    refined: bool = False              # mask follows the strokes (strokes.py) instead of covering the box
+    inpainted: Optional[np.ndarray] = None  # crop-sized result
+
+
+class WatermarkEngine:
+    """Detect, remove and re-stamp watermarks - numpy in, numpy out"""
+
+    def __init__(self, model_provider=get_model, inpainter=None, detection_cache=None, logo_cache=None,
+                 metrics=None, template_cache=None):
+        # Callable returning a SimpleLama-compatible model or None
+        self.model_provider = model_provider
+        # Optional lama_batch.BatchingInpainter shared by concurrent callers
+        self.inpainter = inpainter
+        # Optional detect_cache.DetectionCache shared by the images of a batch
+        self.detection_cache = detection_cache
+        # Prepared logos, shared by every image this engine stamps
+        self.logo_cache = logo_cache or LogoCache()
+        # Stage spans and counters (see metrics.py), shared with clones
+        self.metrics = metrics or Metrics()
+        # Template detectors (and their FFTs), shared by every image this engine searches
+        self.template_cache = template_cache or TemplateCache()
+
+    def clone(self, **overrides):
+        """Copy of this engine with some constructor arguments replaced"""
+        kwargs = {
+            "model_provider": self.model_provider,
+            "inpainter": self.inpainter,
+            "detection_cache": self.detection_cache,
+            "logo_cache": self.logo_cache,
+            "metrics": self.metrics,
+            "template_cache": self.template_cache,
+        }
+        kwargs.update(overrides)
+        return WatermarkEngine(**kwargs)
+
+    def process(self, image, settings, out=None):
+        """
+        Full pipeline: remove watermark, then apply the new logo (if any).
+        out: optional buffer (image itself for in place) that receives the result.
+        """
+        result = self.remove_watermark(image, settings, out)
+        result.image = self.apply_logo(result.image, settings.logo, inplace=True)
+        return result
+
+    def detect_watermark_bounds(self, image):
+        """
+        Detect 'MI VIETNAM.VN' style watermarks (white text) in the corners or the centre band.
+        Returns: (success_bool, (x, y, w, h)); detect.detect_watermark also gives the confidence.
+        """
+        detection = detect_watermark(image)
+        return detection.found, detection.box
+
+    def detect(self, image, settings):
+        """detect.Detection: the template (if settings.template is set) first, then the text heuristics"""
+        if settings.template is not None:
+            detection = self.template_cache.get(settings.template).detect(image)
+            if detection.found:
+                return detection
+            log.debug("🔍 Template not found (score %.2f), trying text detection", detection.confidence)
+        return detect_watermark(image)
+
+    def resolve_region(self, image, settings):
+        """
+        Work out which region to remove.
+        Returns: (detected_bool, (x, y, w, h), cache_hit, confidence)
+        cache_hit is None when no detection cache was consulted; confidence is
+        None unless full detection ran.
+        """
+        h, w = image.shape[:2]
+
+        if not settings.auto_mode:
+            x, y, wm_w, wm_h = settings.region
+            log.debug("👆 Manual selection: %dx%d at (%d,%d)", wm_w, wm_h, x, y)
+            return False, (x, y, wm_w, wm_h), None, None
+
+        # Same source as the previous images? Verify the cached box first
+        cache_hit = None
+        cached = None
+        confidence = None
+        if self.detection_cache is not None:
+            cached = self.detection_cache.lookup(image)
+            cache_hit = cached is not None
+
+        if cached is not None:
+            detection_success, (x, y, wm_w, wm_h) = True, cached
+            self.metrics.count(DETECTION_CACHE_HIT)
+            log.debug("♻️ Cached detection verified: %dx%d at (%d,%d)", wm_w, wm_h, x, y)
+        else:
+            # AI / Smart Detection System
+            detection = self.detect(image, settings)
+            detection_success, (x, y, wm_w, wm_h) = detection.found, detection.box
+            confidence = detection.confidence
+
+            if detection_success:
+                log.debug("🎯 AI Detection matched: %dx%d at (%d,%d), %s, confidence %.2f",
+                          wm_w, wm_h, x, y, detection.location, confidence)
+                if self.detection_cache is not None:
+                    self.detection_cache.store(image, (x, y, wm_w, wm_h))
+            else:
+                # Fallback to standard region if detection fails
+                x, y = 0, 0
+                wm_w = int(w * 0.28)
+                wm_h = int(h * 0.065)
+                self.metrics.count(DETECTION_MISS)
+                log.debug("⚠️ AI Detection failed (confidence %.2f), using fallback: %dx%d at (%d,%d)",
+                          confidence, wm_w, wm_h, x, y)
+
+        # Force expansion to edges if close - ONLY for auto mode
+        # For manual mode, respect the exact selection
+        edge_snap = 10
+        if x < edge_snap:
+            wm_w += x
+            x = 0
+        if y < edge_snap:
+            wm_h += y
+            y = 0
+
+        return detection_success, (x, y, wm_w, wm_h), cache_hit, confidence
+
+    def remove_watermark(self, image, settings, out=None):
+        """
+        LaMa Deep Learning Watermark Removal.
+        Uses mirror padding for boundary safety and aggressive dilation.
+        """
+        job = self.prepare(image, settings)
+        self.inpaint(job)
+        return self.compose(job, out)
+
+    def prepare(self, image, settings):
+        """
+        Stage 1: find the region, then build the mask for the context crop around it.
+        Nothing here is frame-sized, so the cost doesn't grow with megapixels.
+        """
+        h, w = image.shape[:2]
+
+        with self.metrics.span("detect"):
+            detected, (x, y, wm_w, wm_h), cache_hit, confidence = self.resolve_region(image, settings)
+
+        log.debug("🔧 Final region to remove: x=%d, y=%d, w=%d, h=%d", x, y, wm_w, wm_h)
+
+        # Context around the watermark: scales with its size and the surrounding texture
+        pad = settings.context_pad
+        if pad is None:
+            pad = context_margin(image, (x, y, wm_w, wm_h), settings.context_bounds)
+
+        # Calculate crop bounds with padding
+        crop_x1 = max(0, x - pad)
+        crop_y1 = max(0, y - pad)
+        crop_x2 = min(w, x + wm_w + pad)
+        crop_y2 = min(h, y + wm_h + pad)
+        crop = (crop_x1, crop_y1, crop_x2, crop_y2)
+
+        # Round the crop up to a canonical size so shapes repeat across images,
+        # or at least to sides LaMa takes without padding
+        crop_pad = (0, 0)
+        if settings.crop_buckets:
+            crop, crop_pad, _ = fit_to_bucket(crop, image.shape, settings.crop_buckets)
+        else:
+            crop = snap_crop(crop, image.shape, PAD_MODULO)
+        crop_x1, crop_y1, crop_x2, crop_y2 = crop
+
+        with self.metrics.span("mask"):
+            # Create binary mask of the crop (white = area to inpaint)
+            mask = np.zeros((crop_y2 - crop_y1, crop_x2 - crop_x1), dtype=np.uint8)
+            mask[max(0, y - crop_y1):y + wm_h - crop_y1, max(0, x - crop_x1):x + wm_w - crop_x1] = 255
+
+            # Dilation for coverage - lighter for manual mode to avoid affecting surrounding content
+            if settings.auto_mode:
+                # Aggressive dilation for auto detection
+                kernel = np.ones((9, 9), np.uint8)
+                mask = cv2.dilate(mask, kernel, iterations=2)
+            else:
+                # Moderate dilation for manual selection - enough to cover watermark edges
+                kernel = np.ones((5, 5), np.uint8)
+                mask = cv2.dilate(mask, kernel, iterations=2)
+            box_pixels = np.count_nonzero(mask)
+
+            # Only a detected box is known to hold a watermark to segment - the fallback region is a guess
+            refined = False
+            if settings.auto_mode and settings.stroke_mask and detected:
+                strokes = refine_mask(image[crop_y1:crop_y2, crop_x1:crop_x2],
+                                      (x - crop_x1, y - crop_y1, wm_w, wm_h))
+                if strokes is not None:
+                    mask, refined = strokes, True
+
+        crop_pixels = mask.size
+        mask_pixels = np.count_nonzero(mask)
+        self.metrics.count(CROP_PIXELS, crop_pixels)
+        self.metrics.count(MASK_PIXELS, mask_pixels)
+        self.metrics.count(MASK_BOX_PIXELS, box_pixels)
+        if refined:
+            log.debug("🎭 Stroke mask: %d of the box's %d pixels (%.0f%%)",
+                      mask_pixels, box_pixels, 100.0 * mask_pixels / max(1, box_pixels))
+        log.debug("✅ Mask created with %d pixels to inpaint; context %d px, crop %dx%d, crop/mask area %.1f",
+                  mask_pixels, pad, crop_x2 - crop_x1, crop_y2 - crop_y1, crop_pixels / max(1, mask_pixels))
+
+        return RemovalJob(image, settings, (x, y, wm_w, wm_h), detected, mask, crop, crop_pad,
+                          cache_hit=cache_hit, confidence=confidence, refined=refined)
+
+    def inpaint(self, job):
+        """Stage 2: inpaint the crop with the backend selected for the job (see backends.py)"""
+        backend = select_backend(self, job)
+        log.debug("🚀 Inpainting with %s...", backend.name)
+        with self.metrics.span("infer"):
+            try:
+                t0 = time.perf_counter()
+                job.inpainted = backend.inpaint(self, job)
+                backend.cost.observe(backend.work(job), (time.perf_counter() - t0) * 1000)
+            except Exception as e:
+                if backend.name == FALLBACK_BACKEND:
+                    raise
+                self.metrics.count(FALLBACK_OPENCV)
+                log.warning("❌ %s error: %s", backend.name, e, exc_info=True)
+                backend = get_backend(FALLBACK_BACKEND)
+                job.model_shape = None
+                job.inpainted = backend.inpaint(self, job)
+        job.backend = backend.name
+        return job
+
+    def compose(self, job, out=None):
+        """
+        Stage 3: paste the inpainted crop back into a copy of the image, or
+        into out (same shape; pass job.image itself to only write the pasted area).
+        """
+        with self.metrics.span("paste"):
+            return self._paste(job, out)
+
+    def _paste(self, job, out):
+        crop_x1, crop_y1, _, _ = job.crop
+        result_crop = job.inpainted
+
+        # Create final result
+        if out is None:
+            final_result = job.image.copy()
+        else:
+            final_result = out
+            if out is not job.image:
+                np.copyto(out, job.image)
+
+        alpha = None
+        if job.backend == BACKEND_LAMA and job.refined:
+            # Stroke mask: blend LaMa's output over the strokes only (feathered), the
+            # background between them stays original
+            alpha = cv2.dilate(job.mask, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5)))
+            mx, my, mw, mh = cv2.boundingRect(alpha)
+            blend_x1, blend_y1, blend_x2, blend_y2 = mx, my, mx + mw, my + mh
+            alpha = cv2.GaussianBlur(alpha[my:my + mh, mx:mx + mw], (5, 5), 0)
+            alpha = np.maximum(alpha, job.mask[my:my + mh, mx:mx + mw]).astype(np.float32)[..., None] / 255.0
+        elif job.backend == BACKEND_LAMA:
+            x, y, wm_w, wm_h = job.region
+
+            # Calculate where the watermark region is within the crop
+            wm_in_crop_x = x - crop_x1
+            wm_in_crop_y = y - crop_y1
+
+            # Extract just the watermark region from the inpainted result
+            # Add small padding for smoother edges
+            pad_blend = 5
+            blend_x1 = max(0, wm_in_crop_x - pad_blend)
+            blend_y1 = max(0, wm_in_crop_y - pad_blend)
+            blend_x2 = min(result_crop.shape[1], wm_in_crop_x + wm_w + pad_blend)
+            blend_y2 = min(result_crop.shape[0], wm_in_crop_y + wm_h + pad_blend)
+        else:
+            # OpenCV only changes masked pixels - paste the mask's bounding box
+            mx, my, mw, mh = cv2.boundingRect(job.mask)
+            blend_x1, blend_y1, blend_x2, blend_y2 = mx, my, mx + mw, my + mh
+
+        # Get the region to paste
+        inpainted_region = result_crop[blend_y1:blend_y2, blend_x1:blend_x2]
+
+        # Calculate destination coordinates
+        dest_x1 = crop_x1 + blend_x1
+        dest_y1 = crop_y1 + blend_y1
+        dest_x2 = dest_x1 + inpainted_region.shape[1]
+        dest_y2 = dest_y1 + inpainted_region.shape[0]
+
+        # Paste the inpainted region
+        if alpha is None:
+            final_result[dest_y1:dest_y2, dest_x1:dest_x2] = inpainted_region
+        else:
+            original = job.image[dest_y1:dest_y2, dest_x1:dest_x2].astype(np.float32)
+            final_result[dest_y1:dest_y2, dest_x1:dest_x2] = np.clip(
+                original + (inpainted_region - original) * alpha + 0.5, 0, 255).astype(np.uint8)
+
+        log.debug("📍 Pasted region: (%d,%d) to (%d,%d)", dest_x1, dest_y1, dest_x2, dest_y2)
+        return JobResult(final_result, job.region, job.detected, job.backend, job.model_shape, job.cache_hit,
+                         box=(dest_x1, dest_y1, dest_x2, dest_y2), confidence=job.confidence)
+
+    def apply_logo(self, image, logo_settings, inplace=False):
+        """
+        Apply new logo watermark to image.
+        With inplace=True the image buffer itself is stamped (no full-frame copy).
+        """
+        if logo_settings is None:
+            return image
+        with self.metrics.span("overlay"):
+            return self._stamp_logo(image, logo_settings, inplace)
+
+    def _stamp_logo(self, image, logo_settings, inplace):
+        try:
+            h_img, w_img = image.shape[:2]
+
+            # Target width based on image width
+            scale = logo_settings.scale / 100.0
+            target_w = int(w_img * scale)
+            logo_key = (logo_settings.path, logo_settings.remove_bg, logo_settings.angle,
+                        target_w, logo_settings.opacity / 100.0)
+
+            # Background keying, rotation, resize and opacity are cached per settings
+            logo = self.logo_cache.get(*logo_key)
+            if logo is None: return image
+            target_h = logo.size[1]
+
+            result = image if inplace else image.copy()
+
+            # 3. Tiling (Repeated Pattern) - layer cached per image size
+            if logo_settings.tiled:
+                for y1, y2, band in self.logo_cache.pattern(image.shape, *logo_key):
+                    blend(result[y1:y2], band.rgb, band.alpha)
+
+            else:
+                # Normal Positioning
+                pos = logo_settings.position
+                padding = int(w_img * 0.02) # 2% padding
+
+                if pos == "top-left":
+                    x, y = padding, padding
+                elif pos == "top-right":
+                    x, y = w_img - target_w - padding, padding
+                elif pos == "bottom-left":
+                    x, y = padding, h_img - target_h - padding
+                elif pos == "bottom-right":
+                    x, y = w_img - target_w - padding, h_img - target_h - padding
+                else: # center
+                    x, y = (w_img - target_w) // 2, (h_img - target_h) // 2
+
+                stamp(result, logo, x, y)
+
+            return result
+
+        except Exception as e:
+            log.error("Error applying watermark: %s", e)
+            return image
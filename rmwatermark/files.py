@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Image file helpers.
+
+Reads and writes go through imdecode/imencode so paths with Vietnamese
+(non-ASCII) characters work on Windows too.
+"""
+
+import bisect
+import os
+import threading
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+IMAGE_PATTERNS = ['*.jpg', '*.jpeg', '*.png', '*.bmp']
+IMAGE_EXTENSIONS = frozenset(p[1:] for p in IMAGE_PATTERNS)
+
+# Power-of-two reductions libjpeg can apply while decoding
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def _scan_images(folder):
+    """Image paths (str, unsorted) directly inside folder - one directory read"""
+    with os.scandir(folder) as entries:
+        return [
+            str(Path(folder) / e.name) for e in entries
+            if os.path.splitext(e.name)[1].lower() in IMAGE_EXTENSIONS and e.is_file()
+        ]
+
+
+def list_images(folder):
+    """Sorted list of image paths (str) directly inside folder (extensions matched case-insensitively)"""
+    if not Path(folder).is_dir():
+        return []
+    return sorted(_scan_images(folder))
+
+
+class FolderIndex:
+    """
+    Sorted image list of a folder, kept up to date incrementally.
+
+    refresh() only rescans when the directory mtime changed (files were
+    added, removed or renamed); code that writes into the folder can call
+    add() so the index is current without any rescan.
+    """
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.files = []
+        self._known = set()
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Rescan if the directory changed; returns True if it did"""
+        try:
+            mtime = self.folder.stat().st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            found = set(_scan_images(self.folder)) if mtime is not None else set()
+            if found != self._known:
+                self._known = found
+                self.files = sorted(found)
+            return True
+
+    def add(self, path):
+        """Record a file just written into the folder"""
+        path = str(self.folder / Path(path).name)
+        with self._lock:
+            if path not in self._known:
+                self._known.add(path)
+                bisect.insort(self.files, path)
+
+    def position(self, path):
+        """Index of path in files, or of the entry that would follow it"""
+        with self._lock:
+            return bisect.bisect_left(self.files, str(path))
+
+    def __len__(self):
+        return len(self.files)
+
+
+def read_image(path):
+    """Read an image file as RGB uint8, or None if it can't be decoded"""
+    data = np.fromfile(str(path), dtype=np.uint8)
+    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def read_image_reduced(path, max_w, max_h):
+    """
+    Read an image as RGB for display in a max_w x max_h box. JPEGs are decoded
+    at the largest power-of-two reduction that still covers that box.
+    """
+    with Image.open(path) as im:  # header only
+        w, h = im.size
+    limit = max(w / max_w, h / max_h)
+    flag = cv2.IMREAD_COLOR
+    for factor, reduced in _REDUCED_FLAGS:
+        if factor <= limit:
+            flag = reduced
+            break
+
+    image = cv2.imdecode(np.fromfile(str(path), dtype=np.uint8), flag)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def write_image(path, image_rgb):
+    """Write an RGB image, format chosen from the file extension"""
+    ext = Path(path).suffix or '.jpg'
+    ok, encoded = cv2.imencode(ext, cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise IOError(f"Cannot encode image as {ext}: {path}")
+    encoded.tofile(str(path))
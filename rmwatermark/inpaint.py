@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Classic (non deep-learning) inpainting helpers.
+
+Images passed here are RGB uint8 arrays, masks are single-channel uint8
+(255 = area to inpaint).
+"""
+
+import cv2
+import numpy as np
+
+
+def opencv_inpaint(image, mask, radius, method=cv2.INPAINT_NS):
+    """Run cv2.inpaint on an RGB image (channels are inpainted independently, no BGR round trip needed)"""
+    return cv2.inpaint(image, mask, radius, method)
+
+
+def pyramid_inpaint(image, mask, radius):
+    """Multi-scale pyramid inpainting for structure preservation"""
+    result = image.copy()
+
+    # Build Gaussian pyramid (3 levels)
+    num_levels = 3
+    img_pyramid = [result.copy()]
+    mask_pyramid = [mask.copy()]
+
+    for i in range(num_levels - 1):
+        img_pyramid.append(cv2.pyrDown(img_pyramid[-1]))
+        mask_pyramid.append(cv2.pyrDown(mask_pyramid[-1]))
+        # Ensure mask stays binary
+        mask_pyramid[-1] = (mask_pyramid[-1] > 127).astype(np.uint8) * 255
+
+    # Inpaint from coarsest to finest level
+    for level in range(num_levels - 1, -1, -1):
+        img = img_pyramid[level]
+        msk = mask_pyramid[level]
+
+        # Use appropriate radius for each level
+        level_radius = max(3, radius // (2 ** level))
+
+        # Inpaint at this level
+        img = cv2.inpaint(img, msk, level_radius, cv2.INPAINT_NS)
+
+        # Upsample if not at finest level
+        if level > 0:
+            upsampled = cv2.pyrUp(img)
+            # Match size to finer level
+            target_size = img_pyramid[level - 1].shape[:2][::-1]
+            upsampled = cv2.resize(upsampled, target_size)
+
+            # Blend upsampled with original where known
+            fine_mask = mask_pyramid[level - 1]
+            fine_mask_3c = np.stack([fine_mask] * 3, axis=-1) / 255.0
+            img_pyramid[level - 1] = (
+                upsampled * fine_mask_3c +
+                img_pyramid[level - 1] * (1 - fine_mask_3c)
+            ).astype(np.uint8)
+        else:
+            result = img
+
+    return result
+
+
+def transfer_detail(image, mask, fill, low):
+    """
+    Restore fine texture on an upsampled low-res fill.
+
+    low is image through the same down/up-sampling as fill, so image - low is
+    exactly the detail the low-res pass lost. Each masked pixel gets fill plus
+    the detail of its mirror image across the nearest unmasked pixel; where the
+    mirror lands in the mask too (deep inside large masks) fill is used as is.
+    """
+    masked = (mask > 0).astype(np.uint8)
+    result = image.copy()
+    my, mx = np.nonzero(masked)
+    if my.size == 0:
+        return result
+    if my.size == masked.size:
+        return fill.copy()
+
+    # Labels number the unmasked pixels in raster order - the order np.nonzero returns them in
+    _, labels = cv2.distanceTransformWithLabels(masked, cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_PIXEL)
+    zy, zx = np.nonzero(masked == 0)
+    nearest = labels[my, mx] - 1
+    qy, qx = zy[nearest], zx[nearest]
+
+    h, w = masked.shape
+    ry = np.clip(2 * qy - my, 0, h - 1)
+    rx = np.clip(2 * qx - mx, 0, w - 1)
+    ok = masked[ry, rx] == 0
+
+    values = fill[my, mx].astype(np.float32)
+    values[ok] += image[ry[ok], rx[ok]].astype(np.float32) - low[ry[ok], rx[ok]]
+    result[my, mx] = np.clip(values + 0.5, 0, 255).astype(np.uint8)
+    return result
+
+
+def texture_synthesis_refinement(result, original, mask, x, y, region_w, region_h):
+    """Patch-based texture synthesis for natural texture restoration"""
+    h, w = result.shape[:2]
+
+    # Find best texture source regions
+    patch_size = max(16, min(region_w, region_h) // 4)
+
+    # Sample texture from surrounding areas
+    source_regions = []
+
+    # Below
+    if y + region_h + patch_size < h:
+        source_regions.append(original[y+region_h:y+region_h+patch_size*2, x:x+region_w])
+    # Right
+    if x + region_w + patch_size < w:
+        source_regions.append(original[y:y+region_h, x+region_w:x+region_w+patch_size*2])
+    # Above
+    if y - patch_size*2 >= 0:
+        source_regions.append(original[y-patch_size*2:y, x:x+region_w])
+    # Left
+    if x - patch_size*2 >= 0:
+        source_regions.append(original[y:y+region_h, x-patch_size*2:x])
+
+    if not source_regions:
+        return result
+
+    # Find source with most similar texture to inpainted region
+    roi_result = result[y:y+region_h, x:x+region_w]
+
+    best_source = None
+    best_score = float('inf')
+
+    for src in source_regions:
+        if src.size == 0 or src.shape[0] < 10 or src.shape[1] < 10:
+            continue
+        # Compare using gradient histogram (texture measure)
+        src_gray = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+        roi_gray = cv2.cvtColor(roi_result, cv2.COLOR_BGR2GRAY)
+
+        src_grad = cv2.Laplacian(src_gray, cv2.CV_64F)
+        roi_grad = cv2.Laplacian(cv2.resize(roi_gray, (src_gray.shape[1], src_gray.shape[0])), cv2.CV_64F)
+
+        score = np.abs(np.std(src_grad) - np.std(roi_grad))
+        if score < best_score:
+            best_score = score
+            best_source = src
+
+    if best_source is None:
+        return result
+
+    # Apply texture transfer using color transfer technique
+    try:
+        # Resize source to match ROI
+        source_resized = cv2.resize(best_source, (region_w, region_h))
+
+        # Convert to LAB for color matching
+        roi_lab = cv2.cvtColor(roi_result, cv2.COLOR_BGR2LAB).astype(np.float32)
+        src_lab = cv2.cvtColor(source_resized, cv2.COLOR_BGR2LAB).astype(np.float32)
+
+        # Match mean and std of L channel (luminance) only for texture
+        # Keep color from inpainted result
+        for i in [1, 2]:  # Only a and b channels
+            src_mean = np.mean(src_lab[:, :, i])
+            src_std = np.std(src_lab[:, :, i])
+            roi_mean = np.mean(roi_lab[:, :, i])
+            roi_std = np.std(roi_lab[:, :, i])
+
+            if src_std > 0:
+                roi_lab[:, :, i] = (roi_lab[:, :, i] - roi_mean) * (src_std / max(roi_std, 1)) + src_mean
+
+        roi_lab = np.clip(roi_lab, 0, 255).astype(np.uint8)
+        refined_roi = cv2.cvtColor(roi_lab, cv2.COLOR_LAB2BGR)
+
+        # Blend refined texture with inpainted result
+        # Use mask to only apply to watermark areas
+        roi_mask = mask[y:y+region_h, x:x+region_w]
+        roi_mask_3c = np.stack([roi_mask / 255.0] * 3, axis=-1)
+
+        blended = (refined_roi * roi_mask_3c * 0.3 + roi_result * (1 - roi_mask_3c * 0.3)).astype(np.uint8)
+        result[y:y+region_h, x:x+region_w] = blended
+
+    except Exception:
+        pass
+
+    return result
+
+
+def seamless_blend(result, original, x, y, region_w, region_h):
+    """Final seamless blending at region boundaries"""
+    h, w = result.shape[:2]
+
+    # Create feathered edge mask
+    edge_width = max(8, min(region_w, region_h) // 8)
+
+    # Expand region slightly for blending
+    bx = max(0, x - edge_width)
+    by = max(0, y - edge_width)
+    bw = min(w - bx, region_w + edge_width * 2)
+    bh = min(h - by, region_h + edge_width * 2)
+
+    # Create gradient mask
+    mask = np.zeros((bh, bw), dtype=np.float32)
+
+    # Calculate relative position of watermark region within blend region
+    inner_x = x - bx
+    inner_y = y - by
+
+    # Fill inner region with 1.0
+    if inner_y + region_h <= bh and inner_x + region_w <= bw:
+        mask[inner_y:inner_y+region_h, inner_x:inner_x+region_w] = 1.0
+
+    # Apply Gaussian blur for smooth transition
+    mask = cv2.GaussianBlur(mask, (edge_width * 2 + 1, edge_width * 2 + 1), edge_width / 2)
+
+    # Blend result with original at boundaries
+    mask_3c = np.stack([mask] * 3, axis=-1)
+
+    blend_roi_result = result[by:by+bh, bx:bx+bw]
+    blend_roi_orig = original[by:by+bh, bx:bx+bw]
+
+    blended = (blend_roi_result * mask_3c + blend_roi_orig * (1 - mask_3c)).astype(np.uint8)
+
+    result = result.copy()
+    result[by:by+bh, bx:bx+bw] = blended
+
+    return result
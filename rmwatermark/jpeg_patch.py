@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+Block-level JPEG patching.
+
+Removing a watermark changes a few percent of the pixels, but re-encoding
+the whole image costs CPU on every pixel and adds one more generation of
+loss to the untouched 95%. For a baseline JPEG source that has restart
+markers (DRI), the entropy-coded data is a sequence of independent,
+byte-aligned restart intervals. Here only the intervals covering changed
+MCU rows are re-encoded - with the source's quantization tables, by
+libjpeg through Pillow - and spliced into the source file. Every other
+interval (and every header, EXIF included) is copied byte for byte.
+Sources with an EXIF orientation other than 1 decode rotated, so they are
+never patched; their re-encode carries the EXIF with Orientation reset to 1.
+
+Sources that can't be patched (progressive, no restart markers, custom
+Huffman tables, mostly changed) are re-encoded whole, still with the
+source quantization tables, and with a restart marker per MCU row so the
+output itself can be patched next time.
+"""
+
+import io
+import re
+from dataclasses import dataclass, field
+from math import ceil, gcd
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, JpegImagePlugin
+
+from .files import write_image
+
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+
+# Above this share of changed MCU rows patching saves little - re-encode everything
+MAX_PATCH_FRACTION = 0.5
+
+# Write modes reported by write_output
+MODE_PATCHED = "patched"
+MODE_REENCODED = "reencoded"
+MODE_FULL = "full"
+
+ORIENTATION_TAG = 0x0112
+
+_RST = re.compile(rb"\xff[\xd0-\xd7]")
+# First real marker after the entropy-coded data (not stuffing, not RSTn)
+_SCAN_END = re.compile(rb"\xff[^\x00\xd0-\xd7\xff]")
+
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+@dataclass
+class _JpegInfo:
+    sof: int = 0
+    height: int = 0
+    width: int = 0
+    components: List[Tuple[int, int, int, int]] = field(default_factory=list)   # (id, h, v, tq)
+    scan_components: List[Tuple[int, int, int]] = field(default_factory=list)  # (id, td, ta)
+    qtables: Dict[int, bytes] = field(default_factory=dict)
+    htables: Dict[Tuple[int, int], bytes] = field(default_factory=dict)
+    restart_interval: int = 0
+    scan_start: int = 0
+    scan_end: int = 0
+
+
+def _parse(data):
+    """Headers up to the first scan, and where its entropy-coded data starts and ends"""
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("not a JPEG")
+    info = _JpegInfo()
+    i = 2
+    while True:
+        if data[i] != 0xFF:
+            raise ValueError(f"bad marker at {i}")
+        while data[i + 1] == 0xFF:  # fill bytes
+            i += 1
+        marker = data[i + 1]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+
+        length = int.from_bytes(data[i + 2:i + 4], "big")
+        payload = data[i + 4:i + 2 + length]
+        if marker in _SOF_MARKERS:
+            info.sof = marker
+            info.height = int.from_bytes(payload[1:3], "big")
+            info.width = int.from_bytes(payload[3:5], "big")
+            info.components = [
+                (payload[6 + 3 * k], payload[7 + 3 * k] >> 4, payload[7 + 3 * k] & 15, payload[8 + 3 * k])
+                for k in range(payload[5])
+            ]
+        elif marker == 0xDB:
+            j = 0
+            while j < len(payload):
+                size = 64 * (1 + (payload[j] >> 4))
+                info.qtables[payload[j] & 15] = bytes(payload[j + 1:j + 1 + size])
+                j += 1 + size
+        elif marker == 0xC4:
+            j = 0
+            while j < len(payload):
+                total = sum(payload[j + 1:j + 17])
+                info.htables[(payload[j] >> 4, payload[j] & 15)] = bytes(payload[j + 1:j + 17 + total])
+                j += 17 + total
+        elif marker == 0xDD:
+            info.restart_interval = int.from_bytes(payload[0:2], "big")
+        elif marker == 0xDA:
+            info.scan_components = [
+                (payload[1 + 2 * k], payload[2 + 2 * k] >> 4, payload[2 + 2 * k] & 15)
+                for k in range(payload[0])
+            ]
+            info.scan_start = i + 2 + length
+            end = _SCAN_END.search(data, info.scan_start)
+            if end is None:
+                raise ValueError("truncated scan")
+            info.scan_end = end.start()
+            return info
+        i += 2 + length
+
+
+def _compatible(src, strip):
+    """Can the strip's restart intervals be dropped into the source scan?"""
+    if strip.sof != src.sof or strip.components != src.components:
+        return False
+    if strip.scan_components != src.scan_components or strip.restart_interval != src.restart_interval:
+        return False
+    for _, _, _, tq in src.components:
+        if strip.qtables.get(tq) != src.qtables.get(tq):
+            return False
+    for _, td, ta in src.scan_components:
+        for key in ((0, td), (1, ta)):
+            if strip.htables.get(key) != src.htables.get(key):
+                return False
+    return True
+
+
+def changed_rows(before, after, chunk=256):
+    """Row ranges [(y1, y2), ...] where after differs from before"""
+    h = before.shape[0]
+    changed = np.zeros(h, dtype=bool)
+    # In chunks, so the comparison never allocates a full-frame temporary
+    for y in range(0, h, chunk):
+        diff = before[y:y + chunk] != after[y:y + chunk]
+        changed[y:y + chunk] = diff.reshape(diff.shape[0], -1).any(axis=1)
+
+    rows = np.flatnonzero(changed)
+    if rows.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > 1)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]])) + 1
+    return [(int(a), int(b)) for a, b in zip(starts, ends)]
+
+
+def _source_encoding(data):
+    """
+    (mode, Pillow save() options that reproduce the source's tables and
+    sampling, EXIF orientation). read_image already applied the orientation
+    to the pixels, so the copied EXIF says Orientation = 1.
+    """
+    with Image.open(io.BytesIO(data)) as src:
+        options = {"qtables": src.quantization, "subsampling": JpegImagePlugin.get_sampling(src)}
+        for key in ("icc_profile", "dpi"):
+            if key in src.info:
+                options[key] = src.info[key]
+        exif = src.getexif()
+        orientation = exif.get(ORIENTATION_TAG, 1)
+        if "exif" in src.info:
+            if orientation != 1:
+                exif[ORIENTATION_TAG] = 1
+                options["exif"] = exif.tobytes()
+            else:
+                options["exif"] = src.info["exif"]
+        return src.mode, options, orientation
+
+
+def _encode(image_rgb, **options):
+    buf = io.BytesIO()
+    Image.fromarray(image_rgb).save(buf, "JPEG", **options)
+    return buf.getvalue()
+
+
+def patch_jpeg(data, image_rgb, rows):
+    """
+    Source JPEG bytes with only the MCU rows covering `rows` re-encoded from
+    image_rgb (same size as the source). Returns None if the source can't be
+    patched.
+    """
+    try:
+        src = _parse(data)
+        mode, options, orientation = _source_encoding(data)
+    except (ValueError, IndexError, OSError):
+        return None
+    # Rotated sources decode rotated: their blocks don't line up with image_rgb
+    if (orientation != 1 or src.sof != 0xC0 or not src.restart_interval or mode != "RGB" or options["subsampling"] == -1
+            or len(src.components) != 3 or len(src.scan_components) != 3
+            or image_rgb.shape[:2] != (src.height, src.width)):
+        return None
+
+    mcu_w = 8 * max(c[1] for c in src.components)
+    mcu_h = 8 * max(c[2] for c in src.components)
+    per_row = ceil(src.width / mcu_w)
+    mcu_rows = ceil(src.height / mcu_h)
+    dri = src.restart_interval
+
+    dirty = np.zeros(mcu_rows, dtype=bool)
+    for y1, y2 in rows:
+        dirty[y1 // mcu_h:ceil(y2 / mcu_h)] = True
+    if not dirty.any():
+        return bytes(data)
+    if dirty.mean() > MAX_PATCH_FRACTION:
+        return None
+
+    # Runs of MCU rows that start and end on restart interval boundaries
+    align = dri // gcd(dri, per_row)
+    runs = []
+    for r in np.flatnonzero(dirty):
+        r0 = r // align * align
+        r1 = min(mcu_rows, (r // align + 1) * align)
+        if runs and r0 <= runs[-1][1]:
+            runs[-1] = (runs[-1][0], max(runs[-1][1], r1))
+        else:
+            runs.append((r0, r1))
+
+    segments = _RST.split(data[src.scan_start:src.scan_end])
+    if len(segments) != ceil(per_row * mcu_rows / dri):
+        return None
+
+    options.pop("exif", None)
+    options.pop("icc_profile", None)
+    for r0, r1 in runs:
+        strip = np.ascontiguousarray(image_rgb[r0 * mcu_h:min(src.height, r1 * mcu_h)])
+        strip_data = _encode(strip, restart_marker_blocks=dri, **options)
+        strip_info = _parse(strip_data)
+        if not _compatible(src, strip_info):
+            return None
+        strip_segments = _RST.split(strip_data[strip_info.scan_start:strip_info.scan_end])
+        k0 = r0 * per_row // dri
+        if len(strip_segments) != ceil((r1 - r0) * per_row / dri):
+            return None
+        segments[k0:k0 + len(strip_segments)] = strip_segments
+
+    # Re-join the intervals with RST0..RST7 numbered in sequence
+    parts = [segments[0]]
+    for k, segment in enumerate(segments[1:]):
+        parts.append(bytes((0xFF, 0xD0 + k % 8)))
+        parts.append(segment)
+    return b"".join((data[:src.scan_start], *parts, data[src.scan_end:]))
+
+
+def is_jpeg(path):
+    return Path(path).suffix.lower() in JPEG_EXTENSIONS
+
+
+def write_output(output_path, image_rgb, source_path, rows):
+    """
+    Write image_rgb as output_path. JPEG -> JPEG keeps the source's compressed
+    blocks outside `rows` when possible. Returns MODE_PATCHED, MODE_REENCODED
+    or MODE_FULL (not JPEG to JPEG - plain write_image).
+    """
+    if not (is_jpeg(source_path) and is_jpeg(output_path)):
+        write_image(output_path, image_rgb)
+        return MODE_FULL
+
+    data = Path(source_path).read_bytes()
+    out = patch_jpeg(data, image_rgb, rows)
+    mode = MODE_PATCHED
+    if out is None:
+        mode = MODE_REENCODED
+        try:
+            source_mode, options, _ = _source_encoding(data)
+        except OSError:
+            source_mode = None
+        if source_mode != "RGB":
+            # Grayscale/CMYK tables don't fit an RGB encode
+            options = {"quality": 95}
+        elif options["subsampling"] == -1:
+            del options["subsampling"]
+        out = _encode(np.ascontiguousarray(image_rgb), restart_marker_rows=1, **options)
+    Path(output_path).write_bytes(out)
+    return mode
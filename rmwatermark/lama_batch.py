@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Batched LaMa inference.
+
+SimpleLama.__call__ runs one crop per forward pass. lama_inpaint_batch()
+pads several crops/masks to a common shape, runs a single batched forward
+pass through the underlying TorchScript model and splits the results back
+out at their original sizes.
+
+BatchingInpainter collects crops submitted concurrently by several threads
+(one per image being processed) into such batches. Callers that care about
+latency simply don't use it, or set batch_size=1 / max_wait=0.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from PIL import Image
+
+# LaMa needs H and W to be multiples of 8
+PAD_MODULO = 8
+
+# Don't batch crops whose area is less than 1/MAX_PAD_RATIO of the padded canvas
+MAX_PAD_RATIO = 2.0
+
+
+def _ceil_modulo(value, mod):
+    return -(-value // mod) * mod
+
+
+def _group_by_shape(shapes):
+    """Split item indices into groups that pad to a common canvas without too much waste"""
+    order = sorted(range(len(shapes)), key=lambda i: shapes[i][0] * shapes[i][1], reverse=True)
+    groups = []
+    for i in order:
+        h, w = shapes[i]
+        for group in groups:
+            gh = max(group["h"], h)
+            gw = max(group["w"], w)
+            if gh * gw <= MAX_PAD_RATIO * h * w:
+                group["items"].append(i)
+                group["h"], group["w"] = gh, gw
+                break
+        else:
+            groups.append({"items": [i], "h": h, "w": w})
+    return groups
+
+
+def _forward(model, crops, masks, height, width):
+    """One batched forward pass; all crops are padded to (height, width)"""
+    import torch
+
+    n = len(crops)
+    images = np.empty((n, 3, height, width), dtype=np.float32)
+    mask_batch = np.empty((n, 1, height, width), dtype=np.float32)
+
+    for i, (crop, mask) in enumerate(zip(crops, masks)):
+        h, w = crop.shape[:2]
+        # Same symmetric padding simple_lama uses for its modulo-8 padding
+        padded = np.pad(crop, ((0, height - h), (0, width - w), (0, 0)), mode='symmetric')
+        images[i] = padded.transpose(2, 0, 1) / 255.0
+        padded_mask = np.pad(mask, ((0, height - h), (0, width - w)), mode='symmetric')
+        mask_batch[i, 0] = padded_mask > 0
+
+    device = model.device
+    with torch.inference_mode():
+        output = model.model(torch.from_numpy(images).to(device), torch.from_numpy(mask_batch).to(device))
+        output = output.permute(0, 2, 3, 1).detach().cpu().numpy()
+
+    output = np.clip(output * 255, 0, 255).astype(np.uint8)
+    return [output[i, :crop.shape[0], :crop.shape[1]] for i, crop in enumerate(crops)]
+
+
+def lama_inpaint_batch(model, crops, masks):
+    """
+    Inpaint a list of RGB crops with their masks using as few forward passes as possible.
+    Returns a list of RGB uint8 arrays, same sizes as the crops.
+    """
+    if not hasattr(model, "model"):
+        # Not a SimpleLama - no access to the raw network, run one by one
+        return [np.array(model(Image.fromarray(c), Image.fromarray(m))) for c, m in zip(crops, masks)]
+
+    results = [None] * len(crops)
+    for group in _group_by_shape([c.shape[:2] for c in crops]):
+        height = _ceil_modulo(group["h"], PAD_MODULO)
+        width = _ceil_modulo(group["w"], PAD_MODULO)
+        outputs = _forward(model,
+                           [crops[i] for i in group["items"]],
+                           [masks[i] for i in group["items"]],
+                           height, width)
+        for i, out in zip(group["items"], outputs):
+            results[i] = out
+    return results
+
+
+class BatchingInpainter:
+    """
+    Collects inpaint() calls from many threads into batched forward passes.
+
+    A batch is run as soon as batch_size requests are waiting, or max_wait
+    seconds after the first one arrived, whichever comes first.
+    """
+
+    def __init__(self, model_provider, batch_size=4, max_wait=0.05):
+        self.model_provider = model_provider
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+
+        self._pending = []  # (crop, mask, future, arrival_time)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def inpaint(self, crop, mask):
+        """Inpaint one crop (blocks until its batch has run)"""
+        if self.batch_size <= 1 or self.max_wait <= 0:
+            return lama_inpaint_batch(self.model_provider(), [crop], [mask])[0]
+
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchingInpainter is closed")
+            self._pending.append((crop, mask, future, time.perf_counter()))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="lama-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future.result()
+
+    def close(self):
+        """Stop the batching thread after flushing anything still pending"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if self._pending:
+                    deadline = self._pending[0][3] + self.max_wait
+                    remaining = deadline - time.perf_counter()
+                    if len(self._pending) >= self.batch_size or remaining <= 0 or self._closed:
+                        batch = self._pending[:self.batch_size]
+                        del self._pending[:self.batch_size]
+                        return batch
+                    self._cond.wait(remaining)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                results = lama_inpaint_batch(self.model_provider(),
+                                             [b[0] for b in batch],
+                                             [b[1] for b in batch])
+                for (_, _, future, _), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent batch manifest for resumable runs.
+
+Every finished image is recorded in an SQLite database in the output
+folder: input path, size, mtime and a content fingerprint, the settings
+it was processed with, the detected region, timing, write mode and status
+(with the error message for failures). A later run with the same settings
+skips inputs that are recorded as done, unchanged, and whose output still
+exists; failed and changed ones are processed again.
+
+Rows are buffered and written in one transaction every CHECKPOINT_ITEMS
+items or CHECKPOINT_SECONDS, so the manifest costs next to nothing per
+image; a crash loses at most the last checkpoint, whose images are then
+simply redone.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+MANIFEST_NAME = ".rmwatermark-manifest.sqlite"
+
+CHECKPOINT_ITEMS = 64
+CHECKPOINT_SECONDS = 2.0
+
+# Bytes read from each end of a file for its fingerprint
+FINGERPRINT_BYTES = 64 * 1024
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    description TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    input_path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    fingerprint TEXT,
+    settings_key TEXT,
+    output_path TEXT,
+    status TEXT,
+    error TEXT,
+    region TEXT,
+    detected INTEGER,
+    backend TEXT,
+    write_mode TEXT,
+    seconds REAL,
+    updated_at REAL
+);
+"""
+
+
+def fingerprint(path, size=None):
+    """Cheap content fingerprint: size plus the first and last FINGERPRINT_BYTES"""
+    size = os.path.getsize(path) if size is None else size
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def settings_key(settings, jpeg_patch=False, lama_precision=None):
+    """
+    Stable key for RemovalSettings and the output options, including the
+    logo and template files' identity and the LaMa CPU precision (bf16
+    changes the output)
+    """
+    description = repr(settings) + f" jpeg_patch={bool(jpeg_patch)}"
+    if settings.use_lama:
+        description += f" lama_precision={lama_precision or 'fp32'}"
+    files = (("logo_file", settings.logo.path if settings.logo is not None else None),
+             ("template_file", settings.template))
+    for name, path in files:
+        if path is None:
+            continue
+        try:
+            st = os.stat(path)
+            description += f" {name}=({os.path.abspath(path)}, {st.st_size}, {st.st_mtime_ns})"
+        except OSError:
+            pass
+    return hashlib.sha1(description.encode("utf-8")).hexdigest()[:16], description
+
+
+class Manifest:
+    """Job manifest of one output folder for one settings snapshot"""
+
+    def __init__(self, output_folder, settings, jpeg_patch=False, lama_precision=None):
+        Path(output_folder).mkdir(parents=True, exist_ok=True)
+        self.path = Path(output_folder) / MANIFEST_NAME
+        self.settings_key, description = settings_key(settings, jpeg_patch, lama_precision)
+        # Rows are written from the reporting thread (check_same_thread off, guarded by _lock)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.execute("INSERT OR IGNORE INTO settings VALUES (?, ?)", (self.settings_key, description))
+        self._db.commit()
+        self._pending_rows = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def pending(self, image_files):
+        """Indices into image_files that still need processing"""
+        rows = {
+            row[0]: row[1:] for row in self._db.execute(
+                "SELECT input_path, size, mtime_ns, fingerprint, output_path FROM jobs "
+                "WHERE status = ? AND settings_key = ?", (STATUS_DONE, self.settings_key))
+        }
+        todo = []
+        for i, path in enumerate(image_files):
+            row = rows.get(os.path.abspath(path))
+            if row is None or not self._unchanged(path, *row):
+                todo.append(i)
+        return todo
+
+    @staticmethod
+    def _unchanged(path, size, mtime_ns, digest, output_path):
+        try:
+            st = os.stat(path)
+            if not os.path.exists(output_path) or st.st_size != size:
+                return False
+            # Same mtime: trust it; touched/copied: compare content
+            return st.st_mtime_ns == mtime_ns or fingerprint(path, st.st_size) == digest
+        except OSError:
+            return False
+
+    def record(self, item):
+        """Buffer the outcome of a BatchItem; checkpoints when due"""
+        path = os.path.abspath(item.path)
+        try:
+            st = os.stat(path)
+            size, mtime_ns, digest = st.st_size, st.st_mtime_ns, fingerprint(path, st.st_size)
+        except OSError:
+            size = mtime_ns = digest = None
+
+        result = item.result
+        row = (
+            path, size, mtime_ns, digest, self.settings_key, os.path.abspath(item.output_path),
+            STATUS_DONE if item.ok else STATUS_FAILED, item.error,
+            json.dumps(list(result.region)) if result is not None and result.region else None,
+            int(result.detected) if result is not None else None,
+            result.backend if result is not None else None,
+            item.write_mode, item.seconds, time.time(),
+        )
+        with self._lock:
+            self._pending_rows.append(row)
+            due = (len(self._pending_rows) >= CHECKPOINT_ITEMS
+                   or time.monotonic() - self._last_flush >= CHECKPOINT_SECONDS)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows in one transaction"""
+        with self._lock:
+            rows, self._pending_rows = self._pending_rows, []
+            self._last_flush = time.monotonic()
+            if not rows:
+                return
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                     rows)
+
+    def close(self):
+        self.flush()
+        self._db.close()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight instrumentation: named spans, counters and logging setup.
+
+The engine and the batch runners time every stage of an image with
+metrics.span("detect") etc. and count notable events (OpenCV fallbacks,
+detection misses, errors) with metrics.count(...). A span costs two clock
+reads and a lock, so it is always on. With track_memory, each span also
+records the peak of Python/numpy allocations made while it ran
+(tracemalloc; approximate when stages run concurrently).
+
+A Metrics object exports a JSON-able report, CSV, and Prometheus text
+exposition format; serve_prometheus() publishes the latter over HTTP so
+long batches can be scraped while they run.
+
+Progress messages go through the standard logging module (logger
+"rmwatermark"); setup_logging() picks the level, so they can be silenced.
+"""
+
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Recent samples kept per span for percentiles
+SAMPLES_PER_SPAN = 2048
+
+LOG_LEVEL_ENV = "RMWATERMARK_LOG_LEVEL"
+LOG_LEVELS = ("debug", "info", "warning", "error")
+
+PROMETHEUS_PREFIX = "rmwatermark"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Counter names used across the package
+FALLBACK_OPENCV = "fallback_opencv"        # LaMa failed, OpenCV used instead
+DETECTION_MISS = "detection_miss"          # auto mode found nothing, default region used
+DETECTION_CACHE_HIT = "detection_cache_hit"
+TILED_INPAINT = "tiled_inpaint"
+IMAGE_ERRORS = "image_errors"              # image failed to decode, process or write
+CROP_PIXELS = "crop_pixels"                # pixels in the context crops sent to the inpainter
+MASK_PIXELS = "mask_pixels"                # of which masked
+MASK_BOX_PIXELS = "mask_box_pixels"        # masked with the plain (dilated) boxes, before stroke refinement
+
+
+def setup_logging(level=None):
+    """
+    Send rmwatermark log messages to stderr as plain lines.
+    level: name or number; default from $RMWATERMARK_LOG_LEVEL, else INFO.
+    """
+    level = level or os.environ.get(LOG_LEVEL_ENV, "INFO")
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    logger = logging.getLogger("rmwatermark")
+    if not any(getattr(h, "_rmwatermark", False) for h in logger.handlers):
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        handler._rmwatermark = True
+        logger.addHandler(handler)
+    logger.setLevel(level)
+    return logger
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None if unknown"""
+    try:
+        import resource
+    except ImportError:
+        # Windows: psutil, if installed, knows the peak working set
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Span:
+    __slots__ = ("count", "total", "max", "peak_bytes", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.peak_bytes = 0
+        self.samples = deque(maxlen=SAMPLES_PER_SPAN)
+
+    def add(self, seconds, peak_bytes=0):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.peak_bytes = max(self.peak_bytes, peak_bytes)
+        self.samples.append(seconds)
+
+
+class Metrics:
+    """Thread-safe span timings and counters of one run (or one app session)"""
+
+    def __init__(self, track_memory=False, forward=False):
+        self.track_memory = track_memory
+        self.forward = forward
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.started = time.time()
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        # With forward: recorded since the last drain(), for worker processes to ship to the parent
+        self._events = []
+
+    @contextmanager
+    def span(self, name):
+        """Time the enclosed block as stage `name`"""
+        base = 0
+        if self.track_memory:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - t0
+            peak = max(0, tracemalloc.get_traced_memory()[1] - base) if self.track_memory else 0
+            self.add_span(name, seconds, peak)
+
+    def add_span(self, name, seconds, peak_bytes=0):
+        with self._lock:
+            span = self._spans.get(name)
+            if span is None:
+                span = self._spans[name] = _Span()
+            span.add(seconds, peak_bytes)
+            if self.forward:
+                self._events.append((name, seconds, peak_bytes))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+            if self.forward:
+                self._events.append((name, None, n))
+
+    def drain(self):
+        """Events recorded since the last drain, for merge() in another process"""
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def merge(self, events):
+        for name, seconds, value in events:
+            if seconds is None:
+                self.count(name, value)
+            else:
+                self.add_span(name, seconds, value)
+
+    def counter(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def report(self):
+        """JSON-able dict: per-span stats, counters and process peak RSS"""
+        with self._lock:
+            spans = {name: (s.count, s.total, s.max, s.peak_bytes, np.array(s.samples))
+                     for name, s in self._spans.items()}
+            counters = dict(self._counters)
+
+        report = {"started": self.started, "seconds": round(time.time() - self.started, 3),
+                  "spans": {}, "counters": counters}
+        for name, (count, total, max_s, peak, samples) in spans.items():
+            p50, p90, p99 = np.percentile(samples, (50, 90, 99)) if samples.size else (0.0, 0.0, 0.0)
+            report["spans"][name] = {
+                "count": count,
+                "total_s": round(total, 4),
+                "mean_ms": round(total / count * 1000, 3),
+                "p50_ms": round(p50 * 1000, 3),
+                "p90_ms": round(p90 * 1000, 3),
+                "p99_ms": round(p99 * 1000, 3),
+                "max_ms": round(max_s * 1000, 3),
+                "peak_mem_mb": round(peak / (1024 * 1024), 2) if self.track_memory else None,
+            }
+        rss = peak_rss_bytes()
+        report["peak_rss_mb"] = round(rss / (1024 * 1024), 1) if rss else None
+        return report
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_csv(self, path):
+        """One row per span, then one per counter"""
+        report = self.report()
+        columns = ("count", "total_s", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms", "peak_mem_mb")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(("kind", "name") + columns)
+            for name, st in report["spans"].items():
+                writer.writerow(("span", name) + tuple(st[c] for c in columns))
+            for name, value in sorted(report["counters"].items()):
+                writer.writerow(("counter", name, value) + ("",) * (len(columns) - 1))
+
+    def prometheus_text(self):
+        """Current state in Prometheus text exposition format"""
+        report = self.report()
+        p = PROMETHEUS_PREFIX
+        lines = [
+            f"# HELP {p}_stage_seconds Time spent per pipeline stage.",
+            f"# TYPE {p}_stage_seconds summary",
+        ]
+        for name, st in report["spans"].items():
+            for q, key in (("0.5", "p50_ms"), ("0.9", "p90_ms"), ("0.99", "p99_ms")):
+                lines.append(f'{p}_stage_seconds{{stage="{name}",quantile="{q}"}} {st[key] / 1000:.6f}')
+            lines.append(f'{p}_stage_seconds_sum{{stage="{name}"}} {st["total_s"]:.6f}')
+            lines.append(f'{p}_stage_seconds_count{{stage="{name}"}} {st["count"]}')
+        if self.track_memory:
+            lines.append(f"# HELP {p}_stage_peak_bytes Peak allocation during one call of a stage.")
+            lines.append(f"# TYPE {p}_stage_peak_bytes gauge")
+            for name, st in report["spans"].items():
+                lines.append(f'{p}_stage_peak_bytes{{stage="{name}"}} {int(st["peak_mem_mb"] * 1024 * 1024)}')
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"# TYPE {p}_{name}_total counter")
+            lines.append(f"{p}_{name}_total {value}")
+        if report["peak_rss_mb"] is not None:
+            lines.append(f"# TYPE {p}_peak_rss_bytes gauge")
+            lines.append(f"{p}_peak_rss_bytes {int(report['peak_rss_mb'] * 1024 * 1024)}")
+        return "\n".join(lines) + "\n"
+
+    def format(self):
+        """Human readable table"""
+        report = self.report()
+        lines = [f"{'stage':<10} {'calls':>6} {'total':>8} {'p50':>9} {'p90':>9} {'max':>9}"]
+        for name, st in report["spans"].items():
+            lines.append(f"{name:<10} {st['count']:>6} {st['total_s']:>7.2f}s {st['p50_ms']:>7.1f}ms "
+                         f"{st['p90_ms']:>7.1f}ms {st['max_ms']:>7.1f}ms")
+        if report["counters"]:
+            lines.append(", ".join(f"{name}={value}" for name, value in sorted(report["counters"].items())))
+        return "\n".join(lines)
+
+
+def serve_prometheus(metrics, port, host="127.0.0.1"):
+    """Serve metrics.prometheus_text() at http://host:port/metrics from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy LaMa model loading.
+
+Importing torch and building SimpleLama takes several seconds, so nothing in
+this module touches them until the model is actually needed. The GUI calls
+start_warmup() once its window is up; processing code calls get_model(),
+which blocks until the background load has finished.
+"""
+
+import importlib.util
+import logging
+import os
+import sys
+import threading
+import time
+
+# Only checks that the package is installed - does NOT import torch
+LAMA_AVAILABLE = importlib.util.find_spec("simple_lama_inpainting") is not None
+
+log = logging.getLogger(__name__)
+
+STATUS_IDLE = "idle"
+STATUS_LOADING = "loading"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_thread = None
+_model = None
+_status = STATUS_IDLE if LAMA_AVAILABLE else STATUS_FAILED
+_load_seconds = None
+_torch_threads = None
+_cpu_options = None
+
+
+def set_torch_threads(num_threads):
+    """
+    Limit torch intra-op threads (call before start_warmup, e.g. in batch workers).
+    Also sets OMP/MKL env vars so the limit holds from the moment torch is imported.
+    """
+    global _torch_threads
+    _torch_threads = num_threads
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    if "torch" in sys.modules:
+        sys.modules["torch"].set_num_threads(num_threads)
+
+
+def set_cpu_options(options):
+    """
+    Run LaMa through lama_cpu.optimize_for_cpu with these CpuOptions (None = as shipped).
+    Call before start_warmup.
+    """
+    global _cpu_options
+    _cpu_options = options
+
+
+def cpu_options():
+    return _cpu_options
+
+
+def _load_model():
+    """Import simple_lama_inpainting and build the model (runs in the warm-up thread)"""
+    global _model, _status, _load_seconds
+    start = time.perf_counter()
+    try:
+        from simple_lama_inpainting import SimpleLama
+        if _torch_threads:
+            import torch
+            torch.set_num_threads(_torch_threads)
+        if _cpu_options is not None and _cpu_options.interop_threads:
+            # Before the model runs anything in parallel
+            from .lama_cpu import set_interop_threads
+            set_interop_threads(_cpu_options.interop_threads)
+        model = SimpleLama()
+        if _cpu_options is not None:
+            from .lama_cpu import optimize_for_cpu
+            model = optimize_for_cpu(model, _cpu_options)
+        _load_seconds = time.perf_counter() - start
+        _model = model
+        _status = STATUS_READY
+        log.info("✅ LaMa model loaded in %.1fs", _load_seconds)
+    except Exception as e:
+        _status = STATUS_FAILED
+        log.warning("⚠️ LaMa not available (%s), falling back to OpenCV inpainting", e)
+    finally:
+        _ready.set()
+
+
+def start_warmup():
+    """Start loading the model in a background thread (no-op if already started)"""
+    global _thread, _status
+    if not LAMA_AVAILABLE:
+        _ready.set()
+        return None
+
+    with _lock:
+        if _thread is None:
+            _status = STATUS_LOADING
+            _thread = threading.Thread(target=_load_model, name="lama-warmup", daemon=True)
+            _thread.start()
+        return _thread
+
+
+def get_model(timeout=None):
+    """
+    Return the shared SimpleLama instance, waiting for the warm-up to finish.
+    Returns None if LaMa is not installed, failed to load, or timeout expired.
+    """
+    if not LAMA_AVAILABLE:
+        return None
+    start_warmup()
+    _ready.wait(timeout)
+    return _model
+
+
+def model_status():
+    """One of STATUS_IDLE / STATUS_LOADING / STATUS_READY / STATUS_FAILED"""
+    return _status
+
+
+def load_seconds():
+    """Seconds spent importing torch and building the model, or None if not loaded"""
+    return _load_seconds
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+Multi-process batch execution.
+
+Each worker process loads LaMa once (warm-up starts as soon as the worker
+boots) and then pulls jobs from its own queue, so the parent knows which
+jobs every process holds: when one dies (segfault, OOM killer) its jobs
+are failed and a fresh worker takes its place. Pixels never go through
+pickle: the parent decodes every image straight into a SharedMemory block,
+the worker processes it and writes the result back into the same block,
+and the parent encodes it to disk. Only small (index, name, shape)
+messages travel through the queues; each result also carries the stage
+timings the worker recorded, merged into the parent's Metrics.
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from . import model as lama_model
+from .batch import BatchItem, BatchSummary, write_result
+from .engine import JobResult
+from .jpeg_patch import changed_rows
+from .metrics import IMAGE_ERRORS, Metrics
+
+# Images decoded ahead per worker (bounds shared-memory usage)
+JOBS_PER_WORKER = 2
+
+log = logging.getLogger(__name__)
+
+
+def default_torch_threads(workers):
+    """Split the machine's cores evenly between workers"""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _worker_loop(engine, job_queue, result_queue, settings, jpeg_patch=False):
+    """Process jobs until None arrives"""
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        index, shm_name, shape = job
+        shm = image = None
+        try:
+            shm = shared_memory.SharedMemory(name=shm_name)
+            image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            if jpeg_patch and settings.logo is not None:
+                result = engine.process(image, settings)
+                # The input is about to be overwritten - diff it now for JPEG patching
+                rows = changed_rows(image, result.image)
+                image[...] = result.image
+            else:
+                # Straight into shared memory: only the pasted area is written
+                result = engine.process(image, settings, out=image)
+                rows = [(result.box[1], result.box[3])] if jpeg_patch else None
+            del image
+            result.image = None
+            result_queue.put((index, True, None, result.region, result.detected, result.backend,
+                              result.model_shape, result.cache_hit, result.confidence, result.box, rows,
+                              engine.metrics.drain()))
+        except Exception as e:
+            result_queue.put((index, False, str(e), None, False, None, None, None, None, None, None,
+                              engine.metrics.drain()))
+        finally:
+            # No views of the block may be left when it is closed
+            image = None
+            if shm is not None:
+                shm.close()
+
+
+def _worker_main(job_queue, result_queue, settings, torch_threads, lama_batch_size, lama_max_wait,
+                 detect_cache, jpeg_patch, track_memory, log_level, cpu_options):
+    """Worker process: warm up the model once, then process jobs from the queue"""
+    from . import model
+    from .detect_cache import DetectionCache
+    from .engine import WatermarkEngine
+    from .lama_batch import BatchingInpainter
+    from .metrics import setup_logging
+
+    setup_logging(log_level)
+    model.set_torch_threads(torch_threads)
+    model.set_cpu_options(cpu_options)
+    cv2.setNumThreads(torch_threads)
+    if settings.use_lama:
+        model.start_warmup()
+
+    # Each worker keeps its own detection cache
+    engine = WatermarkEngine(metrics=Metrics(track_memory, forward=True))
+    if detect_cache and settings.auto_mode:
+        engine = engine.clone(detection_cache=DetectionCache())
+
+    if lama_batch_size <= 1 or not settings.use_lama:
+        _worker_loop(engine, job_queue, result_queue, settings, jpeg_patch)
+        return
+
+    # Several threads per worker so their crops can share batched forward passes
+    inpainter = BatchingInpainter(model.get_model, lama_batch_size, lama_max_wait)
+    engine = engine.clone(inpainter=inpainter)
+    threads = [
+        threading.Thread(target=_worker_loop, args=(engine, job_queue, result_queue, settings, jpeg_patch))
+        for _ in range(lama_batch_size)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    inpainter.close()
+
+
+def _decode_to_shared(path):
+    """Decode an image file into a new SharedMemory block (RGB). Returns (shm, array)"""
+    data = np.fromfile(str(path), dtype=np.uint8)
+    bgr = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise IOError(f"Cannot read image: {path}")
+
+    shm = shared_memory.SharedMemory(create=True, size=bgr.nbytes)
+    image = np.ndarray(bgr.shape, dtype=np.uint8, buffer=shm.buf)
+    cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=image)
+    return shm, image
+
+
+class _Worker:
+    """One worker process, its job queue and the indices it holds"""
+
+    def __init__(self, ctx, args):
+        self.jobs = ctx.Queue()
+        self.held = set()
+        self.process = ctx.Process(target=_worker_main, args=(self.jobs,) + args, daemon=True)
+        self.process.start()
+
+
+def run_batch_parallel(image_files, output_folder, settings, workers, torch_threads=None, on_progress=None,
+                       lama_batch_size=1, lama_max_wait=0.05, detect_cache=True, jpeg_patch=False, metrics=None):
+    """
+    Same contract as batch.run_batch, spread over `workers` processes.
+    Results are written and reported in input order.
+    """
+    torch_threads = torch_threads or default_torch_threads(workers)
+    metrics = metrics or Metrics()
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+
+    summary = BatchSummary(total=len(image_files))
+    start = time.perf_counter()
+
+    # spawn: safe with torch and Tk threads in the parent, and the same on Windows
+    ctx = mp.get_context("spawn")
+    result_queue = ctx.Queue()
+    worker_args = (result_queue, settings, torch_threads, lama_batch_size, lama_max_wait, detect_cache, jpeg_patch,
+                   metrics.track_memory, logging.getLogger("rmwatermark").getEffectiveLevel(),
+                   lama_model.cpu_options())
+    pool = [_Worker(ctx, worker_args) for _ in range(workers)]
+
+    in_flight = {}     # index -> (shm, array)
+    owners = {}        # index -> _Worker holding it
+    started = {}       # index -> decode start time
+    finished = {}      # index -> BatchItem, waiting for earlier items
+    next_submit = 0
+    next_report = 0
+    per_worker = max(1, lama_batch_size) * JOBS_PER_WORKER
+
+    def output_path_for(index):
+        return str(Path(output_folder) / Path(image_files[index]).name)
+
+    def release(index):
+        shm, _ = in_flight.pop(index)
+        owners.pop(index).held.discard(index)
+        started.pop(index, None)
+        shm.close()
+        shm.unlink()
+
+    def replace_dead_workers():
+        for slot, worker in enumerate(pool):
+            if worker.process.is_alive():
+                continue
+            error = f"Batch worker process exited unexpectedly (exit code {worker.process.exitcode})"
+            log.error("❌ %s, %d images lost, starting a new worker", error, len(worker.held))
+            for index in sorted(worker.held):
+                metrics.count(IMAGE_ERRORS)
+                finished[index] = BatchItem(index, image_files[index], output_path_for(index), False, error=error)
+                release(index)
+            pool[slot] = _Worker(ctx, worker_args)
+
+    try:
+        while next_report < summary.total:
+            # Keep every worker's queue topped up
+            while next_submit < summary.total:
+                worker = min(pool, key=lambda w: len(w.held))
+                if len(worker.held) >= per_worker:
+                    break
+                index = next_submit
+                next_submit += 1
+                path = image_files[index]
+                started[index] = time.perf_counter()
+                try:
+                    with metrics.span("decode"):
+                        shm, image = _decode_to_shared(path)
+                except Exception as e:
+                    metrics.count(IMAGE_ERRORS)
+                    log.error("Error: %s: %s", path, e)
+                    finished[index] = BatchItem(index, path, output_path_for(index), False, error=str(e))
+                    continue
+                in_flight[index] = (shm, image)
+                owners[index] = worker
+                worker.held.add(index)
+                worker.jobs.put((index, shm.name, image.shape))
+
+            # Report everything that is complete, in order
+            while next_report in finished:
+                item = finished.pop(next_report)
+                summary.add(item)
+                next_report += 1
+                if on_progress:
+                    on_progress(next_report, summary.total, item)
+
+            if next_report >= summary.total or not in_flight:
+                continue
+
+            try:
+                (index, ok, error, region, detected, backend, model_shape, cache_hit, confidence, box,
+                 rows, events) = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                replace_dead_workers()
+                continue
+
+            metrics.merge(events)
+            if index not in in_flight:
+                continue   # sent just before its worker died - already reported as failed
+            path = image_files[index]
+            out_path = output_path_for(index)
+            if ok:
+                _, image = in_flight[index]
+                try:
+                    with metrics.span("encode"):
+                        mode = write_result(out_path, image, path, rows=rows, jpeg_patch=jpeg_patch)
+                    # Only copy out of shared memory if someone wants to look at it
+                    result_image = image.copy() if on_progress else None
+                    result = JobResult(result_image, region, detected, backend, model_shape, cache_hit,
+                                       box=box, confidence=confidence)
+                    finished[index] = BatchItem(index, path, out_path, True, result=result, write_mode=mode,
+                                                seconds=time.perf_counter() - started.pop(index))
+                except Exception as e:
+                    metrics.count(IMAGE_ERRORS)
+                    log.error("Error: %s: %s", path, e)
+                    finished[index] = BatchItem(index, path, out_path, False, error=str(e))
+            else:
+                metrics.count(IMAGE_ERRORS)
+                log.error("Error: %s: %s", path, error)
+                finished[index] = BatchItem(index, path, out_path, False, error=error)
+            release(index)
+            replace_dead_workers()
+
+    finally:
+        for index in list(in_flight):
+            release(index)
+        # One stop marker per worker thread
+        for worker in pool:
+            for _ in range(max(1, lama_batch_size)):
+                worker.jobs.put(None)
+        for worker in pool:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+    summary.seconds = time.perf_counter() - start
+    return summary
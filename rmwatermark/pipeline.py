@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming batch pipeline.
+
+Instead of decode -> detect -> inpaint -> compose -> encode strictly one
+image after another, every stage runs in its own thread(s) and hands work
+to the next stage through a bounded queue. Disk I/O and JPEG coding then
+overlap with inference (OpenCV and torch release the GIL), and the queue
+bounds keep the number of decoded images in memory small.
+
+Each stage counts busy time and time spent waiting for input (starved) or
+for room in the next queue (blocked), so the bottleneck is easy to spot:
+it is the stage with the highest utilization.
+"""
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .batch import BatchItem, BatchSummary, write_result
+from .detect_cache import DetectionCache
+from .engine import JobResult, RemovalJob, WatermarkEngine
+from .files import read_image
+from .lama_batch import BatchingInpainter
+from .metrics import IMAGE_ERRORS
+
+STAGES = ("decode", "prepare", "infer", "post", "encode")
+
+DEFAULT_STAGE_THREADS = {
+    "decode": 2,
+    "prepare": 1,
+    "infer": 1,
+    "post": 1,
+    "encode": 2,
+}
+
+# Items allowed to wait between two stages
+DEFAULT_QUEUE_SIZE = 4
+
+_STOP = object()
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class _Item:
+    index: int
+    path: str
+    output_path: str
+    image: Optional[np.ndarray] = None
+    job: Optional[RemovalJob] = None
+    result: Optional[JobResult] = None
+    error: Optional[str] = None
+    write_mode: Optional[str] = None
+    started: float = 0.0
+    seconds: Optional[float] = None
+
+
+@dataclass
+class StageStats:
+    """Counters for one stage (times in seconds, summed over its threads)"""
+    name: str
+    threads: int
+    items: int = 0
+    busy: float = 0.0
+    starved: float = 0.0   # waiting for input
+    blocked: float = 0.0   # waiting for room in the next queue
+
+    def utilization(self, wall_seconds):
+        if wall_seconds <= 0:
+            return 0.0
+        return self.busy / (wall_seconds * self.threads)
+
+    def as_dict(self, wall_seconds):
+        return {
+            "threads": self.threads,
+            "items": self.items,
+            "busy_s": round(self.busy, 3),
+            "starved_s": round(self.starved, 3),
+            "blocked_s": round(self.blocked, 3),
+            "utilization": round(self.utilization(wall_seconds), 3),
+        }
+
+
+class _Stage:
+    """N threads moving items from in_queue to out_queue through fn"""
+
+    def __init__(self, name, fn, threads, in_queue, out_queue, metrics=None):
+        self.name = name
+        self.metrics = metrics
+        self.fn = fn
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.stats = StageStats(name, threads)
+        self._lock = threading.Lock()
+        self._alive = threads
+        self._threads = [
+            threading.Thread(target=self._run, name=f"pipeline-{name}-{i}", daemon=True)
+            for i in range(threads)
+        ]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def _run(self):
+        while True:
+            t0 = time.perf_counter()
+            item = self.in_queue.get()
+            t1 = time.perf_counter()
+
+            if item is _STOP:
+                # Let sibling threads see the marker too; the last one forwards it
+                self.in_queue.put(_STOP)
+                with self._lock:
+                    self.stats.starved += t1 - t0
+                    self._alive -= 1
+                    last = self._alive == 0
+                if last:
+                    self.out_queue.put(_STOP)
+                return
+
+            if item.error is None:
+                try:
+                    self.fn(item)
+                except Exception as e:
+                    if self.metrics is not None:
+                        self.metrics.count(IMAGE_ERRORS)
+                    log.error("Error: %s: %s", item.path, e)
+                    item.error = str(e)
+                    # Don't keep big buffers alive for a failed item
+                    item.image = item.job = item.result = None
+            t2 = time.perf_counter()
+
+            self.out_queue.put(item)
+            t3 = time.perf_counter()
+
+            with self._lock:
+                self.stats.items += 1
+                self.stats.starved += t1 - t0
+                self.stats.busy += t2 - t1
+                self.stats.blocked += t3 - t2
+
+
+def parse_stage_threads(text):
+    """'decode=2,encode=3' -> dict merged over DEFAULT_STAGE_THREADS"""
+    threads = dict(DEFAULT_STAGE_THREADS)
+    if not text:
+        return threads
+    for part in text.split(','):
+        name, _, value = part.partition('=')
+        name = name.strip()
+        if name not in STAGES:
+            raise ValueError(f"Unknown pipeline stage: {name} (expected one of {', '.join(STAGES)})")
+        threads[name] = max(1, int(value))
+    return threads
+
+
+def run_pipeline(image_files, output_folder, settings, engine=None, on_progress=None,
+                 stage_threads=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 lama_batch_size=1, lama_max_wait=0.05, detect_cache=True, jpeg_patch=False):
+    """
+    Same contract as batch.run_batch, run as a staged streaming pipeline.
+    Results are reported in input order; summary.stage_stats holds the counters.
+    """
+    threads = dict(DEFAULT_STAGE_THREADS)
+    threads.update(stage_threads or {})
+
+    engine = engine or WatermarkEngine()
+    if detect_cache and settings.auto_mode:
+        engine = engine.clone(detection_cache=DetectionCache())
+    inpainter = None
+    if lama_batch_size > 1 and settings.use_lama:
+        # Enough inference threads to fill a batch
+        inpainter = BatchingInpainter(engine.model_provider, lama_batch_size, lama_max_wait)
+        engine = engine.clone(inpainter=inpainter)
+        threads["infer"] = max(threads["infer"], lama_batch_size)
+
+    Path(output_folder).mkdir(parents=True, exist_ok=True)
+
+    def decode(item):
+        item.started = time.perf_counter()
+        with engine.metrics.span("decode"):
+            item.image = read_image(item.path)
+        if item.image is None:
+            raise IOError(f"Cannot read image: {item.path}")
+
+    def prepare(item):
+        item.job = engine.prepare(item.image, settings)
+
+    def infer(item):
+        engine.inpaint(item.job)
+
+    def post(item):
+        item.result = engine.compose(item.job)
+        item.result.image = engine.apply_logo(item.result.image, settings.logo, inplace=True)
+        item.job = None
+
+    def encode(item):
+        with engine.metrics.span("encode"):
+            item.write_mode = write_result(item.output_path, item.result.image, item.path,
+                                           before=item.image, jpeg_patch=jpeg_patch)
+        item.seconds = time.perf_counter() - item.started
+
+    functions = {"decode": decode, "prepare": prepare, "infer": infer, "post": post, "encode": encode}
+
+    # feed -> decode -> prepare -> infer -> post -> encode -> done
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(STAGES) + 1)]
+    stages = [
+        _Stage(name, functions[name], threads[name], queues[i], queues[i + 1], engine.metrics)
+        for i, name in enumerate(STAGES)
+    ]
+
+    summary = BatchSummary(total=len(image_files))
+    start = time.perf_counter()
+    for stage in stages:
+        stage.start()
+
+    def feed():
+        for i, path in enumerate(image_files):
+            queues[0].put(_Item(i, path, str(Path(output_folder) / Path(path).name)))
+        queues[0].put(_STOP)
+
+    feeder = threading.Thread(target=feed, name="pipeline-feed", daemon=True)
+    feeder.start()
+
+    # Collect results and report them in input order
+    finished = {}
+    next_report = 0
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _STOP:
+                break
+            finished[item.index] = item
+
+            while next_report in finished:
+                done = finished.pop(next_report)
+                next_report += 1
+                item = BatchItem(done.index, done.path, done.output_path, done.error is None,
+                                 error=done.error, image=done.image, result=done.result,
+                                 write_mode=done.write_mode, seconds=done.seconds)
+                summary.add(item)
+                if on_progress:
+                    on_progress(next_report, summary.total, item)
+    finally:
+        if inpainter is not None:
+            inpainter.close()
+
+    summary.seconds = time.perf_counter() - start
+    summary.stage_stats = {s.name: s.stats.as_dict(summary.seconds) for s in stages}
+    return summary
+
+
+def format_stage_stats(stage_stats):
+    """Human readable table of summary.stage_stats, bottleneck marked"""
+    if not stage_stats:
+        return ""
+    bottleneck = max(stage_stats, key=lambda name: stage_stats[name]["utilization"])
+    lines = [f"{'stage':<8} {'threads':>7} {'items':>6} {'busy':>8} {'starved':>8} {'blocked':>8} {'util':>6}"]
+    for name, st in stage_stats.items():
+        mark = "  <- bottleneck" if name == bottleneck else ""
+        lines.append(
+            f"{name:<8} {st['threads']:>7} {st['items']:>6} {st['busy_s']:>7.2f}s "
+            f"{st['starved_s']:>7.2f}s {st['blocked_s']:>7.2f}s {st['utilization'] * 100:>5.0f}%{mark}"
+        )
+    return "\n".join(lines)
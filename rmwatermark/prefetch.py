@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+Background prefetch of decoded images.
+
+The GUI navigator asks for the neighbours of the current image (next N,
+previous M, nearest first). They are decoded in a small thread pool into a
+byte-bounded cache, so paging to them needs no decode. Asking for a new
+neighbourhood cancels the queued work that is no longer wanted. The window
+is trimmed to what fits in the memory cap, estimated from the size of the
+images decoded so far. hits/misses tell how often navigation found the
+image ready (or already in flight).
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .preview import PreviewCache
+
+DEFAULT_PREFETCH_MB = 512
+
+log = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """load_fn(key, path) -> ndarray or None, run in background threads"""
+
+    def __init__(self, load_fn, max_mb=DEFAULT_PREFETCH_MB, workers=2):
+        self.load_fn = load_fn
+        self.cache = PreviewCache(max_mb)
+        self.hits = 0
+        self.misses = 0
+        self._avg_bytes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="prefetch")
+
+    def prefetch(self, entries):
+        """
+        Decode entries [(key, path), ...] (nearest first) in the background.
+        Queued work for keys not in entries is cancelled.
+        """
+        if self._avg_bytes:
+            # Keep room for the image being viewed
+            fit = max(0, self.cache.max_bytes // self._avg_bytes - 1)
+            entries = entries[:fit]
+        wanted = {key for key, _ in entries}
+
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key not in wanted and future.cancel():
+                    del self._pending[key]
+
+            # Submit in priority order - the pool runs them FIFO
+            for key, path in entries:
+                if key in self._pending or self.cache.get(key) is not None:
+                    continue
+                self._pending[key] = self._executor.submit(self._load, key, path)
+
+    def get(self, key, path):
+        """Image for key: prefetched, in flight, or decoded now (blocks - call off the UI thread)"""
+        image = self.cache.get(key)
+        if image is not None:
+            self._count(True)
+            return image
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None and future.cancel():
+                # Still queued - decode it here instead of waiting for a worker
+                del self._pending[key]
+                future = None
+        if future is not None:
+            self._count(True)
+            return future.result()
+
+        self._count(False)
+        return self._load(key, path)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load(self, key, path):
+        try:
+            image = self.load_fn(key, path)
+        except Exception as e:
+            log.warning("Prefetch error: %s: %s", path, e)
+            image = None
+        with self._lock:
+            self._pending.pop(key, None)
+            if image is not None:
+                # Running average of decoded sizes, for the window estimate
+                self._avg_bytes = image.nbytes if not self._avg_bytes else (self._avg_bytes + image.nbytes) // 2
+        if image is not None:
+            self.cache.put(key, image, image.nbytes)
+        return image
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
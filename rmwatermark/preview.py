@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Preview pyramid and display cache for the GUI.
+
+Fitting a 40 MP image to a ~500 px canvas with INTER_AREA reads every
+source pixel. Instead, each image gets a few power-of-two downscaled
+levels, built once (off the UI thread), and the fitted preview is resized
+from the smallest level that is still at least the display size. Fitted
+previews (and pyramids) live in a byte-bounded LRU keyed by
+(file, canvas size), so paging back and forth and window resizes reuse
+them. Nothing here depends on tkinter: the cache is filled from worker
+threads, so it holds numpy arrays only - Tk images must be created and
+dropped on the Tk thread.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+# Stop halving once the next level's longest side would drop below this
+PYRAMID_MIN_SIDE = 256
+
+DEFAULT_CACHE_MB = 256
+
+
+def file_key(path):
+    """Cache key for an image file; changes when the file is rewritten"""
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def build_pyramid(image, min_side=PYRAMID_MIN_SIDE):
+    """Downscaled levels [1/2, 1/4, ...] of image (the full image itself is not included)"""
+    levels = []
+    current = image
+    while max(current.shape[:2]) // 2 >= min_side:
+        h, w = current.shape[:2]
+        current = cv2.resize(current, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+        levels.append(current)
+    return levels
+
+
+def fit_size(shape, canvas_w, canvas_h):
+    """Display (width, height, scale) of an image of shape fitted into the canvas"""
+    h, w = shape[:2]
+    scale = min(canvas_w / w, canvas_h / h)
+    return max(1, int(w * scale)), max(1, int(h * scale)), scale
+
+
+def fit_preview(image, levels, new_w, new_h):
+    """Resize to (new_w, new_h) from the smallest pyramid level that is still large enough"""
+    source = image
+    for level in levels:
+        if level.shape[1] < new_w or level.shape[0] < new_h:
+            break
+        source = level
+    return cv2.resize(source, (new_w, new_h), interpolation=cv2.INTER_AREA)
+
+
+class PreviewCache:
+    """Thread-safe LRU of preview entries, bounded by their total size in bytes"""
+
+    def __init__(self, max_mb=DEFAULT_CACHE_MB):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self.bytes += nbytes
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, size) = self._entries.popitem(last=False)
+                self.bytes -= size
+
+    def pyramid(self, key, image=None):
+        """
+        Cached pyramid for key. If missing and image is given, build and store it
+        (call that from a worker thread). Returns None if missing and no image.
+        """
+        levels = self.get(("pyramid", key))
+        if levels is None and image is not None:
+            levels = build_pyramid(image)
+            self.put(("pyramid", key), levels, sum(level.nbytes for level in levels))
+        return levels
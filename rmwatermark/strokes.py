@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Stroke-accurate watermark masks.
+
+A detected box is mostly background - 'MI VIETNAM.VN' is thin text, a keyed
+logo is full of holes - and every masked pixel is one the inpainter has to
+invent. refine_mask() keeps only the pixels that don't look like the
+background there: the box is filled from the ring of real image around it
+at low resolution (cv2.inpaint on at most MODEL_SIDE px, so it is smooth
+and cheap), and pixels whose Lab colour differs from that estimate by more
+than the ring itself strays from an equally smooth copy of it are strokes -
+with hysteresis, so fainter pixels count where they touch a clear one.
+Specks are dropped and the rest is grown by a few px to take in
+anti-aliasing, soft shadows and JPEG ringing.
+
+When the result covers most of the box anyway (busy texture, a solid
+block) or almost none of it (nothing there), the plain box is kept.
+"""
+
+import cv2
+import numpy as np
+
+# Long side (px) of the box in the low-resolution background estimate
+MODEL_SIDE = 64
+
+# Ring of real image around the box, as a fraction of the box's short side (at least MIN_RING px)
+RING_FRACTION = 0.5
+MIN_RING = 6
+
+# Colour difference (Lab, 0..255 scale) a stroke needs at least, and over the ring's RING_PERCENTILE
+MIN_CONTRAST = 14.0
+RING_PERCENTILE = 98
+RING_FACTOR = 1.2
+
+# Pixels above WEAK_FACTOR x the threshold count when connected to one above it
+WEAK_FACTOR = 0.4
+
+# Blur (fraction of the box's short side) the ring is compared with for its noise level
+NOISE_SIGMA = 0.25
+
+# Growth around the strokes: fraction of the box's short side, at least MIN_GROW px
+GROW_FRACTION = 0.03
+MIN_GROW = 2
+
+# Components smaller than this fraction of the box area are noise
+MIN_SPECK = 0.0005
+
+# Keep the plain box when the strokes cover more / less than this fraction of it
+MAX_FILL = 0.75
+MIN_FILL = 0.01
+
+
+def _background(image, box):
+    """Low-resolution estimate of image (box plus ring) without whatever is inside box"""
+    x, y, w, h = box
+    rh, rw = image.shape[:2]
+    scale = min(1.0, MODEL_SIDE / max(w, h))
+    size = (max(1, round(rw * scale)), max(1, round(rh * scale)))
+    small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    hole = np.zeros(small.shape[:2], np.uint8)
+    hole[int(y * scale):int(np.ceil((y + h) * scale)), int(x * scale):int(np.ceil((x + w) * scale))] = 255
+    filled = cv2.inpaint(small, hole, 3, cv2.INPAINT_TELEA)
+    # The same image blurred to the smoothness of such a fill, for the noise level
+    blurred = cv2.GaussianBlur(small, (0, 0), max(1.0, min(w, h) * scale * NOISE_SIGMA))
+    return (cv2.resize(filled, (rw, rh), interpolation=cv2.INTER_LINEAR),
+            cv2.resize(blurred, (rw, rh), interpolation=cv2.INTER_LINEAR))
+
+
+def refine_mask(image, box):
+    """
+    uint8 mask (255 = watermark) the size of image for the strokes inside box
+    (x, y, w, h), or None to keep the whole box.
+    """
+    ih, iw = image.shape[:2]
+    x, y, w, h = box
+    x1, y1, x2, y2 = max(0, x), max(0, y), min(iw, x + w), min(ih, y + h)
+    if x2 - x1 < 4 or y2 - y1 < 4:
+        return None
+    ring = max(MIN_RING, int(min(x2 - x1, y2 - y1) * RING_FRACTION))
+    rx1, ry1, rx2, ry2 = max(0, x1 - ring), max(0, y1 - ring), min(iw, x2 + ring), min(ih, y2 + ring)
+    if (rx1, ry1, rx2, ry2) == (x1, y1, x2, y2):
+        return None   # no real image around the box to compare with
+
+    region = image[ry1:ry2, rx1:rx2]
+    inner = (x1 - rx1, y1 - ry1, x2 - x1, y2 - y1)
+    ring_mask = np.ones(region.shape[:2], bool)
+    ring_mask[inner[1]:inner[1] + inner[3], inner[0]:inner[0] + inner[2]] = False
+
+    background, lowpass = _background(region, inner)
+    lab = cv2.cvtColor(region, cv2.COLOR_RGB2LAB).astype(np.float32)
+    diff = np.linalg.norm(lab - cv2.cvtColor(background, cv2.COLOR_RGB2LAB), axis=2)
+    # How far the real image strays from a fill that smooth: the ring against its own blur at the box's scale
+    noise = np.linalg.norm(lab[ring_mask] - cv2.cvtColor(lowpass, cv2.COLOR_RGB2LAB)[ring_mask], axis=1)
+    high = max(MIN_CONTRAST, float(np.percentile(noise, RING_PERCENTILE)) * RING_FACTOR)
+
+    # Hysteresis: weak pixels count where they touch a strong one (anti-aliased edges, faint logo parts)
+    bx, by, bw, bh = inner
+    diff = diff[by:by + bh, bx:bx + bw]
+    weak = (diff > high * WEAK_FACTOR).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(weak, connectivity=8)
+    keep = np.zeros(count, bool)
+    keep[np.unique(labels[diff > high])] = True
+    keep &= stats[:, cv2.CC_STAT_AREA] >= max(2, MIN_SPECK * bw * bh)
+    keep[0] = False
+    strokes = keep[labels].astype(np.uint8) * 255
+
+    fill = np.count_nonzero(strokes) / float(bw * bh)
+    if not MIN_FILL <= fill <= MAX_FILL:
+        return None
+
+    mask = np.zeros((ih, iw), np.uint8)
+    mask[y1:y2, x1:x2] = strokes
+    grow = max(MIN_GROW, int(round(min(bw, bh) * GROW_FRACTION)))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * grow + 1, 2 * grow + 1))
+    gx1, gy1, gx2, gy2 = max(0, x1 - grow), max(0, y1 - grow), min(iw, x2 + grow), min(ih, y2 + grow)
+    mask[gy1:gy2, gx1:gx2] = cv2.dilate(mask[gy1:gy2, gx1:gx2], kernel)
+    return mask
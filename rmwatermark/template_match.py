@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+"""
+Template-matching watermark detection.
+
+When the watermark is a known image (the bundled logo.jpg, the logo picked in
+the GUI), matching it directly beats the text heuristics in detect.py.
+
+Matching runs on edge orientation, not on grey levels: a logo stamped with
+its white background keyed out and at partial opacity shares almost no
+colours with the file, but its outline is there on any background. Each
+pixel gets the colour gradient's doubled-angle vector (magnitude-weighted
+cos 2θ, sin 2θ - the same for dark-on-light and light-on-dark edges),
+blurred a little so small scale errors still overlap. Random texture has
+random orientations and correlates far less with it than plain gradient
+magnitude does.
+
+Each image is reduced to a COARSE_SIDE px copy and halved into a small
+pyramid; a template width (a fraction of the image width) is searched on
+the level where it is MATCH_WIDTH..2*MATCH_WIDTH px wide, by normalized
+cross-correlation in the frequency domain, and only placements that
+overlap one of detect.WINDOWS (the corners and the centre band) count.
+Few widths are tried: the ones around the logo size found in the previous
+image, which is where a batch from one source keeps finding it; failing
+that, a coarse SWEEP_WIDTHS pass and then LOCAL_STEPS around its winner.
+The image side (FFTs, window sums) is computed once per level, the
+template side once per width and canvas size, kept for the last
+MAX_CANVASES sizes. Scales are compared by how far their peak stands out
+of their own score map (small templates find high but unremarkable peaks
+everywhere); the winner is refined with cv2.matchTemplate at a finer
+resolution and finer scale steps.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from .detect import WINDOWS, Detection
+
+# Long side of the pyramid's finest level
+COARSE_SIDE = 384
+
+# Template widths of the coarse pass, as fractions of the image width (about 30% apart)
+SWEEP_WIDTHS = tuple(float(v) for v in np.geomspace(0.05, 0.45, 9))
+
+# Widths tried around an expected one (the coarse winner or the previous image's logo)
+LOCAL_STEPS = (0.83, 0.91, 1.0, 1.1, 1.21)
+
+# Template FFTs are kept for this many image sizes, template fields for this many widths
+MAX_CANVASES = 4
+MAX_FIELDS = 64
+
+# Templates are matched on the pyramid level where they are at least this wide (px)
+MATCH_WIDTH = 64
+
+# Gaussian sigma (px, at the level matched on) applied to the orientation field
+FIELD_BLUR = 1.5
+
+# Refinement: template long side at most this many px, scales tried around the coarse one
+REFINE_SIDE = 160
+REFINE_SCALES = (0.96, 0.98, 1.0, 1.02, 1.04)
+
+# Same white threshold as the logo background removal
+WHITE_THRESHOLD = 240
+
+# Windows whose field variance is below this fraction of the whole image's are skipped
+FLAT_VARIANCE = 0.05
+
+# Normalized correlation needed to count as found
+MIN_SCORE = 0.45
+
+
+def _load_template(path):
+    """RGB uint8 template; transparent and near-white pixels flattened to white, as stamping keys them out"""
+    rgba = np.array(Image.open(path).convert("RGBA"))
+    rgb = rgba[..., :3].copy()
+    rgb[(rgba[..., 3] == 0) | (rgb > WHITE_THRESHOLD).all(axis=2)] = 255
+    return rgb
+
+
+_CHANNEL_SUM = np.ones((1, 3), np.float32)
+
+
+def orientation_field(rgb):
+    """float32 HxWx2 doubled-angle gradient field of an RGB image, summed over the colour channels"""
+    gx, gy = cv2.Sobel(rgb, cv2.CV_32F, 1, 0), cv2.Sobel(rgb, cv2.CV_32F, 0, 1)
+    # Colour, not grey: a red logo at partial opacity over a dark background barely changes the grey levels.
+    # cv2.transform sums the channels much faster than numpy's axis reductions
+    xx, yy, xy = (cv2.transform(a * b, _CHANNEL_SUM) for a, b in ((gx, gx), (gy, gy), (gx, gy)))
+    magnitude = np.sqrt(xx + yy) + 1e-3
+    field = np.dstack(((xx - yy) / magnitude, 2 * xy / magnitude))
+    return cv2.GaussianBlur(field, (0, 0), FIELD_BLUR)
+
+
+def _colour_copy(image, side):
+    """(RGB copy of at most side px, scale from full resolution to it), area-averaged"""
+    h, w = image.shape[:2]
+    scale = min(1.0, side / max(h, w))
+    # Strided read down to about twice the target, then area averaging: fine
+    # background texture must not alias into edges
+    step = max(1, int(1 / scale) // 2)
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    small = np.ascontiguousarray(image[::step, ::step])
+    if small.shape[1::-1] != size:
+        small = cv2.resize(small, size, interpolation=cv2.INTER_AREA)
+    return small, scale
+
+
+def _level_for(width):
+    """Pyramid level on which a template width px wide at level 0 is matched"""
+    level = 0
+    while width / 2 ** (level + 1) >= MATCH_WIDTH:
+        level += 1
+    return level
+
+
+def _around(fraction):
+    """LOCAL_STEPS widths around fraction, within the sweep's range"""
+    low, high = SWEEP_WIDTHS[0] * LOCAL_STEPS[0], SWEEP_WIDTHS[-1] * LOCAL_STEPS[-1]
+    return [fraction * step for step in LOCAL_STEPS if low <= fraction * step <= high]
+
+
+def _in_windows(shape, th, tw):
+    """Placements of a th x tw template on a level of shape (h, w) that overlap one of detect.WINDOWS"""
+    h, w = shape
+    allowed = np.zeros((h - th + 1, w - tw + 1), bool)
+    for (fx1, fy1, fx2, fy2), _ in WINDOWS.values():
+        allowed[max(0, int(h * fy1) - th + 1):int(np.ceil(h * fy2)),
+                max(0, int(w * fx1) - tw + 1):int(np.ceil(w * fx2))] = True
+    return allowed
+
+
+def _dft(channel, fft_shape):
+    """float32 CCS-packed spectrum of channel, zero-padded to fft_shape"""
+    h, w = channel.shape
+    padded = cv2.copyMakeBorder(channel, 0, fft_shape[0] - h, 0, fft_shape[1] - w, cv2.BORDER_CONSTANT, value=0)
+    return cv2.dft(padded)
+
+
+class _Level:
+    """One pyramid level of an image: orientation field, its FFTs and squared magnitude"""
+
+    def __init__(self, field, fft_shape):
+        self.field = field
+        self.shape = field.shape[:2]
+        self.fft_shape = fft_shape
+        cos, sin = cv2.split(field)
+        self.spectra = [_dft(cos, fft_shape), _dft(sin, fft_shape)]
+        self.squares = cos * cos + sin * sin
+        self.variance = float(cos.var() + sin.var())
+
+    def window_variance(self, th, tw):
+        """Sum of squared deviations (both channels) of every th x tw window with a valid placement"""
+        h, w = self.shape
+        vh, vw = h - th + 1, w - tw + 1
+        # Box filters anchored at the top-left corner = sums over each placement
+        sums = cv2.boxFilter(self.field, -1, (tw, th), anchor=(0, 0), normalize=False,
+                             borderType=cv2.BORDER_CONSTANT)[:vh, :vw]
+        total = cv2.boxFilter(self.squares, -1, (tw, th), anchor=(0, 0), normalize=False,
+                              borderType=cv2.BORDER_CONSTANT)[:vh, :vw]
+        cos, sin = cv2.split(np.ascontiguousarray(sums))
+        total -= (cos * cos + sin * sin) / (th * tw)
+        return np.maximum(total, 0.0)
+
+
+class _Pyramid:
+    """Levels of one image's coarse copy, built as the template widths ask for them"""
+
+    def __init__(self, small, template_shape):
+        self.images = [small]
+        self.levels = {}
+        self.aspect = template_shape[0] / template_shape[1]
+
+    @property
+    def shape(self):
+        return self.images[0].shape[:2]
+
+    def level(self, index):
+        if index not in self.levels:
+            while len(self.images) <= index:
+                self.images.append(cv2.pyrDown(self.images[-1]))
+            image = self.images[index]
+            h, w = image.shape[:2]
+            # Room for the widest template matched on this level, so the FFT size only depends on the image size
+            max_tw = min(2 * MATCH_WIDTH, int(np.ceil(w * SWEEP_WIDTHS[-1] * LOCAL_STEPS[-1]))) + 1
+            max_th = int(np.ceil(max_tw * self.aspect)) + 1
+            fft_shape = (cv2.getOptimalDFTSize(h + max_th), cv2.getOptimalDFTSize(w + max_tw))
+            self.levels[index] = _Level(orientation_field(image), fft_shape)
+        return self.levels[index]
+
+
+class TemplateDetector:
+    """Finds one template image in RGB images; thread-safe, caches template FFTs per image size"""
+
+    def __init__(self, path, min_score=MIN_SCORE):
+        self.path = path
+        self.min_score = min_score
+        self.template = _load_template(path)
+        # (h, w) of the coarse copy -> {(width, fft_h, fft_w): ([template FFT per channel], norm, shape)}
+        self._spectra = OrderedDict()
+        self._lock = threading.Lock()
+        # Template fields by width, for the refinement (batches keep asking for the same few)
+        self._fields = OrderedDict()
+        # Logo width found in the last image (fraction of its width), searched first in the next one
+        self._expected = None
+
+    def _scaled(self, width):
+        """Template orientation field at width px (None if too small)"""
+        with self._lock:
+            field = self._fields.get(width)
+        if field is not None:
+            return field
+        th, tw = self.template.shape[:2]
+        height = int(round(th * width / tw))
+        if min(width, height) < 3:
+            return None
+        field = orientation_field(cv2.resize(self.template, (width, height), interpolation=cv2.INTER_AREA))
+        with self._lock:
+            self._fields[width] = field
+            while len(self._fields) > MAX_FIELDS:
+                self._fields.popitem(last=False)
+        return field
+
+    def _spectrum(self, canvas, width, fft_shape):
+        key = (width,) + fft_shape
+        with self._lock:
+            spectra = self._spectra.get(canvas)
+            if spectra is None:
+                spectra = self._spectra[canvas] = {}
+                while len(self._spectra) > MAX_CANVASES:
+                    self._spectra.popitem(last=False)
+            else:
+                self._spectra.move_to_end(canvas)
+            cached = spectra.get(key)
+        if cached is not None:
+            return cached
+
+        field = self._scaled(width)
+        if field is None:
+            return None
+        field = (field - field.mean(axis=(0, 1))).astype(np.float32)
+        norm = float(np.sqrt((field.astype(np.float64) ** 2).sum()))
+        if norm < 1e-3:
+            return None
+        entry = ([_dft(channel, fft_shape) for channel in cv2.split(field)], norm, field.shape[:2])
+        with self._lock:
+            spectra[key] = entry
+        return entry
+
+    def _coarse(self, pyramid, fractions):
+        """Best (prominence, score, x, y, template width) over the widths in fractions, in level 0 px"""
+        w = pyramid.shape[1]
+        best = (0.0, 0.0, 0, 0, 0)
+        for fraction in fractions:
+            level = _level_for(w * fraction)
+            data = pyramid.level(level)
+            h, lw = data.shape
+            spectrum = self._spectrum(pyramid.shape, int(round(lw * fraction)), data.fft_shape)
+            if spectrum is None:
+                continue
+            template_f, norm, (th, tw) = spectrum
+            if th > h or tw > lw:
+                continue
+            vh, vw = h - th + 1, lw - tw + 1
+            # Correlation = spectrum times the template's conjugate; one inverse transform for both channels
+            product = (cv2.mulSpectrums(data.spectra[0], template_f[0], 0, conjB=True) +
+                       cv2.mulSpectrums(data.spectra[1], template_f[1], 0, conjB=True))
+            numerator = cv2.idft(product, flags=cv2.DFT_REAL_OUTPUT | cv2.DFT_SCALE)[:vh, :vw]
+            variance = data.window_variance(th, tw)
+            score = numerator / (norm * np.sqrt(np.maximum(variance, 1e-6)))
+            # Near-flat windows (solid shapes, sky) correlate with anything; only the detection windows count
+            allowed = _in_windows(data.shape, th, tw)
+            allowed &= variance >= th * tw * data.variance * FLAT_VARIANCE
+            score[~allowed] = 0.0
+
+            y, x = np.unravel_index(int(np.argmax(score)), score.shape)
+            peak = float(score[y, x])
+            # Every other placement is plenty for the score map's spread
+            sample = score[::2, ::2][allowed[::2, ::2]]
+            if sample.size < 2:
+                continue
+            prominence = (peak - float(sample.mean())) / max(float(sample.std()), 1e-6)
+            if prominence > best[0]:
+                factor = 2 ** level
+                best = (prominence, peak, int(x) * factor, int(y) * factor, tw * factor)
+        return best
+
+    def _refine(self, image, box):
+        """(score, (x, y, w, h)) around box (x, y, w, h) at up to REFINE_SIDE px"""
+        h, w = image.shape[:2]
+        x, y, bw, bh = box
+        scale = min(1.0, REFINE_SIDE / max(bw, bh))
+        # Room for the larger scale plus a coarse step of slack on each side
+        slack = int(max(bw, bh) * (REFINE_SCALES[-1] - 1 + 0.1)) + max(4, int(round(max(h, w) / COARSE_SIDE)) * 2)
+        rx1, ry1 = max(0, x - slack), max(0, y - slack)
+        rx2, ry2 = min(w, x + bw + slack), min(h, y + bh + slack)
+        region = image[ry1:ry2, rx1:rx2]
+        if scale < 1.0:
+            region = cv2.resize(region, (max(1, round((rx2 - rx1) * scale)), max(1, round((ry2 - ry1) * scale))),
+                                interpolation=cv2.INTER_AREA)
+        region = orientation_field(region)
+
+        best = (0.0, box)
+        for factor in REFINE_SCALES:
+            template = self._scaled(int(round(bw * factor * scale)))
+            if template is None:
+                continue
+            th, tw = template.shape[:2]
+            if th > region.shape[0] or tw > region.shape[1]:
+                continue
+            scores = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, (px, py) = cv2.minMaxLoc(scores)
+            if score > best[0]:
+                best = (float(score), (rx1 + int(round(px / scale)), ry1 + int(round(py / scale)),
+                                       int(round(tw / scale)), int(round(th / scale))))
+        return best
+
+    def _search(self, small):
+        """Best (prominence, score, x, y, width) on the coarse copy: around the expected width, else a sweep"""
+        pyramid = _Pyramid(small, self.template.shape[:2])
+        expected = self._expected
+        if expected is not None:
+            best = self._coarse(pyramid, _around(expected))
+            if best[1] >= self.min_score * 0.75:
+                return best
+        best = self._coarse(pyramid, SWEEP_WIDTHS)
+        if not best[4]:
+            return best
+        # The sweep's steps are coarse - settle the width among its neighbours
+        return self._coarse(pyramid, _around(best[4] / small.shape[1]))
+
+    def detect(self, image):
+        """Detection for an RGB image; location is "template", scale is matched size / template file size"""
+        h, w = image.shape[:2]
+        small, scale = _colour_copy(image, COARSE_SIDE)
+        _, score, x, y, width = self._search(small)
+        if not width or score < self.min_score * 0.75:
+            return Detection(False, (0, 0, 0, 0), round(score, 3), "template")
+
+        th, tw = self.template.shape[:2]
+        box = (int(x / scale), int(y / scale), int(round(width / scale)), int(round(width / scale * th / tw)))
+        refined_score, refined_box = self._refine(image, box)
+        if refined_score:
+            score, box = refined_score, refined_box
+        bx, by, bw, bh = box
+        box = (max(0, bx), max(0, by), min(w, bx + bw) - max(0, bx), min(h, by + bh) - max(0, by))
+        found = score >= self.min_score
+        if found:
+            self._expected = bw / float(w)
+        return Detection(found, box, round(score, 3), "template", round(bw / tw, 4))
+
+
+class TemplateCache:
+    """TemplateDetector per template file, shared by the images of a batch"""
+
+    def __init__(self):
+        self._detectors = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+        with self._lock:
+            detector = self._detectors.get(key)
+            if detector is None:
+                detector = self._detectors[key] = TemplateDetector(path)
+            return detector
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Cached thumbnails for browsing a results folder.
+
+Thumbnails are decoded at reduced resolution (files.read_image_reduced),
+fitted to a square of `side` pixels, kept in memory and written to the
+per-user cache directory (user_cache_dir()/thumbs/<side>/, one JPEG per
+image named by a hash of its absolute path), so later sessions only decode
+files that are new or were rewritten since their thumbnail was made. The
+folders being browsed are never written to.
+"""
+
+import hashlib
+import logging
+import os
+import sys
+from pathlib import Path
+
+import cv2
+
+from .files import read_image, read_image_reduced, write_image
+from .preview import PreviewCache, file_key, fit_size
+
+THUMB_SIDE = 96
+THUMBS_DIR = "thumbs"
+
+log = logging.getLogger(__name__)
+
+
+def user_cache_dir():
+    """rmwatermark's per-user cache directory (not created here)"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or Path.home() / "AppData" / "Local"
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base) / "rmwatermark"
+
+
+class ThumbnailStore:
+    """Thread-safe get(path) -> small RGB thumbnail, memory and disk cached"""
+
+    def __init__(self, side=THUMB_SIDE, max_mb=32, cache_dir=None):
+        self.side = side
+        self.dir = Path(cache_dir or user_cache_dir()) / THUMBS_DIR / str(side)
+        self.memory = PreviewCache(max_mb)
+
+    def _thumb_path(self, path):
+        name = hashlib.blake2b(os.path.abspath(path).encode("utf-8"), digest_size=16).hexdigest()
+        return self.dir / (name + ".jpg")
+
+    def get(self, path):
+        """Thumbnail of path (RGB uint8), or None if it can't be decoded"""
+        key = file_key(path)
+        thumb = self.memory.get(key)
+        if thumb is not None:
+            return thumb
+
+        thumb_path = self._thumb_path(path)
+        try:
+            # Stale if the image was rewritten after its thumbnail
+            if os.stat(thumb_path).st_mtime_ns >= key[1]:
+                thumb = read_image(thumb_path)
+        except OSError:
+            pass
+
+        if thumb is None:
+            image = read_image_reduced(path, self.side, self.side)
+            if image is None:
+                return None
+            new_w, new_h, _ = fit_size(image.shape, self.side, self.side)
+            thumb = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+            try:
+                self.dir.mkdir(parents=True, exist_ok=True)
+                write_image(thumb_path, thumb)
+            except OSError as e:
+                log.warning("Cannot save thumbnail %s: %s", thumb_path, e)
+
+        self.memory.put(key, thumb, thumb.nbytes)
+        return thumb
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Tiled, memory-bounded inpainting.
+
+Very large crops (big manual selections, 50+ MP images) are split into
+equal-size overlapping tiles. Each tile is inpainted on its own and the
+results are blended back with linear feathering across the overlaps, so
+there are no visible seams. Tiles are independent of each other, so they
+can be handed to a thread pool (and, having the same shape, batched into
+one LaMa forward pass by lama_batch.BatchingInpainter).
+
+The tile size comes from a peak-memory budget and a rough bytes-per-pixel
+figure for the inpainting backend.
+"""
+
+import logging
+import math
+
+import numpy as np
+
+# Rough peak working memory per input pixel (fp32 activations for big-lama on
+# CPU; buffers for cv2.inpaint). Only used to turn a MB budget into a tile size.
+LAMA_BYTES_PER_PIXEL = 4096
+OPENCV_BYTES_PER_PIXEL = 64
+
+MIN_TILE = 256
+
+log = logging.getLogger(__name__)
+
+
+def tile_size_for_budget(budget_mb, bytes_per_pixel, tiles_in_flight=1):
+    """Largest tile side (multiple of 8) so tiles_in_flight tiles fit in budget_mb"""
+    pixels = budget_mb * 1024 * 1024 / (bytes_per_pixel * max(1, tiles_in_flight))
+    side = int(math.sqrt(pixels)) // 8 * 8
+    return max(MIN_TILE, side)
+
+
+def needs_tiling(bounds, budget_mb, bytes_per_pixel):
+    """True if inpainting bounds (x1, y1, x2, y2) in one go would exceed budget_mb"""
+    if not budget_mb:
+        return False
+    x1, y1, x2, y2 = bounds
+    return (x2 - x1) * (y2 - y1) * bytes_per_pixel > budget_mb * 1024 * 1024
+
+
+def _axis_starts(length, tile, overlap):
+    """Evenly spaced tile starts covering [0, length) with at least `overlap` overlap"""
+    if length <= tile:
+        return [0]
+    stride = tile - overlap
+    n = math.ceil((length - overlap) / stride)
+    return [round(i * (length - tile) / (n - 1)) for i in range(n)]
+
+
+def plan_tiles(bounds, mask, tile, overlap):
+    """
+    Tiles (x1, y1, x2, y2) in image coordinates covering bounds.
+    Tiles without any masked pixel are skipped - nothing to inpaint there.
+    """
+    bx1, by1, bx2, by2 = bounds
+    overlap = min(overlap, tile // 2)
+    tiles = []
+    for ty in _axis_starts(by2 - by1, tile, overlap):
+        for tx in _axis_starts(bx2 - bx1, tile, overlap):
+            x1, y1 = bx1 + tx, by1 + ty
+            x2, y2 = min(bx2, x1 + tile), min(by2, y1 + tile)
+            if mask[y1:y2, x1:x2].any():
+                tiles.append((x1, y1, x2, y2))
+    return tiles
+
+
+def _ramp(length, overlap, feather_start, feather_end):
+    """1-D blend weights: linear ramps on the edges that overlap a neighbour"""
+    weights = np.ones(length, dtype=np.float32)
+    n = min(overlap, length // 2)
+    if n > 0:
+        ramp = np.arange(1, n + 1, dtype=np.float32) / (n + 1)
+        if feather_start:
+            weights[:n] = ramp
+        if feather_end:
+            weights[-n:] = ramp[::-1]
+    return weights
+
+
+def tiled_inpaint(image, mask, bounds, inpaint_fn, tile, overlap, map_fn=map):
+    """
+    Inpaint image[bounds] tile by tile.
+
+    inpaint_fn(tile_img, tile_mask) -> RGB tile result (same size).
+    map_fn lets the caller run tiles in parallel (e.g. executor.map).
+    Returns the RGB result for the bounds area only.
+    """
+    bx1, by1, bx2, by2 = bounds
+    tiles = plan_tiles(bounds, mask, tile, overlap)
+    log.debug("🧩 Tiled inpainting: %d tiles of %dpx (overlap %dpx)", len(tiles), tile, overlap)
+
+    def run(t):
+        x1, y1, x2, y2 = t
+        return inpaint_fn(image[y1:y2, x1:x2], mask[y1:y2, x1:x2])
+
+    region = image[by1:by2, bx1:bx2]
+    acc = np.zeros(region.shape, dtype=np.float32)
+    weight_sum = np.zeros(region.shape[:2], dtype=np.float32)
+
+    for (x1, y1, x2, y2), result in zip(tiles, map_fn(run, tiles)):
+        # Feather only edges shared with a neighbouring tile, not the bounds edges
+        wy = _ramp(y2 - y1, overlap, y1 > by1, y2 < by2)
+        wx = _ramp(x2 - x1, overlap, x1 > bx1, x2 < bx2)
+        weights = np.outer(wy, wx)
+
+        ry1, rx1 = y1 - by1, x1 - bx1
+        acc[ry1:ry1 + (y2 - y1), rx1:rx1 + (x2 - x1)] += result.astype(np.float32) * weights[..., None]
+        weight_sum[ry1:ry1 + (y2 - y1), rx1:rx1 + (x2 - x1)] += weights
+
+    out = region.copy()
+    covered = weight_sum > 0
+    out[covered] = np.clip(acc[covered] / weight_sum[covered, None] + 0.5, 0, 255).astype(np.uint8)
+    return out
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Hit rate of detect_watermark on the bench's synthetic text watermarks"""
+
+import numpy as np
+import pytest
+
+from rmwatermark.bench import _iou, stamp_text, synthetic_image
+from rmwatermark.detect import detect_watermark
+
+SEEDS = range(20)
+
+
+@pytest.mark.parametrize("size", [(1280, 720), (1920, 1080), (4000, 3000)])
+def test_text_hit_rate(size):
+    # Background shapes merged into the text box once cost 4 of these at 4000x3000
+    misses = []
+    for seed in SEEDS:
+        image = synthetic_image(*size, np.random.default_rng(seed))
+        truth = stamp_text(image)
+        detection = detect_watermark(image)
+        if not (detection.found and _iou(detection.box, truth) >= 0.5):
+            misses.append(seed)
+    assert not misses
+
+
+@pytest.mark.parametrize("size", [(640, 480), (1280, 720), (1920, 1080)])
+def test_no_detection_on_clean_images(size):
+    found = [seed for seed in SEEDS
+             if detect_watermark(synthetic_image(*size, np.random.default_rng(1000 + seed))).found]
+    assert not found
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""EXIF orientation handling of jpeg_patch (run with: python -m pytest tests)"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from rmwatermark.files import read_image
+from rmwatermark.jpeg_patch import MODE_PATCHED, MODE_REENCODED, ORIENTATION_TAG, patch_jpeg, write_output
+
+
+def _source(tmp_path, width, height, orientation):
+    """A patchable JPEG (restart marker per MCU row) tagged with `orientation`"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    path = tmp_path / f"src_{width}x{height}_{orientation}.jpg"
+    Image.fromarray(pixels).save(path, "JPEG", quality=90, restart_marker_rows=1, exif=exif.tobytes())
+    return path
+
+
+def _edit(image):
+    """Paint a small box, the way removing a watermark changes a few rows"""
+    result = image.copy()
+    result[16:48, 16:80] = 128
+    return result, [(16, 48)]
+
+
+@pytest.mark.parametrize("size", [(400, 300), (320, 320)])
+def test_rotated_source_is_not_patched(tmp_path, size):
+    path = _source(tmp_path, *size, orientation=6)
+    image = read_image(path)
+    assert image.shape[:2] == (size[0], size[1])   # decoded upright
+    result, rows = _edit(image)
+    assert patch_jpeg(path.read_bytes(), result, rows) is None
+
+
+def test_rotated_source_reencodes_with_orientation_reset(tmp_path):
+    path = _source(tmp_path, 400, 300, orientation=6)
+    image = read_image(path)
+    result, rows = _edit(image)
+    out_path = tmp_path / "out.jpg"
+
+    assert write_output(str(out_path), result, str(path), rows) == MODE_REENCODED
+    with Image.open(out_path) as out:
+        assert out.getexif().get(ORIENTATION_TAG) == 1
+    assert read_image(out_path).shape == image.shape
+
+
+def test_upright_source_is_patched(tmp_path):
+    path = _source(tmp_path, 400, 300, orientation=1)
+    image = read_image(path)
+    result, rows = _edit(image)
+    out_path = tmp_path / "out.jpg"
+
+    assert write_output(str(out_path), result, str(path), rows) == MODE_PATCHED
+    with Image.open(io.BytesIO(out_path.read_bytes())) as out:
+        assert out.getexif().get(ORIENTATION_TAG) == 1
@@ -5,6 +5,11 @@ Chọn vùng bằng chuột → Xóa ngay!
 Uses LaMa (Large Mask Inpainting) deep learning model for high-quality results.
 """
 
+import logging
+import os
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import cv2
@@ -12,17 +17,43 @@ import numpy as np
 from pathlib import Path
 from PIL import Image, ImageTk, ImageDraw
 import threading
-
-# LaMa Deep Learning Model
-try:
-    from simple_lama_inpainting import SimpleLama
-    LAMA_AVAILABLE = True
-    simple_lama = SimpleLama()  # Initialize once
-    print("✅ LaMa model loaded successfully!")
-except ImportError:
-    LAMA_AVAILABLE = False
-    simple_lama = None
-    print("⚠️ LaMa not available, falling back to OpenCV inpainting")
+import itertools
+from collections import OrderedDict
+
+# LaMa Deep Learning Model - torch is imported lazily in a background thread
+from rmwatermark import model as lama_model
+from rmwatermark.batch import run_batch
+from rmwatermark.engine import LogoSettings, RemovalSettings, WatermarkEngine
+from rmwatermark.files import FolderIndex, list_images, read_image, read_image_reduced
+from rmwatermark.jpeg_patch import changed_rows, write_output
+from rmwatermark.metrics import setup_logging
+from rmwatermark.pipeline import DEFAULT_STAGE_THREADS, format_stage_stats
+from rmwatermark.prefetch import Prefetcher
+from rmwatermark.preview import PreviewCache, file_key, fit_preview, fit_size
+from rmwatermark.thumbnails import ThumbnailStore
+# Under the package logger, so setup_logging() / RMWATERMARK_LOG_LEVEL apply to the GUI too
+logger = logging.getLogger("rmwatermark.gui")
+
+# GUI position labels -> engine LOGO_POSITIONS
+LOGO_POSITION_KEYS = {
+    "Góc Trái Trên": "top-left",
+    "Góc Phải Trên": "top-right",
+    "Góc Trái Dưới": "bottom-left",
+    "Góc Phải Dưới": "bottom-right",
+    "Chính Giữa": "center",
+}
+
+
+# Images decoded ahead of the current one (next, previous)
+PREFETCH_NEXT = 2
+PREFETCH_PREV = 1
+
+# PhotoImages kept for redraws (Tk thread only, so never evicted by a worker)
+PHOTO_CACHE_SIZE = 16
+
+# Result thumbnails shown around the current one
+STRIP_SIZE = 5
+STRIP_THUMB = 64
 
 
 class WatermarkRemover:
@@ -50,23 +81,62 @@ class WatermarkRemover:
         self.auto_mode = tk.BooleanVar(value=True)
         self.inpaint_radius = tk.IntVar(value=20)
 
+        # Headless processing engine (shared by single-image and batch runs)
+        self.engine = WatermarkEngine()
+
+        # Preview pyramids and fitted previews, keyed by file and canvas size
+        self.previews = PreviewCache()
+        # Their PhotoImages, by the same display key - touched on the Tk thread only
+        self._photos = OrderedDict()
+        self._load_serial = 0
+        self._result_serial = itertools.count()
+        self._resize_jobs = {}
+
+        # Neighbouring images are decoded ahead of navigation
+        self._prefetch_canvas_size = (450, 500)
+        self.prefetcher = Prefetcher(lambda key, path: self._prefetch_load(key, path, self._prefetch_canvas_size))
+
+        # Results browser: incremental index of output/ and cached thumbnails
+        self.output_index = FolderIndex("output")
+        self.output_files = []
+        self.current_output_index = 0
+        self.thumbnails = ThumbnailStore(side=STRIP_THUMB)
+        self._strip_serial = 0
+
         self.setup_ui()
+
+        # Load LaMa only once the window is interactive
+        self.root.after(0, self.start_model_warmup)
         
         # Auto-load images from input folder on startup
         # Wait 500ms for UI to fully render before loading
         self.root.after(500, self.auto_load_input_folder)
 
+    def start_model_warmup(self):
+        """Report startup time and begin loading LaMa in the background"""
+        logger.debug("⏱️ Window ready in %.0f ms", (time.perf_counter() - _STARTUP_T0) * 1000)
+        lama_model.start_warmup()
+        self.update_model_status()
+
+    def update_model_status(self):
+        """Refresh the LaMa status label until loading has finished"""
+        status = lama_model.model_status()
+        if status == lama_model.STATUS_READY:
+            self.model_label.config(text="🧠 LaMa sẵn sàng")
+        elif status == lama_model.STATUS_FAILED:
+            self.model_label.config(text="⚠️ LaMa không khả dụng - dùng OpenCV")
+        else:
+            self.model_label.config(text="⏳ Đang tải LaMa...")
+            self.root.after(200, self.update_model_status)
+
     def auto_load_input_folder(self):
         """Automatically load images from 'input' folder on startup"""
         input_dir = Path("input")
         if input_dir.exists() and input_dir.is_dir():
-            unique_files = set()
-            for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp']:
-                unique_files.update(str(f) for f in input_dir.glob(ext))
-                unique_files.update(str(f) for f in input_dir.glob(ext.upper()))
+            unique_files = list_images(input_dir)
             
             if unique_files:
-                self.image_files = sorted(list(unique_files))
+                self.image_files = unique_files
                 self.current_index = 0
                 self.file_label.config(text=f"Đã load {len(self.image_files)} ảnh từ input/", fg='#4CAF50')
                 self.load_image()
@@ -88,6 +158,16 @@ class WatermarkRemover:
             fg='white'
         ).pack(side=tk.LEFT, padx=20, pady=10)
 
+        # LaMa model status indicator
+        self.model_label = tk.Label(
+            header,
+            text="",
+            font=('Arial', 9, 'bold'),
+            bg='#2196F3',
+            fg='white'
+        )
+        self.model_label.pack(side=tk.RIGHT, padx=20, pady=10)
+
         # Main area
         main = tk.Frame(self.root, bg='#f5f5f5')
         main.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
@@ -162,7 +242,7 @@ class WatermarkRemover:
 
         tk.Radiobutton(
             parent,
-            text="🤖 Tự động (góc trên trái)",
+            text="🤖 Tự động (4 góc + giữa ảnh)",
             variable=self.auto_mode,
             value=True,
             bg='white',
@@ -292,6 +372,11 @@ class WatermarkRemover:
         self.wm_angle = tk.IntVar(value=0)
         tk.Spinbox(opts_f, from_=-180, to=180, textvariable=self.wm_angle, width=4, font=('Arial', 8)).pack(side=tk.LEFT)
 
+        # Auto mode: look for the chosen logo itself before the text detection
+        self.wm_find_logo = tk.BooleanVar(value=False)
+        tk.Checkbutton(parent, text="🔍 Tìm logo này trong ảnh (tự động)", variable=self.wm_find_logo,
+                       bg='white', font=('Arial', 8)).pack(anchor=tk.W, padx=15)
+
         # Separator
         tk.Frame(parent, height=1, bg='#ddd').pack(fill=tk.X, padx=15, pady=8)
 
@@ -332,6 +417,24 @@ class WatermarkRemover:
             pady=6
         ).pack(fill=tk.X, padx=15, pady=3)
 
+        # Batch worker processes (each loads its own LaMa model)
+        workers_f = tk.Frame(parent, bg='white')
+        workers_f.pack(fill=tk.X, padx=15, pady=2)
+        tk.Label(workers_f, text="Số tiến trình:", bg='white', font=('Arial', 8)).pack(side=tk.LEFT)
+        self.batch_workers = tk.IntVar(value=1)
+        tk.Spinbox(workers_f, from_=1, to=os.cpu_count() or 1, textvariable=self.batch_workers, width=4, font=('Arial', 8)).pack(side=tk.LEFT, padx=5)
+
+        # JPEG patching only pays off for sources with restart markers (see rmwatermark/jpeg_patch.py);
+        # applies to "Lưu" as well as batch runs
+        self.jpeg_patch = tk.BooleanVar(value=True)
+        tk.Checkbutton(parent, text="Giữ khối JPEG gốc (chỉ ảnh có restart marker)", variable=self.jpeg_patch,
+                       bg='white', font=('Arial', 8)).pack(anchor=tk.W, padx=15)
+
+        # Resume: skip inputs output/ already has from an earlier run with the same settings
+        self.batch_resume = tk.BooleanVar(value=True)
+        tk.Checkbutton(parent, text="Bỏ qua ảnh đã xử lý ở lần trước", variable=self.batch_resume,
+                       bg='white', font=('Arial', 8)).pack(anchor=tk.W, padx=15)
+
         self.on_mode_change()
 
     def setup_preview(self, parent):
@@ -394,6 +497,7 @@ class WatermarkRemover:
             highlightthickness=0
         )
         self.original_canvas.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.original_canvas.bind("<Configure>", self.on_canvas_resize)
 
         # Bind mouse events
         self.original_canvas.bind("<ButtonPress-1>", self.on_mouse_press)
@@ -417,6 +521,7 @@ class WatermarkRemover:
             highlightthickness=0
         )
         self.result_canvas.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.result_canvas.bind("<Configure>", self.on_canvas_resize)
         
         # Result Navigation
         res_nav = tk.Frame(result_frame, bg='white')
@@ -432,6 +537,10 @@ class WatermarkRemover:
             bg='#607D8B', fg='white', relief=tk.FLAT, font=('Arial', 9)
         ).pack(side=tk.RIGHT, padx=10)
 
+        # Thumbnail strip of neighbouring results
+        self.strip_canvas = tk.Canvas(res_nav, height=STRIP_THUMB + 6, bg='white', highlightthickness=0)
+        self.strip_canvas.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
         # Progress
         self.progress_label = tk.Label(
             parent,
@@ -445,7 +554,7 @@ class WatermarkRemover:
     def on_mode_change(self):
         """Change mode"""
         if self.auto_mode.get():
-            self.instruction_label.config(text="Chế độ tự động sẽ xóa watermark ở góc trên trái")
+            self.instruction_label.config(text="Chế độ tự động tìm watermark ở 4 góc và dải giữa ảnh rồi xóa")
             self.selected_region = None
             if hasattr(self, 'original_canvas'):
                 self.original_canvas.config(cursor="")
@@ -470,16 +579,7 @@ class WatermarkRemover:
         """Select folder"""
         folder = filedialog.askdirectory(title="Chọn thư mục")
         if folder:
-            folder_path = Path(folder)
-            folder_path = Path(folder)
-            unique_files = set()
-            for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp']:
-                # On Windows, glob is case-insensitive, so *.jpg might match *.JPG
-                # We use a set to avoid duplicates
-                unique_files.update(str(f) for f in folder_path.glob(ext))
-                unique_files.update(str(f) for f in folder_path.glob(ext.upper()))
-            
-            self.image_files = sorted(list(unique_files))
+            self.image_files = list_images(folder)
             self.current_index = 0
             self.file_label.config(text=f"Đã chọn {len(self.image_files)} ảnh", fg='#4CAF50')
             self.load_image()
@@ -512,118 +612,40 @@ class WatermarkRemover:
         self.logo_btn.config(text="📂 Chọn Logo", bg='#EEEEEE')
         self.clear_logo_btn.config(state='disabled')
         
-    def _apply_new_watermark(self, image):
-        """Apply new logo watermark to image"""
-        if not self.new_logo_path:
-            return image
-            
-        try:
-            # Load logo
-            logo = Image.open(self.new_logo_path).convert("RGBA")
-            h_img, w_img = image.shape[:2]
-            
-            # 1. Remove White Background (if selected)
-            if self.wm_remove_bg.get():
-                datas = logo.getdata()
-                new_data = []
-                for item in datas:
-                    # Change all white (also shades of whites) to transparent
-                    if item[0] > 200 and item[1] > 200 and item[2] > 200:
-                        new_data.append((255, 255, 255, 0))
-                    else:
-                        new_data.append(item)
-                logo.putdata(new_data)
-                
-            # 2. Rotation
-            angle = self.wm_angle.get()
-            if angle != 0:
-                logo = logo.rotate(angle, expand=True, resample=Image.BICUBIC)
-            
-            # Calculate size
-            scale = self.wm_scale_val.get() / 100.0
-            
-            # Resize logo maintaining aspect ratio
-            logo_w, logo_h = logo.size
-            aspect = logo_w / logo_h
-            
-            # Target width based on image width
-            target_w = int(w_img * scale)
-            target_h = int(target_w / aspect)
-            
-            if target_w <= 0 or target_h <= 0: return image
-            
-            logo = logo.resize((target_w, target_h), Image.Resampling.LANCZOS)
-            
-            # Apply opacity
-            alpha = logo.split()[3]
-            opacity = self.wm_opacity_val.get() / 100.0
-            alpha = alpha.point(lambda p: int(p * opacity))
-            logo.putalpha(alpha)
-            
-            # Create overlay
-            overlay = Image.new('RGBA', (w_img, h_img), (0, 0, 0, 0))
-            
-            # 3. Tiling (Repeated Pattern)
-            if self.wm_tiled.get():
-                # Spacing
-                space_x = int(target_w * 0.5)
-                space_y = int(target_h * 0.5)
-                
-                for y in range(0, h_img, target_h + space_y):
-                    # Stagger rows for better look? (Optional, let's keep simple grid for now)
-                    offset = 0 if (y // (target_h + space_y)) % 2 == 0 else int(target_w/2)
-                    
-                    for x in range(-int(target_w/2), w_img, target_w + space_x):
-                        overlay.paste(logo, (x + offset, y), logo)
-                        
-            else:
-                # Normal Positioning
-                pos = self.wm_position.get()
-                padding = int(w_img * 0.02) # 2% padding
-                
-                if pos == "Góc Trái Trên":
-                    x, y = padding, padding
-                elif pos == "Góc Phải Trên":
-                    x, y = w_img - target_w - padding, padding
-                elif pos == "Góc Trái Dưới":
-                    x, y = padding, h_img - target_h - padding
-                elif pos == "Góc Phải Dưới":
-                    x, y = w_img - target_w - padding, h_img - target_h - padding
-                else: # Center
-                    x, y = (w_img - target_w) // 2, (h_img - target_h) // 2
-                    
-                overlay.paste(logo, (x, y), logo)
-            
-            # Composite
-            base_img = Image.fromarray(image)
-            base_img.paste(overlay, (0, 0), overlay)
-            
-            return np.array(base_img)
-            
-        except Exception as e:
-            print(f"Error applying watermark: {e}")
-            return image
+    def get_settings(self):
+        """Snapshot the current GUI controls into immutable engine settings (main thread only)"""
+        logo = None
+        if self.new_logo_path:
+            logo = LogoSettings(
+                path=self.new_logo_path,
+                position=LOGO_POSITION_KEYS.get(self.wm_position.get(), "center"),
+                scale=self.wm_scale_val.get(),
+                opacity=self.wm_opacity_val.get(),
+                tiled=self.wm_tiled.get(),
+                remove_bg=self.wm_remove_bg.get(),
+                angle=self.wm_angle.get(),
+            )
+        return RemovalSettings(
+            auto_mode=self.auto_mode.get(),
+            region=None if self.auto_mode.get() else self.selected_region,
+            inpaint_radius=self.inpaint_radius.get(),
+            logo=logo,
+            template=self.new_logo_path if self.new_logo_path and self.wm_find_logo.get() else None,
+        )
 
     # --- Result Navigation ---
     def _refresh_output_files(self):
-        """Scan output folder for images"""
-        output_dir = Path("output")
-        if not output_dir.exists():
-            self.output_files = []
-            return
-            
-        unique_files = set()
-        for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp']:
-            unique_files.update(str(f) for f in output_dir.glob(ext))
-            unique_files.update(str(f) for f in output_dir.glob(ext.upper()))
-            
-        self.output_files = sorted(list(unique_files))
+        """Bring the output folder index up to date (rescans only if the folder changed)"""
+        current = self.output_files[self.current_output_index] if self.output_files else None
+        self.output_index.refresh()
+        self.output_files = self.output_index.files
+        # Stay on the same file if entries were added or removed before it
+        if current is not None and self.output_files:
+            self.current_output_index = min(self.output_index.position(current), len(self.output_files) - 1)
 
     def prev_result(self):
         """Show previous result from output folder"""
         self._refresh_output_files()
-        if not hasattr(self, 'current_output_index'): self.current_output_index = 0
-            
         if self.output_files:
             self.current_output_index = (self.current_output_index - 1) % len(self.output_files)
             self._display_result_file()
@@ -631,71 +653,202 @@ class WatermarkRemover:
     def next_result(self):
         """Show next result from output folder"""
         self._refresh_output_files()
-        if not hasattr(self, 'current_output_index'): self.current_output_index = 0
-        
         if self.output_files:
             self.current_output_index = (self.current_output_index + 1) % len(self.output_files)
             self._display_result_file()
+
+    def show_result_at(self, index):
+        """Jump to a result from the thumbnail strip"""
+        if 0 <= index < len(self.output_files):
+            self.current_output_index = index
+            self._display_result_file()
             
     def _display_result_file(self):
         if not self.output_files: return
         
         path = self.output_files[self.current_output_index]
+        self._update_strip()
         try:
-             # Load with encoding support
-            stream = open(path, "rb")
-            bytes_data = bytearray(stream.read())
-            numpy_array = np.asarray(bytes_data, dtype=np.uint8)
-            image = cv2.imdecode(numpy_array, cv2.IMREAD_COLOR)
-            
+            key = file_key(path)
+        except OSError as e:
+            logger.warning("Error loading result: %s", e, exc_info=True)
+            return
+
+        # Already fitted to this canvas - no need to decode
+        if self.display_image(None, self.result_canvas, is_original=False, key=key):
+            return
+
+        # Only decode as much resolution as the canvas shows
+        canvas_w, canvas_h = self._canvas_size(self.result_canvas)
+        load = lambda key, path: read_image_reduced(path, canvas_w, canvas_h)
+        threading.Thread(target=self._load_thread, args=(path, key, self._show_result_file, load),
+                         daemon=True).start()
+
+    def _update_strip(self):
+        """Load the thumbnails around the current result off the UI thread, then draw them"""
+        self._strip_serial += 1
+        serial = self._strip_serial
+        first = max(0, min(self.current_output_index - STRIP_SIZE // 2, len(self.output_files) - STRIP_SIZE))
+        paths = list(enumerate(self.output_files[first:first + STRIP_SIZE], start=first))
+
+        def work():
+            thumbs = []
+            for index, path in paths:
+                try:
+                    thumbs.append((index, self.thumbnails.get(path)))
+                except Exception as e:
+                    logger.warning("Thumbnail error: %s: %s", path, e, exc_info=True)
+            if serial == self._strip_serial:
+                self.root.after(0, lambda: self._draw_strip(serial, thumbs))
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def _draw_strip(self, serial, thumbs):
+        if serial != self._strip_serial:
+            return
+        canvas = self.strip_canvas
+        canvas.delete("all")
+        photos = []
+        step = STRIP_THUMB + 6
+        x0 = max(0, (canvas.winfo_width() - step * len(thumbs)) // 2)
+        for slot, (index, thumb) in enumerate(thumbs):
+            x = x0 + slot * step + step // 2
+            tag = f"thumb{index}"
+            if index == self.current_output_index:
+                canvas.create_rectangle(x - step // 2 + 1, 1, x + step // 2 - 1, step - 1,
+                                        outline='#4CAF50', width=2, tags=tag)
+            if thumb is not None:
+                photo = ImageTk.PhotoImage(Image.fromarray(thumb))
+                photos.append(photo)
+                canvas.create_image(x, step // 2, image=photo, anchor=tk.CENTER, tags=tag)
+            canvas.tag_bind(tag, "<Button-1>", lambda e, i=index: self.show_result_at(i))
+        canvas.images = photos
+
+    def _show_result_file(self, path, key, image):
+        if image is None:
+            logger.warning("Error loading result: %s", path)
+            return
+        if self.output_files and self.output_files[self.current_output_index] == path:
+            self.display_image(image, self.result_canvas, is_original=False, key=key)
+            # Decoded at reduced size - re-decode rather than upscale on resize
+            self.result_canvas.shown = (None, False, key)
+
+    def _load_thread(self, path, key, on_loaded, load=None):
+        """Decode and build the preview pyramid off the UI thread"""
+        try:
+            if load is not None:
+                image = load(key, path)
+            else:
+                image = read_image(path)
             if image is not None:
-                image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                self.display_image(image_rgb, self.result_canvas, is_original=False)
+                self.previews.pyramid(key, image)
         except Exception as e:
-            print(f"Error loading result: {e}")
+            logger.warning("Error loading %s: %s", path, e, exc_info=True)
+            self.root.after(0, lambda: self.progress_label.config(text=f"⚠️ Không thể load ảnh: {Path(path).name}"))
+            image = None
+        self.root.after(0, lambda: on_loaded(path, key, image))
 
     def load_image(self):
         """Load image"""
         if not self.image_files:
             return
 
+        image_path = self.image_files[self.current_index]
         try:
-            image_path = self.image_files[self.current_index]
-            self.original_image = cv2.imread(image_path)
-            self.original_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2RGB)
-
-            self.display_image(self.original_image, self.original_canvas, is_original=True)
-            self.nav_label.config(text=f"Ảnh {self.current_index + 1}/{len(self.image_files)}")
-
-            # Clear result
-            self.result_canvas.delete("all")
-            self.result_image = None
-            self.selected_region = None
-
-        except Exception as e:
+            key = file_key(image_path)
+        except OSError as e:
             messagebox.showerror("Lỗi", f"Không thể load ảnh: {str(e)}")
-
-    def display_image(self, image, canvas, is_original=False):
-        """Display image"""
-        if image is None:
             return
 
-        canvas_width = canvas.winfo_width()
-        canvas_height = canvas.winfo_height()
+        self._load_serial += 1
+        serial = self._load_serial
+        self.original_image = None
+        self.nav_label.config(text=f"Ảnh {self.current_index + 1}/{len(self.image_files)}")
 
-        # Use larger default sizes for better initial display
-        if canvas_width <= 1:
-            canvas_width = 450
-        if canvas_height <= 1:
-            canvas_height = 500
-        
-        # Force update canvas to get actual size
-        canvas.update_idletasks()
+        # Clear result
+        self.result_canvas.delete("all")
+        self.result_canvas.shown = None
+        self.result_image = None
+        self.selected_region = None
+
+        # Workers can't ask Tk for the canvas size - snapshot it here
+        self._prefetch_canvas_size = self._canvas_size(self.original_canvas)
+
+        # Show a cached preview right away while the full image decodes
+        self.display_image(None, self.original_canvas, is_original=True, key=key)
+
+        def on_loaded(path, key, image):
+            if serial != self._load_serial:
+                return  # user already moved on
+            if image is None:
+                messagebox.showerror("Lỗi", f"Không thể load ảnh: {path}")
+                return
+            self.original_image = image
+            self.display_image(image, self.original_canvas, is_original=True, key=key)
+            p = self.prefetcher
+            logger.debug("⚡ Prefetch: %d hits, %d misses (%.0f%%)", p.hits, p.misses, p.hit_rate() * 100)
+
+        threading.Thread(target=self._load_thread, args=(image_path, key, on_loaded, self.prefetcher.get),
+                         daemon=True).start()
+        self.prefetch_neighbours()
+
+    def prefetch_neighbours(self):
+        """Decode and pre-render the next/previous images in the background"""
+        i = self.current_index
+        order = [i + d for d in range(1, PREFETCH_NEXT + 1)] + [i - d for d in range(1, PREFETCH_PREV + 1)]
+        entries = []
+        for j in sorted(order, key=lambda j: abs(j - i)):
+            if 0 <= j < len(self.image_files):
+                try:
+                    entries.append((file_key(self.image_files[j]), self.image_files[j]))
+                except OSError:
+                    pass
+        self.prefetcher.prefetch(entries)
+
+    def _prefetch_load(self, key, path, canvas_size):
+        """Prefetch worker: decode, build the pyramid and pre-render the fitted preview"""
+        image = read_image(path)
+        if image is None:
+            return None
+        levels = self.previews.pyramid(key, image)
+        new_w, new_h, scale = fit_size(image.shape, *canvas_size)
+        fitted = fit_preview(image, levels, new_w, new_h)
+        self.previews.put(("fitted", key) + canvas_size, (fitted, scale), fitted.nbytes)
+        return image
+
+    def display_image(self, image, canvas, is_original=False, key=None):
+        """
+        Display image fitted to canvas. With a key, the fitted preview is cached
+        and resized from the cached pyramid. image=None only shows a cached
+        preview; returns False if there is none.
+        """
+        canvas_width, canvas_height = self._canvas_size(canvas)
+
+        display_key = ("fitted", key, canvas_width, canvas_height)
+        entry = self._photos.get(display_key) if key is not None else None
+        if entry is None:
+            # Pre-rendered by the prefetcher?
+            fitted = self.previews.get(display_key) if key is not None else None
+            if fitted is not None:
+                resized, scale = fitted
+            elif image is None:
+                return False
+            else:
+                new_w, new_h, scale = fit_size(image.shape, canvas_width, canvas_height)
+                levels = self.previews.pyramid(key) if key is not None else None
+                resized = fit_preview(image, levels or [], new_w, new_h)
+                if key is not None:
+                    self.previews.put(display_key, (resized, scale), resized.nbytes)
+            new_h, new_w = resized.shape[:2]
+            entry = (ImageTk.PhotoImage(Image.fromarray(resized)), new_w, new_h, scale)
+            if key is not None:
+                self._photos[display_key] = entry
+                while len(self._photos) > PHOTO_CACHE_SIZE:
+                    self._photos.popitem(last=False)
+        else:
+            self._photos.move_to_end(display_key)
+        photo, new_w, new_h, scale = entry
 
-        h, w = image.shape[:2]
-        scale = min(canvas_width / w, canvas_height / h)
-        new_w, new_h = int(w * scale), int(h * scale)
-        
         # Calculate offset for centering
         offset_x = (canvas_width - new_w) // 2
         offset_y = (canvas_height - new_h) // 2
@@ -710,13 +863,42 @@ class WatermarkRemover:
         else:
             self.result_scale = scale
 
-        resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
-        pil_image = Image.fromarray(resized)
-        photo = ImageTk.PhotoImage(pil_image)
-
         canvas.delete("all")
         canvas.create_image(canvas_width // 2, canvas_height // 2, image=photo, anchor=tk.CENTER, tags="image")
         canvas.image = photo
+        # What to redraw when the canvas is resized
+        canvas.shown = (image, is_original, key)
+        return True
+
+    def _canvas_size(self, canvas):
+        canvas_width = canvas.winfo_width()
+        canvas_height = canvas.winfo_height()
+
+        # Use larger default sizes for better initial display
+        if canvas_width <= 1:
+            canvas_width = 450
+        if canvas_height <= 1:
+            canvas_height = 500
+        return canvas_width, canvas_height
+
+    def on_canvas_resize(self, event):
+        """Redraw the shown image at the new canvas size (debounced)"""
+        canvas = event.widget
+        job = self._resize_jobs.pop(canvas, None)
+        if job is not None:
+            self.root.after_cancel(job)
+
+        def redraw():
+            self._resize_jobs.pop(canvas, None)
+            shown = getattr(canvas, "shown", None)
+            if not shown:
+                return
+            image, is_original, key = shown
+            if not self.display_image(image, canvas, is_original=is_original, key=key) and not is_original:
+                # Result file shown from cache only - decode it for the new size
+                self._display_result_file()
+
+        self._resize_jobs[canvas] = self.root.after(150, redraw)
 
     def show_loading(self):
         """Show loading overlay"""
@@ -815,9 +997,8 @@ class WatermarkRemover:
         offset_x = getattr(self, 'original_offset_x', 0)
         offset_y = getattr(self, 'original_offset_y', 0)
 
-        # Debug print
-        print(f"Canvas click: start={self.start_point}, end={end_point}")
-        print(f"Image size: {w_orig}x{h_orig}, scale={scale:.2f}, offset=({offset_x},{offset_y})")
+        logger.debug("Canvas click: start=%s, end=%s", self.start_point, end_point)
+        logger.debug("Image size: %dx%d, scale=%.2f, offset=(%d,%d)", w_orig, h_orig, scale, offset_x, offset_y)
 
         # Convert canvas coords to image coords
         x1 = int((min(self.start_point[0], end_point[0]) - offset_x) / scale)
@@ -825,7 +1006,7 @@ class WatermarkRemover:
         x2 = int((max(self.start_point[0], end_point[0]) - offset_x) / scale)
         y2 = int((max(self.start_point[1], end_point[1]) - offset_y) / scale)
 
-        print(f"Before clamp: ({x1},{y1}) to ({x2},{y2})")
+        logger.debug("Before clamp: (%d,%d) to (%d,%d)", x1, y1, x2, y2)
 
         # Clamp to image bounds
         x1 = max(0, min(x1, w_orig - 1))
@@ -842,7 +1023,7 @@ class WatermarkRemover:
         width = x2 - x1
         height = y2 - y1
 
-        print(f"After clamp: ({x1},{y1}) size {width}x{height}")
+        logger.debug("After clamp: (%d,%d) size %dx%d", x1, y1, width, height)
 
         self.selected_region = (x1, y1, width, height)
         # Notify user of successful selection area
@@ -862,20 +1043,21 @@ class WatermarkRemover:
         self.show_loading()
         self.root.update()
 
-        thread = threading.Thread(target=self._process_thread)
+        settings = self.get_settings()
+        thread = threading.Thread(target=self._process_thread, args=(self.original_image, settings))
         thread.start()
 
-    def _process_thread(self):
+    def _process_thread(self, image, settings):
         """Process thread"""
         try:
-            result = self._remove_watermark_from_image(self.original_image)
-            
-            # Apply new watermark if selected
-            result = self._apply_new_watermark(result)
+            # Remove watermark and apply new watermark if selected
+            result = self.engine.process(image, settings).image
             
             self.result_image = result
+            key = ("result", next(self._result_serial))
+            self.previews.pyramid(key, result)
 
-            self.root.after(0, lambda: self.display_image(result, self.result_canvas, is_original=False))
+            self.root.after(0, lambda: self.display_image(result, self.result_canvas, is_original=False, key=key))
             self.root.after(0, lambda: self.progress_label.config(text="✅ Hoàn thành!"))
 
         except Exception as e:
@@ -885,415 +1067,6 @@ class WatermarkRemover:
             self.root.after(0, self.hide_loading)
             self.root.after(0, lambda: self.root.after(2000, lambda: self.progress_label.config(text="")))
 
-    def _detect_watermark_bounds(self, image):
-        """
-        Smart heuristic to detect 'MI VIETNAM.VN' style watermarks (white text).
-        Returns: (success_bool, (x, y, w, h))
-        """
-        h, w = image.shape[:2]
-        
-        # Focus on top-left quadrant where logo typically is
-        # Scan slightly wider area: 40% width, 15% height
-        scan_w = int(w * 0.4)
-        scan_h = int(h * 0.15)
-        
-        roi = image[0:scan_h, 0:scan_w]
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(roi, cv2.COLOR_RGB2GRAY)
-        
-        # 1. High-Pass Filter or Adaptive Threshold to find text edges
-        # The watermark is usually white text with some shadow or contrast
-        # Use Morphological Gradient to find edges
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-        gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, kernel)
-        
-        # Threshold to get strong edges
-        _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-        
-        # 2. Connect horizontal components (letters -> words)
-        # Use a wide kernel to connect "M I V I E T..."
-        connect_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (15, 3))
-        connected = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, connect_kernel)
-        
-        # 3. Find contours
-        contours, _ = cv2.findContours(connected, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        possible_regions = []
-        for cnt in contours:
-            x, y, cw, ch = cv2.boundingRect(cnt)
-            
-            # Filter noise
-            if cw < 30 or ch < 10: continue
-            
-            # Aspect ratio check: Watermark is usually wide (text)
-            aspect = cw / float(ch)
-            if aspect < 2.0: continue # Likely not our long text URL
-            
-            possible_regions.append((x, y, cw, ch))
-            
-        if not possible_regions:
-            return False, (0, 0, 0, 0)
-            
-        # 4. Merge regions (in case "MI" and "VIETNAM" are separated)
-        # Find the bounding box of all valid regions
-        min_x = min(r[0] for r in possible_regions)
-        min_y = min(r[1] for r in possible_regions)
-        max_x = max(r[0] + r[2] for r in possible_regions)
-        max_y = max(r[1] + r[3] for r in possible_regions)
-        
-        # Pad the result slightly
-        pad_x = 10
-        pad_y = 5
-        
-        final_x = max(0, min_x - pad_x)
-        final_y = max(0, min_y - pad_y)
-        final_w = (max_x - min_x) + pad_x * 2
-        final_h = (max_y - min_y) + pad_y * 2
-        
-        # Safety check: Region shouldn't be too huge (e.g. false positive complex background)
-        if final_w > scan_w * 0.9 or final_h > scan_h * 0.8:
-            return False, (0, 0, 0, 0)
-            
-        return True, (final_x, final_y, final_w, final_h)
-
-    def _remove_watermark_from_image(self, image):
-        """
-        LaMa Deep Learning Watermark Removal.
-        Uses mirror padding for boundary safety and aggressive dilation.
-        """
-        h, w = image.shape[:2]
-
-        # Determine watermark region
-        if self.auto_mode.get():
-            # AI / Smart Detection System
-            detection_success, (dx, dy, dw, dh) = self._detect_watermark_bounds(image)
-            
-            if detection_success:
-                x, y, wm_w, wm_h = dx, dy, dw, dh
-                print(f"🎯 AI Detection matched: {wm_w}x{wm_h} at ({x},{y})")
-            else:
-                # Fallback to standard region if detection fails
-                x, y = 0, 0
-                wm_w = int(w * 0.28)
-                wm_h = int(h * 0.065)
-                print(f"⚠️ AI Detection failed, using fallback: {wm_w}x{wm_h} at ({x},{y})")
-        else:
-            x, y, wm_w, wm_h = self.selected_region
-            print(f"👆 Manual selection: {wm_w}x{wm_h} at ({x},{y})")
-
-        # Force expansion to edges if close - ONLY for auto mode
-        # For manual mode, respect the exact selection
-        if self.auto_mode.get():
-            edge_snap = 10
-            if x < edge_snap: 
-                wm_w += x
-                x = 0
-            if y < edge_snap:
-                wm_h += y
-                y = 0
-
-        print(f"🔧 Final region to remove: x={x}, y={y}, w={wm_w}, h={wm_h}")
-
-        # Create binary mask (white = area to inpaint)
-        mask = np.zeros((h, w), dtype=np.uint8)
-        mask[y:y+wm_h, x:x+wm_w] = 255
-        
-        # Dilation for coverage - lighter for manual mode to avoid affecting surrounding content
-        if self.auto_mode.get():
-            # Aggressive dilation for auto detection
-            kernel = np.ones((9, 9), np.uint8)
-            mask = cv2.dilate(mask, kernel, iterations=2)
-        else:
-            # Moderate dilation for manual selection - enough to cover watermark edges
-            kernel = np.ones((5, 5), np.uint8)
-            mask = cv2.dilate(mask, kernel, iterations=2)
-
-        print(f"✅ Mask created with {np.sum(mask > 0)} pixels to inpaint")
-
-        # Use LaMa if available
-        if LAMA_AVAILABLE and simple_lama is not None:
-            try:
-                print("🚀 Using LaMa model for inpainting...")
-                
-                # For efficiency, crop around watermark with large context
-                pad = 150  # Large padding for better context
-                
-                # Calculate crop bounds with padding
-                crop_x1 = max(0, x - pad)
-                crop_y1 = max(0, y - pad)
-                crop_x2 = min(w, x + wm_w + pad)
-                crop_y2 = min(h, y + wm_h + pad)
-                
-                print(f"📦 Crop region: ({crop_x1},{crop_y1}) to ({crop_x2},{crop_y2})")
-                
-                # Crop image and mask
-                crop_img = image[crop_y1:crop_y2, crop_x1:crop_x2].copy()
-                crop_mask = mask[crop_y1:crop_y2, crop_x1:crop_x2].copy()
-                
-                print(f"📐 Crop size: {crop_img.shape}, Mask white pixels: {np.sum(crop_mask > 0)}")
-                
-                # Run LaMa inpainting
-                pil_img = Image.fromarray(crop_img)
-                pil_mask = Image.fromarray(crop_mask)
-                
-                print("⏳ Running LaMa inpainting...")
-                result_pil = simple_lama(pil_img, pil_mask)
-                result_crop = np.array(result_pil)
-                print(f"✅ LaMa done! Result shape: {result_crop.shape}")
-                
-                # Handle size mismatch
-                if result_crop.shape[:2] != crop_img.shape[:2]:
-                    result_crop = cv2.resize(result_crop, (crop_img.shape[1], crop_img.shape[0]))
-                
-                # Create final result
-                final_result = image.copy()
-                
-                # Calculate where the watermark region is within the crop
-                wm_in_crop_x = x - crop_x1
-                wm_in_crop_y = y - crop_y1
-                
-                # Extract just the watermark region from the inpainted result
-                # Add small padding for smoother edges
-                pad_blend = 5
-                blend_x1 = max(0, wm_in_crop_x - pad_blend)
-                blend_y1 = max(0, wm_in_crop_y - pad_blend)
-                blend_x2 = min(result_crop.shape[1], wm_in_crop_x + wm_w + pad_blend)
-                blend_y2 = min(result_crop.shape[0], wm_in_crop_y + wm_h + pad_blend)
-                
-                # Get the region to paste
-                inpainted_region = result_crop[blend_y1:blend_y2, blend_x1:blend_x2]
-                
-                # Calculate destination coordinates
-                dest_x1 = crop_x1 + blend_x1
-                dest_y1 = crop_y1 + blend_y1
-                dest_x2 = dest_x1 + inpainted_region.shape[1]
-                dest_y2 = dest_y1 + inpainted_region.shape[0]
-                
-                # Paste the inpainted region
-                final_result[dest_y1:dest_y2, dest_x1:dest_x2] = inpainted_region
-                
-                print(f"📍 Pasted region: ({dest_x1},{dest_y1}) to ({dest_x2},{dest_y2})")
-                print("🎉 Watermark removal complete!")
-                return final_result
-                
-            except Exception as e:
-                print(f"❌ LaMa error: {e}")
-                import traceback
-                traceback.print_exc()
-        
-        # Fallback to OpenCV
-        image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        radius = self.inpaint_radius.get()
-        result = cv2.inpaint(image_bgr, mask, radius, cv2.INPAINT_NS)
-        return cv2.cvtColor(result, cv2.COLOR_BGR2RGB)
-
-    def _create_watermark_mask(self, image_bgr, x, y, region_w, region_h):
-        """
-        Create watermark mask - simplified approach for reliable removal.
-        Uses full region with feathered edges for natural blending.
-        """
-        h, w = image_bgr.shape[:2]
-        
-        # Create full region mask (more reliable than detection)
-        mask = np.zeros((h, w), dtype=np.uint8)
-        
-        # Fill the watermark region completely
-        mask[y:y+region_h, x:x+region_w] = 255
-        
-        # Create feathered edges for smooth blending (only at non-image-edge boundaries)
-        feather_size = max(5, min(region_w, region_h) // 10)
-        
-        # Only feather interior edges, not edges touching image boundary
-        roi_mask = mask[y:y+region_h, x:x+region_w].copy()
-        
-        # Create gradient at edges that don't touch image boundary
-        for i in range(feather_size):
-            alpha = int(255 * (i + 1) / feather_size)
-            # Only apply feathering on edges not at image boundary
-            # Bottom edge (if not at image bottom)
-            if y + region_h < h:
-                roi_mask[-(i+1), :] = min(roi_mask[-(i+1), 0], alpha)
-            # Right edge (if not at image right)
-            if x + region_w < w:
-                roi_mask[:, -(i+1)] = np.minimum(roi_mask[:, -(i+1)], alpha)
-        
-        mask[y:y+region_h, x:x+region_w] = roi_mask
-        
-        return mask
-
-    def _pyramid_inpaint(self, image, mask, x, y, region_w, region_h):
-        """Multi-scale pyramid inpainting for structure preservation"""
-        result = image.copy()
-        radius = self.inpaint_radius.get()
-        
-        # Build Gaussian pyramid (3 levels)
-        num_levels = 3
-        img_pyramid = [result.copy()]
-        mask_pyramid = [mask.copy()]
-        
-        for i in range(num_levels - 1):
-            img_pyramid.append(cv2.pyrDown(img_pyramid[-1]))
-            mask_pyramid.append(cv2.pyrDown(mask_pyramid[-1]))
-            # Ensure mask stays binary
-            mask_pyramid[-1] = (mask_pyramid[-1] > 127).astype(np.uint8) * 255
-        
-        # Inpaint from coarsest to finest level
-        for level in range(num_levels - 1, -1, -1):
-            img = img_pyramid[level]
-            msk = mask_pyramid[level]
-            
-            # Use appropriate radius for each level
-            level_radius = max(3, radius // (2 ** level))
-            
-            # Inpaint at this level
-            img = cv2.inpaint(img, msk, level_radius, cv2.INPAINT_NS)
-            
-            # Upsample if not at finest level
-            if level > 0:
-                upsampled = cv2.pyrUp(img)
-                # Match size to finer level
-                target_size = img_pyramid[level - 1].shape[:2][::-1]
-                upsampled = cv2.resize(upsampled, target_size)
-                
-                # Blend upsampled with original where known
-                fine_mask = mask_pyramid[level - 1]
-                fine_mask_3c = np.stack([fine_mask] * 3, axis=-1) / 255.0
-                img_pyramid[level - 1] = (
-                    upsampled * fine_mask_3c + 
-                    img_pyramid[level - 1] * (1 - fine_mask_3c)
-                ).astype(np.uint8)
-            else:
-                result = img
-        
-        return result
-
-    def _texture_synthesis_refinement(self, result, original, mask, x, y, region_w, region_h):
-        """Patch-based texture synthesis for natural texture restoration"""
-        h, w = result.shape[:2]
-        
-        # Find best texture source regions
-        patch_size = max(16, min(region_w, region_h) // 4)
-        
-        # Sample texture from surrounding areas
-        source_regions = []
-        
-        # Below
-        if y + region_h + patch_size < h:
-            source_regions.append(original[y+region_h:y+region_h+patch_size*2, x:x+region_w])
-        # Right
-        if x + region_w + patch_size < w:
-            source_regions.append(original[y:y+region_h, x+region_w:x+region_w+patch_size*2])
-        # Above
-        if y - patch_size*2 >= 0:
-            source_regions.append(original[y-patch_size*2:y, x:x+region_w])
-        # Left
-        if x - patch_size*2 >= 0:
-            source_regions.append(original[y:y+region_h, x-patch_size*2:x])
-        
-        if not source_regions:
-            return result
-        
-        # Find source with most similar texture to inpainted region
-        roi_result = result[y:y+region_h, x:x+region_w]
-        
-        best_source = None
-        best_score = float('inf')
-        
-        for src in source_regions:
-            if src.size == 0 or src.shape[0] < 10 or src.shape[1] < 10:
-                continue
-            # Compare using gradient histogram (texture measure)
-            src_gray = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
-            roi_gray = cv2.cvtColor(roi_result, cv2.COLOR_BGR2GRAY)
-            
-            src_grad = cv2.Laplacian(src_gray, cv2.CV_64F)
-            roi_grad = cv2.Laplacian(cv2.resize(roi_gray, (src_gray.shape[1], src_gray.shape[0])), cv2.CV_64F)
-            
-            score = np.abs(np.std(src_grad) - np.std(roi_grad))
-            if score < best_score:
-                best_score = score
-                best_source = src
-        
-        if best_source is None:
-            return result
-        
-        # Apply texture transfer using color transfer technique
-        try:
-            # Resize source to match ROI
-            source_resized = cv2.resize(best_source, (region_w, region_h))
-            
-            # Convert to LAB for color matching
-            roi_lab = cv2.cvtColor(roi_result, cv2.COLOR_BGR2LAB).astype(np.float32)
-            src_lab = cv2.cvtColor(source_resized, cv2.COLOR_BGR2LAB).astype(np.float32)
-            
-            # Match mean and std of L channel (luminance) only for texture
-            # Keep color from inpainted result
-            for i in [1, 2]:  # Only a and b channels
-                src_mean = np.mean(src_lab[:, :, i])
-                src_std = np.std(src_lab[:, :, i])
-                roi_mean = np.mean(roi_lab[:, :, i])
-                roi_std = np.std(roi_lab[:, :, i])
-                
-                if src_std > 0:
-                    roi_lab[:, :, i] = (roi_lab[:, :, i] - roi_mean) * (src_std / max(roi_std, 1)) + src_mean
-            
-            roi_lab = np.clip(roi_lab, 0, 255).astype(np.uint8)
-            refined_roi = cv2.cvtColor(roi_lab, cv2.COLOR_LAB2BGR)
-            
-            # Blend refined texture with inpainted result
-            # Use mask to only apply to watermark areas
-            roi_mask = mask[y:y+region_h, x:x+region_w]
-            roi_mask_3c = np.stack([roi_mask / 255.0] * 3, axis=-1)
-            
-            blended = (refined_roi * roi_mask_3c * 0.3 + roi_result * (1 - roi_mask_3c * 0.3)).astype(np.uint8)
-            result[y:y+region_h, x:x+region_w] = blended
-            
-        except Exception:
-            pass
-        
-        return result
-
-    def _seamless_blend(self, result, original, x, y, region_w, region_h):
-        """Final seamless blending at region boundaries"""
-        h, w = result.shape[:2]
-        
-        # Create feathered edge mask
-        edge_width = max(8, min(region_w, region_h) // 8)
-        
-        # Expand region slightly for blending
-        bx = max(0, x - edge_width)
-        by = max(0, y - edge_width)
-        bw = min(w - bx, region_w + edge_width * 2)
-        bh = min(h - by, region_h + edge_width * 2)
-        
-        # Create gradient mask
-        mask = np.zeros((bh, bw), dtype=np.float32)
-        
-        # Calculate relative position of watermark region within blend region
-        inner_x = x - bx
-        inner_y = y - by
-        
-        # Fill inner region with 1.0
-        if inner_y + region_h <= bh and inner_x + region_w <= bw:
-            mask[inner_y:inner_y+region_h, inner_x:inner_x+region_w] = 1.0
-        
-        # Apply Gaussian blur for smooth transition
-        mask = cv2.GaussianBlur(mask, (edge_width * 2 + 1, edge_width * 2 + 1), edge_width / 2)
-        
-        # Blend result with original at boundaries
-        mask_3c = np.stack([mask] * 3, axis=-1)
-        
-        blend_roi_result = result[by:by+bh, bx:bx+bw]
-        blend_roi_orig = original[by:by+bh, bx:bx+bw]
-        
-        blended = (blend_roi_result * mask_3c + blend_roi_orig * (1 - mask_3c)).astype(np.uint8)
-        
-        result = result.copy()
-        result[by:by+bh, bx:bx+bw] = blended
-        
-        return result
-
     def save_image(self):
         """Save image to output folder"""
         if self.result_image is None:
@@ -1313,9 +1086,14 @@ class WatermarkRemover:
 
             save_path = output_dir / filename
 
-            # Save image
-            image_bgr = cv2.cvtColor(self.result_image, cv2.COLOR_RGB2BGR)
-            cv2.imwrite(str(save_path), image_bgr)
+            # Save image - with JPEG patching on, JPEG sources keep their untouched blocks as they are
+            if self.jpeg_patch.get() and self.image_files and self.original_image is not None:
+                source = self.image_files[self.current_index]
+                write_output(save_path, self.result_image, source, changed_rows(self.original_image, self.result_image))
+            else:
+                image_bgr = cv2.cvtColor(self.result_image, cv2.COLOR_RGB2BGR)
+                cv2.imwrite(str(save_path), image_bgr)
+            self.output_index.add(save_path)
 
             messagebox.showinfo("Thành công", f"Đã lưu vào:\noutput/{filename}")
         except Exception as e:
@@ -1335,65 +1113,60 @@ class WatermarkRemover:
         output_folder = Path('output')
         output_folder.mkdir(exist_ok=True)
 
-        thread = threading.Thread(target=self._batch_thread, args=(str(output_folder),))
+        settings = self.get_settings()
+        workers = max(1, self.batch_workers.get())
+        thread = threading.Thread(target=self._batch_thread, args=(str(output_folder), list(self.image_files), settings, workers),
+                                  kwargs={"jpeg_patch": self.jpeg_patch.get(), "resume": self.batch_resume.get()})
         thread.start()
 
-    def _batch_thread(self, output_folder):
+    def _batch_thread(self, output_folder, image_files, settings, workers=1, jpeg_patch=True, resume=True):
         """Batch thread"""
-        total = len(self.image_files)
-        success = 0
-
-        for i, image_path in enumerate(self.image_files):
-            try:
-                self.root.after(0, lambda idx=i, t=total: self.progress_label.config(
-                    text=f"⏳ Đang xử lý: {idx + 1}/{t}"
-                ))
-
-                image = cv2.imread(image_path)
-                image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-                # Use current image as reference
-                # Update UI to show current processing image
-                self.current_index = i
-                
-                # Update display safely in main thread
-                self.root.after(0, lambda img=image_rgb: self.display_image(img, self.original_canvas, is_original=True))
-                self.root.after(0, lambda txt=f"Ảnh {i+1}/{total}": self.nav_label.config(text=txt))
-                
-                # Hack: Update original_image for processing context (if needed by modifiers)
-                old_image = self.original_image
-                self.original_image = image_rgb
-                
-                result_rgb = self._remove_watermark_from_image(image_rgb)
-                
-                # Apply new watermark if selected
-                result_rgb = self._apply_new_watermark(result_rgb)
-                
-                self.original_image = old_image # Restore or keep? Actually better to update it to current if we want to support "stop" later.
-                # But for now, just keep logic simple
-                
-                # Update result display
-                self.root.after(0, lambda res=result_rgb: self.display_image(res, self.result_canvas, is_original=False))
-
-                result_bgr = cv2.cvtColor(result_rgb, cv2.COLOR_RGB2BGR)
-
-                filename = Path(image_path).name
-                output_path = Path(output_folder) / filename
-                cv2.imwrite(str(output_path), result_bgr)
-
-                success += 1
-
-            except Exception as e:
-                print(f"Error: {e}")
+        total = len(image_files)
+        self.root.after(0, lambda: self.progress_label.config(text=f"⏳ Đang xử lý: 0/{total}"))
+
+        def on_progress(done, total, item):
+            self.root.after(0, lambda: self.progress_label.config(text=f"⏳ Đang xử lý: {done}/{total}"))
+            if not item.ok:
+                return
+            self.output_index.add(item.output_path)
+
+            # Update display safely in main thread
+            # (multi-process runs only send the result back, not the decoded input)
+            self.current_index = item.index
+            if item.image is not None:
+                key = file_key(item.path)
+                self.previews.pyramid(key, item.image)
+                self.root.after(0, lambda img=item.image, k=key: self.display_image(img, self.original_canvas, is_original=True, key=k))
+            self.root.after(0, lambda txt=f"Ảnh {item.index + 1}/{total}": self.nav_label.config(text=txt))
+            key = file_key(item.output_path)
+            self.previews.pyramid(key, item.result.image)
+            self.root.after(0, lambda res=item.result.image, k=key: self.display_image(res, self.result_canvas, is_original=False, key=k))
+
+        # Single process: overlap decode/inference/encode with the streaming pipeline
+        stage_threads = DEFAULT_STAGE_THREADS if workers == 1 else None
+        summary = run_batch(image_files, output_folder, settings, engine=self.engine, on_progress=on_progress,
+                            workers=workers, stage_threads=stage_threads, jpeg_patch=jpeg_patch, resume=resume)
+        success = summary.success
+        if summary.stage_stats:
+            logger.info("%s", format_stage_stats(summary.stage_stats))
+
+        cache_info = ""
+        if summary.detection_hits or summary.detection_misses:
+            cache_info = f"\nNhận diện dùng lại: {summary.detection_hits}, chạy lại: {summary.detection_misses}"
+        if summary.skipped:
+            cache_info += (f"\nBỏ qua {summary.skipped} ảnh đã xử lý trước đó "
+                           f"(bỏ chọn \"Bỏ qua ảnh đã xử lý\" để làm lại)")
 
         self.root.after(0, lambda: self.progress_label.config(text=f"✅ Hoàn thành: {success}/{total} ảnh"))
         self.root.after(0, lambda: messagebox.showinfo(
             "Hoàn thành",
-            f"Đã xử lý {success}/{total} ảnh!\n\nLưu tại: output/"
+            f"Đã xử lý {success}/{total} ảnh!{cache_info}\n\nLưu tại: output/"
         ))
 
 
 def main():
+    # Engine messages: RMWATERMARK_LOG_LEVEL=debug shows every step
+    setup_logging()
     root = tk.Tk()
     app = WatermarkRemover(root)
     root.mainloop()